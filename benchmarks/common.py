@@ -0,0 +1,306 @@
+# part of skyflash
+# shared tools of the benchmarks: synthetic images & fixtures, timing, peak
+# memory and the baselines to catch the regressions
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tarfile
+import platform
+import tempfile
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the benchmarks runs from a checkout, not from a installed skyflash
+repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repoRoot not in sys.path:
+    sys.path.insert(0, repoRoot)
+
+# version of the baseline files
+baselineVersion = 1
+
+# chunk size of the synthetic images, data or hole
+imageChunkSize = 1024 * 1024
+
+# a slower run than the baseline by this fraction (or a bigger peak memory)
+# is a regression
+defaultThreshold = 0.15
+
+def makeImage(path, size, density=0.3, seed=1):
+    '''Write a synthetic Skybian like image: a sparse file of size bytes with
+    a fraction (density) of it's 1MB chunks holding data, the rest are holes;
+    the data is half random and half text like, so it compress ~2:1 like a
+    real root filesystem, the seed makes it repeatable'''
+
+    rng = random.Random(seed)
+    count = (size + imageChunkSize - 1) // imageChunkSize
+    used = sorted(rng.sample(range(count), max(1, int(count * density))))
+    filler = b"skybian benchmark data block\n" * (imageChunkSize // 60 + 1)
+
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        for index in used:
+            length = min(imageChunkSize, size - index * imageChunkSize)
+            half = length // 2
+            f.seek(index * imageChunkSize)
+            f.write(rng.getrandbits(half * 8).to_bytes(half, 'little'))
+            f.write(filler[:length - half])
+
+    return path
+
+def makeArchive(image, path, digest, algorithm="sha1"):
+    '''Pack the image and it's checksum file on a .tar.gz like a Skybian
+    release (the fast gz level, the creation is not what we measure)'''
+
+    name = os.path.basename(image)
+    sums = image + "." + algorithm
+    with open(sums, 'wt') as f:
+        f.write("{}  {}\n".format(digest, name))
+
+    with tarfile.open(path, 'w:gz', compresslevel=1) as tar:
+        tar.add(image, name)
+        tar.add(sums, os.path.basename(sums))
+
+    os.unlink(sums)
+    return path
+
+def makeSysfs(folder, disks=32, partitions=2):
+    '''Build a fake sysfs block tree and a mountinfo with disks whole disks
+    (fixed disks, usb & mmc cards, loop devices...) with a few partitions
+    each, half of them mounted; return (sysfs, mountinfo)'''
+
+    sysfs = os.path.join(folder, "sys")
+    mountinfo = os.path.join(folder, "mountinfo")
+    kinds = [("sd", "0", "/usb1/1-1"), ("mmcblk", "0", "/mmc0"), ("nvme", "0", "/pci0000"), ("loop", "0", "")]
+    lines = []
+
+    def write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wt') as f:
+            f.write(data + "\n")
+
+    for index in range(disks):
+        (prefix, removable, device) = kinds[index % len(kinds)]
+        name = "{}{}".format(prefix, index)
+        sysdir = os.path.join(sysfs, "block", name)
+        major = 8 + index
+
+        write(os.path.join(sysdir, "dev"), "{}:0".format(major))
+        write(os.path.join(sysdir, "size"), str(15523840 + index))
+        write(os.path.join(sysdir, "removable"), "1" if prefix == "sd" else removable)
+        write(os.path.join(sysdir, "diskseq"), str(index + 1))
+        if device:
+            target = os.path.join(sysfs, "devices" + device, name)
+            write(os.path.join(target, "model"), "Bench Card {}".format(index))
+            os.symlink(target, os.path.join(sysdir, "device"))
+        else:
+            write(os.path.join(sysdir, "loop", "backing_file"), "/tmp/{}.img".format(name))
+
+        for part in range(1, partitions + 1):
+            write(os.path.join(sysdir, "{}{}".format(name, part), "partition"), str(part))
+            write(os.path.join(sysdir, "{}{}".format(name, part), "dev"), "{}:{}".format(major, part))
+            if part % 2:
+                lines.append("{0} 1 {1}:{2} / /media/bench/{3}\\040part{2} rw - vfat /dev/{3}{2} rw".format(
+                    100 + index * 10 + part, major, part, name))
+
+    with open(mountinfo, 'wt') as f:
+        f.write("\n".join(lines) + "\n")
+
+    return (sysfs, mountinfo)
+
+def workFolder(parent=None):
+    '''A scratch folder for the fixtures, on parent if given (the filesystem
+    matters: tmpfs, ext4 & btrfs clone & copy at very different speeds)'''
+
+    return tempfile.mkdtemp(prefix="skyflash-bench-", dir=parent)
+
+# a peak memory bigger than the baseline by less than this is not a regression
+# whatever the threshold, the small ones are noisy
+memorySlack = 8 * 1000 * 1000
+
+# runs a python script like the interpreter does, but writes the peak memory
+# of the process to a file when it exits (the rusage of a child counts the
+# memory of the parent at the spawn, useless for a small helper)
+scriptRunner = """
+import os, sys, runpy, atexit
+
+def peak(path=sys.argv[1]):
+    try:
+        with open("/proc/self/status", "rt") as f, open(path, "wt") as out:
+            out.write("".join(line.split()[1] for line in f if line.startswith("VmHWM:")))
+    except OSError:
+        pass
+
+atexit.register(peak)
+sys.argv = sys.argv[2:]
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+def procStatus(field):
+    '''A memory field of /proc/self/status in bytes, None if not on linux'''
+
+    try:
+        with open("/proc/self/status", 'rt') as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+def resetPeak():
+    '''Reset the peak memory of the process (VmHWM), only on linux; return
+    True if it was reset'''
+
+    try:
+        with open("/proc/self/clear_refs", 'wt') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peakMemory():
+    '''Peak resident memory of the process in bytes, since resetPeak()'''
+
+    peak = procStatus("VmHWM")
+    if peak is not None:
+        return peak
+
+    if resource is None:
+        return 0
+
+    return rusagePeak(resource.getrusage(resource.RUSAGE_SELF))
+
+def timeIt(fn, *args):
+    '''Run fn(*args) and return (seconds, result, peak memory in bytes), the
+    peak is the growth over the memory in use at the start if it can be
+    reset (linux), the peak of the process if not'''
+
+    start = procStatus("VmRSS") if resetPeak() else None
+    begin = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - begin
+    peak = peakMemory()
+    return (seconds, result, max(0, peak - start) if start is not None else peak)
+
+def rusagePeak(usage):
+    '''The peak memory on a rusage in bytes'''
+
+    # bytes on macos, KB on the rest
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+def runProcess(args, **kwargs):
+    '''Run a command and wait for it, return a tuple (return code, rusage)
+    with the resources used by that process alone (cpu times, faults,
+    context switches...)'''
+
+    process = subprocess.Popen(args, **kwargs)
+    (pid, status, usage) = os.wait4(process.pid, 0)
+    # let Popen know, it's already reaped
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return (process.returncode, usage)
+
+def runScript(script, args, **kwargs):
+    '''Run a python script with this interpreter like runProcess, return a
+    tuple (return code, rusage, peak memory of the script in bytes)'''
+
+    fd, report = tempfile.mkstemp(prefix="skyflash-bench-peak-")
+    os.close(fd)
+    try:
+        (code, usage) = runProcess([sys.executable, "-c", scriptRunner, report, script] + list(args), **kwargs)
+        with open(report, 'rt') as f:
+            data = f.read().strip()
+    finally:
+        os.unlink(report)
+
+    return (code, usage, int(data) * 1024 if data else rusagePeak(usage))
+
+def throughput(amount, seconds, unit):
+    '''The work done per second, the bytes as MB (10^6); return a tuple
+    (rate, unit)'''
+
+    if unit == "bytes":
+        return (amount / 1000 / 1000 / max(seconds, 1e-9), "MB")
+
+    return (amount / max(seconds, 1e-9), unit)
+
+def environment():
+    '''What a baseline depends on besides the code'''
+
+    return {
+        'python': platform.python_version(),
+        'system': platform.system(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+def loadBaseline(path):
+    '''The baseline on path or None'''
+
+    try:
+        with open(path, 'rt') as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if baseline.get('version') != baselineVersion:
+        return None
+
+    return baseline
+
+def saveBaseline(path, params, results):
+    '''Save the results of a run as the new baseline, the results of the
+    benchmarks not run this time are kept'''
+
+    baseline = loadBaseline(path) or {'version': baselineVersion, 'results': {}}
+    if baseline.get('params') != params:
+        baseline['results'] = {}
+
+    baseline['params'] = params
+    baseline['environment'] = environment()
+    baseline['results'].update(results)
+
+    with open(path + ".tmp", 'wt') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def compareBaseline(baseline, params, results, threshold=defaultThreshold):
+    '''Compare the results against the baseline, return a list of the
+    regressions as strings; the results are comparable only with the same
+    params (image size, density...)'''
+
+    if baseline is None:
+        return []
+
+    if baseline.get('params') != params:
+        print("WARNING: the baseline was made with other params {}, not compared".format(baseline.get('params')))
+        return []
+
+    regressions = []
+    for (name, result) in sorted(results.items()):
+        old = baseline['results'].get(name)
+        if not old:
+            continue
+
+        if result['rate'] < old['rate'] * (1 - threshold):
+            regressions.append("{}: {:.1f} {}/s, baseline {:.1f} ({:+.1%})".format(
+                name, result['rate'], result['unit'], old['rate'], result['rate'] / old['rate'] - 1))
+
+        peak = old.get('peak', 0)
+        if result['peak'] > max(peak * (1 + threshold), peak + memorySlack):
+            regressions.append("{}: peak memory {:.1f} MB, baseline {:.1f} MB ({:+.1f} MB)".format(
+                name, result['peak'] / 1000 / 1000, peak / 1000 / 1000, (result['peak'] - peak) / 1000 / 1000))
+
+    return regressions
+
+def removeFolder(path):
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# part of skyflash
+# benchmarks of the data path hot loops: build, verify, extract, flash &
+# drives detection on synthetic images and a fake sysfs
+#
+# usage: python3 benchmarks/datapath.py [-s 256] [--save] [--only build-clone,cksum]
+
+import os
+import sys
+import tarfile
+import argparse
+
+# local imports, common puts the checkout on the path
+from common import *
+from skyflash.cluster import buildCluster, baseManifest, defaultGateway, defaultDNS, defaultManager
+from skyflash.download import ProgressFileObject, streamExtract, verifyExtracted
+from skyflash.hashing import hashFile
+from skyflash.manifest import newChunkHash
+from skyflash.imaging import writeVirtualImage, nodeConfig, imageConfigAddress
+from skyflash.progress import ProgressReporter
+from skyflash import devices
+
+# the native writer of the posix flashers
+writerScript = os.path.join(repoRoot, "posix-build", "pydd.py")
+
+def reporter():
+    '''A progress reporter like the ones feeding the UI, emitting to nowhere,
+    the throttling cost is part of the hot loop'''
+
+    return ProgressReporter(lambda percent, text: None, lambda percent, *args: "{:.1%}".format(percent / 100))
+
+def buildImages(mode):
+    '''Build a cluster like buildTheImages does, the bytes of the images'''
+
+    def bench(ctx, out):
+        progress = reporter()
+        images = buildCluster(ctx['image'], out, nodes=ctx['nodes'], mode=mode,
+                              progressfn=lambda fraction, index, count: progress.fraction((index + fraction) / count))
+        return len(images) * ctx['size']
+
+    return bench
+
+def cksum(ctx, out):
+    '''Whole file digest plus the manifest of chunks, like cksumCheck does on a
+    image with no manifest'''
+
+    hashFile(ctx['image'], ["sha1"], reporter().fraction, extra={'manifest': newChunkHash()})
+    return ctx['size']
+
+def cksumManifest(ctx, out):
+    '''Parallel check of the chunks against the manifest, like cksumCheck does
+    on a image with a manifest'''
+
+    bad = ctx['manifest'].verifyFile(ctx['image'], 0, reporter().fraction)
+    assert not bad, "The manifest check failed"
+    return ctx['size']
+
+def extract(ctx, out):
+    '''Extract the release archive like extractFile does'''
+
+    progress = reporter()
+    with tarfile.open(fileobj=ProgressFileObject(ctx['archive'], progressfn=progress.fraction)) as tar:
+        tar.extractall(out)
+    progress.flush()
+    return ctx['size']
+
+def streamExtraction(ctx, out):
+    '''Extract, hash and check the release archive in one pass, the path of
+    the streamed download'''
+
+    progress = reporter()
+    with open(ctx['archive'], 'rb') as source:
+        result = streamExtract(source, out, None, lambda done: progress.update(-1, done))
+
+    assert verifyExtracted(result)[3], "The extracted image does not match it's checksum"
+    return ctx['size']
+
+def writer(image, *options):
+    '''Flash the image with pydd to a file standing for the card, like the
+    posix flashers do (with the options given); the peak memory is the one
+    of the writer process'''
+
+    def bench(ctx, out):
+        # the writer does not create the device, like a card it must be there
+        target = os.path.join(out, "card.img")
+        with open(target, 'wb') as f:
+            f.truncate(ctx['size'])
+
+        with open(os.devnull, 'wb') as null:
+            (code, usage, peak) = runScript(writerScript, [ctx[image], target] + list(options), stdout=null)
+
+        assert code == 0, "The writer failed"
+        ctx['childPeak'] = peak
+        return ctx['size']
+
+    return bench
+
+def drives(cold):
+    '''Parse the fake sysfs like getLinDrivesInfo does, cold is with the cache
+    of the device data empty on each call'''
+
+    def bench(ctx, out):
+        for i in range(ctx['calls']):
+            if cold:
+                devices.deviceCache.clear()
+            devices.removableDrives(ctx['sysfs'], ctx['mountinfo'], "/dev")
+
+        return ctx['calls']
+
+    return bench
+
+# name: (bench, unit)
+benchmarks = {
+    'build-clone': (buildImages("clone"), "bytes"),
+    'build-copy': (buildImages("copy"), "bytes"),
+    'build-virtual': (buildImages("virtual"), "bytes"),
+    'cksum': (cksum, "bytes"),
+    'cksum-manifest': (cksumManifest, "bytes"),
+    'extract': (extract, "bytes"),
+    'stream-extract': (streamExtraction, "bytes"),
+    'pydd': (writer('image'), "bytes"),
+    'pydd-direct': (writer('image', "--direct"), "bytes"),
+    'pydd-skip-zero': (writer('image', "--skip-zero", "--allow-stale"), "bytes"),
+    'pydd-virtual': (writer('virtual'), "bytes"),
+    'drives-cold': (drives(True), "calls"),
+    'drives': (drives(False), "calls"),
+}
+
+def fixtures(folder, args):
+    '''Build the synthetic image, it's manifest, the release archive, a
+    virtual image and the fake sysfs; return the context of the benchmarks'''
+
+    size = args.size * 1024 * 1024
+    image = makeImage(os.path.join(folder, "Skybian-bench.img"), size, args.density)
+    digest = hashFile(image, ["sha1"])['sha1']
+
+    archive = os.path.join(folder, "Skybian-bench.tar.gz")
+    makeArchive(image, archive, digest)
+
+    virtual = os.path.join(folder, "Skybian-bench-node.vimg")
+    writeVirtualImage(virtual, image, imageConfigAddress, nodeConfig("192.168.0.3", defaultGateway, defaultDNS, "node", defaultManager))
+
+    (sysfs, mountinfo) = makeSysfs(folder, args.disks)
+
+    return {
+        'size': size,
+        'image': image,
+        'manifest': baseManifest(image),
+        'archive': archive,
+        'virtual': virtual,
+        'nodes': args.nodes,
+        'sysfs': sysfs,
+        'mountinfo': mountinfo,
+        'calls': args.calls,
+    }
+
+def run(name, ctx, folder, repeat):
+    '''Run a benchmark repeat times, the best run counts (and the lowest
+    peak memory, the allocator may reuse or not the memory of the last run);
+    return a dict with the rate, unit, seconds and peak memory'''
+
+    (bench, unit) = benchmarks[name]
+    best = None
+    peaks = []
+    for i in range(repeat):
+        out = os.path.join(folder, "out")
+        os.makedirs(out)
+        ctx['childPeak'] = 0
+        try:
+            (seconds, amount, peak) = timeIt(bench, ctx, out)
+        finally:
+            removeFolder(out)
+
+        (value, rateUnit) = throughput(amount, seconds, unit)
+        peaks.append(ctx['childPeak'] or peak)
+        if best is None or value > best['rate']:
+            best = {'rate': value, 'unit': rateUnit, 'seconds': seconds}
+
+    best['peak'] = min(peaks)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the data path of skyflash on synthetic images")
+    parser.add_argument("-s", "--size", type=int, default=256, help="Size of the synthetic image in MB, default 256")
+    parser.add_argument("-d", "--density", type=float, default=0.3, help="Fraction of the image holding data, the rest are holes, default 0.3")
+    parser.add_argument("-n", "--nodes", type=int, default=3, help="Nodes of the cluster on the build benchmarks, default 3")
+    parser.add_argument("--disks", type=int, default=32, help="Disks on the fake sysfs, default 32")
+    parser.add_argument("--calls", type=int, default=200, help="Calls on the drives benchmarks, default 200")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs of each benchmark, the best counts, default 3")
+    parser.add_argument("--only", default="", help="Comma separated benchmarks to run, default all: {}".format(", ".join(benchmarks)))
+    parser.add_argument("--folder", help="Folder for the fixtures, the filesystem matters, default the temp folder")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json"),
+                        help="Baseline file, default benchmarks/baseline.json")
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("-t", "--threshold", type=float, default=defaultThreshold,
+                        help="Fraction slower (or bigger peak memory) than the baseline that is a regression, default {}".format(defaultThreshold))
+    args = parser.parse_args(argv)
+
+    if args.size < 16:
+        parser.error("The image must be 16 MB at least, the config block is at 12 MB")
+
+    names = [name.strip() for name in args.only.split(",") if name.strip()] or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            parser.error("Unknown benchmark {}".format(name))
+
+    # the baseline is valid only for the same workload
+    params = {'size': args.size, 'density': args.density, 'nodes': args.nodes, 'disks': args.disks, 'calls': args.calls}
+
+    folder = workFolder(args.folder)
+    try:
+        print("Building the fixtures on {}...".format(folder))
+        ctx = fixtures(folder, args)
+
+        results = {}
+        for name in names:
+            results[name] = run(name, ctx, folder, args.repeat)
+            r = results[name]
+            print("{:<16} {:10.1f} {}/s {:8.3f} s {:8.1f} MB peak".format(name, r['rate'], r['unit'], r['seconds'], r['peak'] / 1000 / 1000))
+    finally:
+        removeFolder(folder)
+
+    regressions = compareBaseline(loadBaseline(args.baseline), params, results, args.threshold)
+    for line in regressions:
+        print("REGRESSION: {}".format(line))
+
+    if args.save:
+        saveBaseline(args.baseline, params, results)
+        print("Baseline saved to {}".format(args.baseline))
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# part of skyflash
+# end to end benchmark of the flashing: the real writer (pydd) driven by
+# flashImage() to sparse files or loop devices acting as cards, throttled to
+# the speed of slow cards if asked, across block sizes & concurrency levels
+#
+# usage: python3 benchmarks/flashing.py [-s 256] [-b 1M,4M] [-c 1,4] [--card class4] [--loop]
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+# local imports, common puts the checkout on the path
+from common import *
+from skyflash.cluster import flashImage, writerScript
+from skyflash.tools import findTool
+
+# write speed of the cards to simulate, MB/s, the minimum sustained write of
+# each SD speed class
+cardSpeeds = {
+    'class2': 2,
+    'class4': 4,
+    'class6': 6,
+    'class10': 10,
+    'uhs1': 10,
+    'uhs3': 30,
+}
+
+# runs the writer like the interpreter does with os.pwrite throttled to a
+# rate (bytes per second, 0 is no limit) and counted, on exit it writes a
+# report with the resources used by the process; it's the stand-in for a
+# slow card, the write returns when the card would had written the data
+flashRunner = """
+import os, sys, json, time, runpy, atexit, resource, threading
+
+report = sys.argv[1]
+rate = float(sys.argv[2])
+counts = {'pwrite': 0, 'bytes': 0}
+start = time.monotonic()
+lock = threading.Lock()
+pwrite = os.pwrite
+
+def throttled(fd, data, offset):
+    count = pwrite(fd, data, offset)
+    with lock:
+        counts['pwrite'] += 1
+        counts['bytes'] += count
+        due = start + counts['bytes'] / rate if rate else 0
+
+    delay = due - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+    return count
+
+def done():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    peak = 0
+    try:
+        with open("/proc/self/status", "rt") as f:
+            peak = int("".join(line.split()[1] for line in f if line.startswith("VmHWM:")) or 0) * 1024
+    except OSError:
+        pass
+
+    with open(report, "wt") as f:
+        json.dump({'user': usage.ru_utime, 'system': usage.ru_stime, 'peak': peak or usage.ru_maxrss * 1024,
+                   'voluntary': usage.ru_nvcsw, 'involuntary': usage.ru_nivcsw,
+                   'inblock': usage.ru_inblock, 'oublock': usage.ru_oublock,
+                   'pwrite': counts['pwrite'], 'written': counts['bytes']}, f)
+
+os.pwrite = throttled
+atexit.register(done)
+sys.argv = sys.argv[3:]
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+def parseSize(text):
+    '''A size like 4M, 512K or 1048576, in bytes'''
+
+    units = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+
+    return int(text)
+
+def parseSpeed(text):
+    '''A card speed as MB/s or a name on cardSpeeds, in bytes per second; 0
+    is no limit'''
+
+    if text in cardSpeeds:
+        return cardSpeeds[text] * 1000 * 1000
+
+    return int(float(text) * 1000 * 1000)
+
+def parseStrace(path):
+    '''Parse a "strace -c" summary, return a dict with the calls of each
+    syscall and the total'''
+
+    calls = {}
+    try:
+        with open(path, 'rt') as f:
+            for line in f:
+                fields = line.split()
+                # % time, seconds, usecs/call, calls, [errors], syscall
+                if len(fields) >= 5 and fields[3].isdigit():
+                    calls[fields[-1]] = int(fields[3])
+    except OSError:
+        pass
+
+    return calls
+
+class Card(object):
+    '''A target to flash: a sparse file, or a loop device over it if asked'''
+
+    def __init__(self, folder, index, size, loop=False):
+        self.file = os.path.join(folder, "card-{}.img".format(index))
+        self.loop = None
+
+        with open(self.file, 'wb') as f:
+            f.truncate(size)
+
+        if loop:
+            self.loop = subprocess.check_output([findTool("losetup"), "--find", "--show", self.file],
+                                                universal_newlines=True).strip()
+
+    @property
+    def device(self):
+        return self.loop or self.file
+
+    def remove(self):
+        if self.loop:
+            subprocess.call([findTool("losetup"), "--detach", self.loop])
+            self.loop = None
+
+        if os.path.exists(self.file):
+            os.unlink(self.file)
+
+def flashCard(image, card, options, speed, strace, report):
+    '''Flash the image on the card with the real writer through the runner,
+    return a dict with the outcome, the progress samples, the resources used
+    by the writer and the syscalls (if traced)'''
+
+    writer = [sys.executable, "-c", flashRunner, report + ".json", str(speed), os.path.normpath(writerScript)]
+    if strace:
+        writer = [findTool("strace"), "-f", "-c", "-o", report + ".strace"] + writer
+
+    samples = []
+    begin = time.perf_counter()
+
+    def progress(percent, line):
+        samples.append((time.perf_counter() - begin, percent))
+
+    (ok, message) = flashImage(image, card.device, progress, writer, **options)
+    seconds = time.perf_counter() - begin
+
+    try:
+        with open(report + ".json", 'rt') as f:
+            usage = json.load(f)
+    except (OSError, ValueError):
+        usage = {}
+
+    return {'ok': ok, 'message': message, 'seconds': seconds, 'samples': samples,
+            'usage': usage, 'syscalls': parseStrace(report + ".strace") if strace else {}}
+
+def curve(samples, size, window=1.0):
+    '''The throughput curve of a flash from it's progress samples, a list of
+    (seconds, MB/s) on windows of that seconds'''
+
+    points = []
+    (lastTime, lastPercent) = (0.0, 0.0)
+    for (when, percent) in samples:
+        if when - lastTime >= window or percent >= 100:
+            points.append((round(when, 2), (percent - lastPercent) / 100 * size / 1000 / 1000 / max(when - lastTime, 1e-9)))
+            (lastTime, lastPercent) = (when, percent)
+
+    return points
+
+def runLevel(image, size, folder, blockSize, concurrency, args):
+    '''Flash concurrency cards at the same time with that block size, return
+    the aggregated results'''
+
+    options = {'blockSize': blockSize, 'buffers': args.buffers, 'direct': args.direct,
+               'skipZero': args.skip_zero, 'discard': False, 'allowStale': True, 'verify': args.verify}
+    speed = parseSpeed(args.card) if args.card else 0
+
+    cards = []
+    outcomes = [None] * concurrency
+    try:
+        for index in range(concurrency):
+            cards.append(Card(folder, index, size, args.loop))
+
+        def work(index):
+            outcomes[index] = flashCard(image, cards[index], options, speed, args.strace,
+                                        os.path.join(folder, "report-{}".format(index)))
+
+        threads = [threading.Thread(target=work, args=(index,)) for index in range(concurrency)]
+        begin = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - begin
+    finally:
+        for card in cards:
+            card.remove()
+
+    failed = [o['message'] if o else "the harness failed" for o in outcomes if o is None or not o['ok']]
+    if failed:
+        raise RuntimeError("The flash failed: {}".format(failed[0]))
+
+    megabytes = size * concurrency / 1000 / 1000
+    cpu = sum(o['usage'].get('user', 0) + o['usage'].get('system', 0) for o in outcomes)
+    syscalls = {}
+    for o in outcomes:
+        for (name, calls) in o['syscalls'].items():
+            syscalls[name] = syscalls.get(name, 0) + calls
+
+    return {
+        'rate': megabytes / wall,
+        'unit': "MB",
+        'seconds': wall,
+        'peak': max(o['usage'].get('peak', 0) for o in outcomes),
+        'device': [size / 1000 / 1000 / o['seconds'] for o in outcomes],
+        'cpu': cpu / megabytes,
+        'writes': sum(o['usage'].get('pwrite', 0) for o in outcomes),
+        'switches': sum(o['usage'].get('voluntary', 0) + o['usage'].get('involuntary', 0) for o in outcomes),
+        'syscalls': syscalls,
+        'curves': [curve(o['samples'], size) for o in outcomes],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End to end benchmark of the flashing of skyflash on files or loop devices")
+    parser.add_argument("-s", "--size", type=int, default=256, help="Size of the synthetic image in MB, default 256")
+    parser.add_argument("-d", "--density", type=float, default=0.3, help="Fraction of the image holding data, default 0.3")
+    parser.add_argument("-i", "--image", help="Flash this image instead of a synthetic one")
+    parser.add_argument("-b", "--block-sizes", default="1M,4M,16M", help="Comma separated block sizes of the writer, default 1M,4M,16M")
+    parser.add_argument("-c", "--concurrency", default="1,2,4", help="Comma separated number of cards flashed at the same time, default 1,2,4")
+    parser.add_argument("-n", "--buffers", type=int, default=4, help="Buffers in the read/write ring of the writer, default 4")
+    parser.add_argument("--card", help="Throttle the writes to the speed of a card, MB/s or one of: {}".format(", ".join(cardSpeeds)))
+    parser.add_argument("--direct", action="store_true", help="Ask the writer for O_DIRECT writes")
+    parser.add_argument("-z", "--skip-zero", action="store_true", help="Do not write the zero blocks (stale data allowed)")
+    parser.add_argument("-v", "--verify", choices=["none", "sample", "full"], default="none", help="Read back the cards after the write, default none")
+    parser.add_argument("--loop", action="store_true", help="Flash loop devices over the files (needs root & losetup)")
+    parser.add_argument("--strace", action="store_true", help="Count the syscalls of the writer with strace -c (it slows it down)")
+    parser.add_argument("--folder", help="Folder for the image and the cards, the filesystem matters, default the temp folder")
+    parser.add_argument("--curves", help="Write the throughput curves (csv) to this file")
+    parser.add_argument("--json", help="Write all the results (json) to this file")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "flashing.json"),
+                        help="Baseline file, default benchmarks/flashing.json")
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("-t", "--threshold", type=float, default=defaultThreshold,
+                        help="Fraction slower than the baseline that is a regression, default {}".format(defaultThreshold))
+    args = parser.parse_args(argv)
+
+    try:
+        blockSizes = [parseSize(b) for b in args.block_sizes.split(",") if b.strip()]
+        levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+        if args.card:
+            parseSpeed(args.card)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.loop and not findTool("losetup"):
+        parser.error("--loop needs losetup")
+    if args.strace and not findTool("strace"):
+        parser.error("--strace needs strace")
+
+    # the baseline is valid only for the same workload
+    params = {'size': args.size, 'density': args.density, 'image': args.image, 'card': args.card,
+              'direct': args.direct, 'skipZero': args.skip_zero, 'verify': args.verify, 'loop': args.loop}
+
+    folder = workFolder(args.folder)
+    results = {}
+    try:
+        if args.image:
+            image = args.image
+        else:
+            print("Building a {} MB image on {}...".format(args.size, folder))
+            image = makeImage(os.path.join(folder, "Skybian-bench.img"), args.size * 1024 * 1024, args.density)
+        size = os.path.getsize(image)
+
+        for blockSize in blockSizes:
+            for concurrency in levels:
+                name = "bs={}K c={}".format(blockSize // 1024, concurrency)
+                try:
+                    r = runLevel(image, size, folder, blockSize, concurrency, args)
+                except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+                    print("ERROR: {}: {}".format(name, e))
+                    return 1
+
+                results[name] = r
+                print("{:<16} {:8.1f} MB/s {:8.2f} s  {:6.1f} MB/s per card  {:6.3f} cpu s/MB  {:6d} writes  {:6d} switches{}".format(
+                    name, r['rate'], r['seconds'], min(r['device']), r['cpu'], r['writes'], r['switches'],
+                    "  {} syscalls".format(sum(r['syscalls'].values())) if r['syscalls'] else ""))
+    finally:
+        removeFolder(folder)
+
+    if args.curves:
+        with open(args.curves, 'wt') as f:
+            f.write("run,card,seconds,mbps\n")
+            for (name, r) in results.items():
+                for (index, points) in enumerate(r['curves']):
+                    for (when, mbps) in points:
+                        f.write("{},{},{},{:.2f}\n".format(name, index, when, mbps))
+
+    if args.json:
+        with open(args.json, 'wt') as f:
+            json.dump({'params': params, 'environment': environment(), 'results': results}, f, indent=2, sort_keys=True)
+
+    # just the summary on the baseline
+    summary = {name: {k: r[k] for k in ('rate', 'unit', 'seconds', 'peak', 'cpu')} for (name, r) in results.items()}
+    regressions = compareBaseline(loadBaseline(args.baseline), params, summary, args.threshold)
+    for line in regressions:
+        print("REGRESSION: {}".format(line))
+
+    if args.save:
+        saveBaseline(args.baseline, params, summary)
+        print("Baseline saved to {}".format(args.baseline))
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# part of skyflash
+# native block writer: writes an image (plain or virtual) to a block device
+# with big aligned writes, this runs with privileges (pkexec/osascript)
+#
+# progress is reported as lines like "12.3%" on stdout (or the --progress
+# path, a fifo for example); errors are reported as lines starting with
+# "ERROR:" and a non zero exit code
+#
+# if asked the device is read back after the write and checked against the
+# digests of the blocks written, the progress of this is reported as lines
+# like "VERIFY 12.3%" and the result as a "VERIFIED ..." line
+
+import sys
+import os
+import mmap
+import stat
+import time
+import struct
+import argparse
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# local imports
+from streamio import openImage, imageRanges, BufferRing, blockDigest, manifestBlocks, pickBlocks
+
+# sector size, all writes but the last one are multiples of it
+sectorSize = 512
+
+# O_DIRECT needs the buffers and sizes aligned to the page size
+pageSize = mmap.PAGESIZE
+
+# BLKDISCARD ioctl from linux/fs.h: _IO(0x12, 119)
+BLKDISCARD = 0x1277
+
+def openDevice(device, direct=False):
+    '''Open the device to write on it, with O_DIRECT if asked and the
+    OS/fs supports it
+
+    Return a tuple with the file descriptor and the O_DIRECT status
+    '''
+
+    flags = os.O_WRONLY
+    if direct and hasattr(os, "O_DIRECT"):
+        try:
+            return (os.open(device, flags | os.O_DIRECT), True)
+        except OSError:
+            # no O_DIRECT support (a file on tmpfs for example)
+            pass
+
+    return (os.open(device, flags), False)
+
+def openReadDevice(device):
+    '''Open the device to read it back skipping the OS cache: with O_DIRECT
+    if possible or dropping the cached pages if not
+
+    Return a tuple with the file descriptor and the O_DIRECT status
+    '''
+
+    if hasattr(os, "O_DIRECT"):
+        try:
+            return (os.open(device, os.O_RDONLY | os.O_DIRECT), True)
+        except OSError:
+            pass
+
+    fd = os.open(device, os.O_RDONLY)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+    return (fd, False)
+
+def clearDirect(fd):
+    '''Remove the O_DIRECT flag from an open file descriptor, needed to write
+    the tail of the image when it's not aligned'''
+
+    if fcntl is not None and hasattr(os, "O_DIRECT"):
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_DIRECT)
+
+def writeAll(fd, data, offset):
+    '''Write all the data at offset, the OS may write it partially'''
+
+    written = 0
+    while written < len(data):
+        written += os.pwrite(fd, data[written:], offset + written)
+
+    return written
+
+def discard(fd, start, length):
+    '''Discard (trim) a range of a block device, return False if the device
+    can't do it (or it's not a block device)'''
+
+    if fcntl is None or not stat.S_ISBLK(os.fstat(fd).st_mode):
+        return False
+
+    try:
+        fcntl.ioctl(fd, BLKDISCARD, struct.pack('QQ', start, length))
+    except OSError:
+        return False
+
+    return True
+
+def readAll(fd, buffer, count, offset):
+    '''Read count bytes at offset into buffer, the OS may read it partially'''
+
+    done = 0
+    while done < count:
+        n = os.preadv(fd, [buffer[done:count]], offset + done)
+        if n == 0:
+            raise IOError("Short read from the device at offset {}".format(offset + done))
+        done += n
+
+    return done
+
+def verify(device, blocks, blockSize, progress, mode="full", sample=5, digestfn=blockDigest):
+    '''Read back from the device the blocks, a list of (offset, count, digest)
+    tuples, and check the digests (made with digestfn); mode is "full" (all
+    of them) or "sample"
+
+    Return a tuple with the offset of the first bad block (None if all are
+    good), the bytes read and the seconds it took
+    '''
+
+    picked = pickBlocks(blocks, mode, sample)
+    fd, direct = openReadDevice(device)
+
+    # page aligned buffer for O_DIRECT
+    buffer = mmap.mmap(-1, max([blockSize] + [count for (offset, count, digest) in picked]))
+    view = memoryview(buffer)
+
+    start = time.time()
+    readed = 0
+    apc = 0
+    try:
+        for (index, (offset, count, digest)) in enumerate(picked):
+            if direct and (count % pageSize or offset % pageSize):
+                clearDirect(fd)
+                direct = False
+
+            readed += readAll(fd, view, count, offset)
+            if digestfn(view[:count]) != digest:
+                return (offset, readed, time.time() - start)
+
+            # calc percent & report
+            cpc = int(1000 * (index + 1) / len(picked))
+            if cpc > apc:
+                apc = cpc
+                progress.write("VERIFY {:.1%}\n".format(apc/1000))
+    finally:
+        view.release()
+        os.close(fd)
+
+    return (None, readed, time.time() - start)
+
+def zeroBlocks(start, end, blockSize, digests):
+    '''Append to digests the blocks (of blockSize at most) of a range skipped
+    by skip zero, with the digest of the zeros they must read back'''
+
+    zeros = {}
+    while start < end:
+        count = min(blockSize, end - start)
+        if count not in zeros:
+            zeros[count] = blockDigest(bytes(count))
+
+        digests.append((start, count, zeros[count]))
+        start += count
+
+def flash(inputfile, device, blockSize, direct, progress, buffers=4, skipZero=False, trim=False, digests=None,
+          allowStale=False):
+    '''Write the image in inputfile to device in blockSize chunks, the
+    progress is written to the progress file object
+
+    The reads are done in a thread on a ring of buffers, so the device
+    always has a block ready to be written
+
+    If skipZero is True the holes of the image (SEEK_DATA/SEEK_HOLE) are not
+    read and blocks full of zeros are not written, the device is left with the
+    data it had on that places unless trim is True and the device supports
+    discard; if it can't discard it's an error unless allowStale is True
+
+    If digests is a list the (offset, count, digest) of each block written is
+    appended to it, for the read back verification; the ranges skipped are
+    appended too (they must read back as zeros) unless allowStale is True'''
+
+    stream, size = openImage(inputfile)
+    fd, direct = openDevice(device, direct)
+
+    ranges = None
+    if skipZero:
+        # just the data parts of the image, page aligned to keep O_DIRECT happy
+        ranges = imageRanges(stream, size, pageSize)
+
+        if trim and not discard(fd, 0, size):
+            if not allowStale:
+                os.close(fd)
+                stream.close()
+                raise IOError("The device does not support discard, stale data will survive (use --allow-stale to accept it)")
+
+            progress.write("WARNING: the device does not support discard, stale data will survive\n")
+
+    ring = BufferRing(stream, buffers, blockSize, ranges)
+    zeros = bytes(ring.size)
+
+    # the skipped ranges are checked too, if the stale data is not allowed
+    zeroDigests = digests if skipZero and not allowStale else None
+
+    writed = 0
+    checked = 0
+    apc = 0
+    try:
+        for (position, chunk) in ring.chunks():
+            # a hole of the image before this chunk
+            if zeroDigests is not None and position > checked:
+                zeroBlocks(checked, position, ring.size, zeroDigests)
+
+            count = len(chunk)
+            if direct and count % pageSize:
+                # unaligned tail, can't go direct
+                clearDirect(fd)
+                direct = False
+
+            # bytes() and compare is way faster than comparing the memoryview
+            if not skipZero or bytes(chunk) != zeros[:count]:
+                writed += writeAll(fd, chunk, position)
+                if digests is not None:
+                    digests.append((position, count, blockDigest(chunk)))
+            elif zeroDigests is not None:
+                zeroBlocks(position, position + count, ring.size, zeroDigests)
+
+            checked = position + count
+
+            # calc percent & report
+            cpc = int(1000 * (position + count) / size)
+            if cpc > apc:
+                apc = cpc
+                progress.write("{:.1%}\n".format(apc/1000))
+
+        # the hole at the end of the image
+        if zeroDigests is not None and size > checked:
+            zeroBlocks(checked, size, ring.size, zeroDigests)
+
+        # flush it all to the device before exit
+        os.fsync(fd)
+    finally:
+        ring.close()
+        stream.close()
+        os.close(fd)
+
+    return writed
+
+def parseArgs():
+    '''Parse the command line arguments'''
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputfile", help="The image file to flash, it can be a virtual image (.vimg)")
+    parser.add_argument("device", help="The device to write to (a regular file works too)")
+    parser.add_argument("-b", "--bs", type=int, default=4*1024*1024, help="Block size for the writes, in bytes, default 4MB")
+    parser.add_argument("-n", "--buffers", type=int, default=4, help="Number of buffers in the read/write ring, default 4")
+    parser.add_argument("-d", "--direct", action="store_true", help="Use O_DIRECT writes if possible, bypassing the OS cache")
+    parser.add_argument("-z", "--skip-zero", action="store_true", help="Do not write the holes and zero blocks of the image, stale data on the device will survive there, needs --discard or --allow-stale")
+    parser.add_argument("--discard", action="store_true", help="Discard (trim) the device range before writing, used with --skip-zero; it fails if the device can't unless --allow-stale")
+    parser.add_argument("--allow-stale", action="store_true", help="Explicitly accept that stale data survives on the device with --skip-zero, the skipped ranges are not verified then")
+    parser.add_argument("-v", "--verify", choices=["none", "sample", "full"], default="none", help="Read back the device after the write and check it: all the blocks or a sample of them, default none")
+    parser.add_argument("--sample", type=float, default=5, help="Percent of the blocks to check on the sample verification, default 5")
+    parser.add_argument("-m", "--manifest", help="Verify against the chunks of this image manifest instead of hashing the blocks while writing, ignored with --skip-zero")
+    parser.add_argument("-p", "--progress", help="The file (or fifo) to report the progress to, default is stdout")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parseArgs()
+
+    # block size must be aligned to the page size
+    blockSize = max(pageSize, args.bs - args.bs % pageSize)
+
+    if args.progress:
+        progress = open(args.progress, mode='wt', buffering=1)
+    else:
+        progress = open(sys.stdout.fileno(), mode='wt', buffering=1, closefd=False)
+
+    # safety first
+    if args.skip_zero and not (args.discard or args.allow_stale):
+        progress.write("ERROR: --skip-zero leaves stale data on the device, use it with --discard or --allow-stale\n")
+        progress.close()
+        sys.exit(1)
+
+    # the digests of the blocks for the read back verification: from the
+    # manifest or taken while writing; with skip zero the manifest is not used,
+    # the blocks written are checked plus the skipped ranges (they must read
+    # back as zeros) unless the stale data is allowed
+    blocks = None
+    digests = None
+    digestfn = blockDigest
+    try:
+        if args.verify != "none" and args.manifest and not args.skip_zero:
+            stream, size = openImage(args.inputfile)
+            stream.close()
+            (blocks, digestfn) = manifestBlocks(args.manifest, size)
+        elif args.verify != "none":
+            blocks = digests = []
+
+        flash(args.inputfile, args.device, blockSize, args.direct, progress, args.buffers, args.skip_zero, args.discard, digests,
+              args.allow_stale)
+        if blocks is not None:
+            (bad, readed, elapsed) = verify(args.device, blocks, blockSize, progress, args.verify, args.sample, digestfn)
+            if bad is not None:
+                raise IOError("Verification failed, the block at offset {} differs from the image".format(bad))
+
+            speed = readed / elapsed / 1000 / 1000 if elapsed else 0
+            # with stale data allowed the skipped ranges were not checked, say it
+            partial = ", written blocks only" if args.skip_zero and args.allow_stale else ""
+            progress.write("VERIFIED {} {:0.1f} MB at {:0.1f} MB/s{}\n".format(args.verify, readed / 1000 / 1000, speed, partial))
+    except Exception as e:
+        progress.write("ERROR: {}\n".format(e))
+        progress.close()
+        sys.exit(1)
+
+    progress.close()
+    sys.exit(0)
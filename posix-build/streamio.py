@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# part of skyflash
+# shared tools for the writer helpers (the posix writer and the windows
+# flasher, PyInstaller bundles it with each one), only the std lib and the
+# imaging module of skyflash can be used here, this runs with privileges
+
+import os
+import sys
+import json
+import mmap
+import queue
+import random
+import hashlib
+import threading
+
+# the virtual images are the ones the app writes (skyflash/imaging.py): from a
+# checkout the package is one folder up, the bundles has it on their path
+repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repoRoot not in sys.path:
+    sys.path.append(repoRoot)
+
+from skyflash.imaging import VirtualImage, dataRanges, mergeRanges, isVirtualImage
+
+def imageRanges(stream, size, align=1):
+    '''Return the data ranges of an image opened with openImage, holes in
+    the file (if any) are not part of it; the ranges are expanded to
+    multiples of align'''
+
+    if isinstance(stream, VirtualImage):
+        ranges = stream.dataRanges()
+    else:
+        ranges = list(dataRanges(stream.fileno(), size))
+        stream.seek(0)
+
+    return mergeRanges(ranges, align, size)
+
+def openImage(path):
+    '''Open a image to read it, return a tuple with the file object and the
+    size; if it's a virtual image descriptor a VirtualImage object is used'''
+
+    if not isVirtualImage(path):
+        stream = open(path, 'rb', buffering=0)
+        return (stream, os.fstat(stream.fileno()).st_size)
+
+    with open(path, 'rt') as f:
+        descriptor = json.load(f)
+
+    stream = VirtualImage(descriptor['base'], int(descriptor['offset']), bytes.fromhex(descriptor['data']))
+    return (stream, stream.size)
+
+class BufferRing(object):
+    '''A bounded ring of preallocated buffers to overlap the reads of the
+    image with the writes to the device: a reader thread fills the free
+    buffers with readinto while the consumer drains the full ones
+
+    Buffers are anonymous mmaps (page aligned, good for O_DIRECT) and the size
+    is rounded down to a multiple of the page size, so every chunk but the last
+    one is sector aligned
+
+    Use it as an iterator, it yields memoryviews of the full buffers; a buffer
+    is given back to the reader when the next one is asked for. If a list of
+    (start, end) ranges is given only that parts of the stream are read, use
+    chunks() to get the offset of each one
+    '''
+
+    def __init__(self, stream, count=4, size=4*1024*1024, ranges=None):
+        self.stream = stream
+        self.ranges = ranges
+        self.size = max(mmap.PAGESIZE, size - size % mmap.PAGESIZE)
+        self.buffers = [mmap.mmap(-1, self.size) for i in range(max(2, count))]
+        self.views = [memoryview(b) for b in self.buffers]
+        self.free = queue.Queue()
+        self.full = queue.Queue()
+        self.stop = False
+        self.thread = None
+
+        for i in range(len(self.buffers)):
+            self.free.put(i)
+
+    def fill(self):
+        '''Reader thread: fill the free buffers until the end of the stream
+        (or the ranges), the end is flagged with a None buffer'''
+
+        try:
+            for (start, end) in self.ranges or [(0, None)]:
+                position = start
+                if self.ranges:
+                    self.stream.seek(start)
+
+                while end is None or position < end:
+                    i = self.free.get()
+                    if i is None or self.stop:
+                        return
+
+                    # fill it up, a short read is only allowed at the end
+                    want = self.size if end is None else min(self.size, end - position)
+                    mv = self.views[i]
+                    count = 0
+                    while count < want:
+                        n = self.stream.readinto(mv[count:want])
+                        if not n:
+                            break
+                        count += n
+
+                    self.full.put((i, position, count))
+                    position += count
+                    if count < want:
+                        # end of the stream
+                        break
+
+            self.full.put((None, None, 0))
+        except Exception as e:
+            self.full.put((None, e, 0))
+
+    def chunks(self):
+        '''Yield (offset, memoryview) tuples for the chunks read'''
+
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+        while True:
+            i, position, count = self.full.get()
+            if i is None:
+                if position is not None:
+                    # the reader failed, pass the error to the consumer
+                    raise position
+                break
+
+            if count:
+                yield (position, self.views[i][:count])
+
+            # give it back to the reader
+            self.free.put(i)
+
+    def __iter__(self):
+        for (position, chunk) in self.chunks():
+            yield chunk
+
+    def close(self):
+        '''Stop the reader thread, the buffers are freed with the object'''
+
+        self.stop = True
+        self.free.put(None)
+        if self.thread is not None:
+            self.thread.join()
+
+def blockDigest(data):
+    '''The digest of a block for the read back verification'''
+
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def manifestBlocks(path, size):
+    '''Load the chunks of a image manifest (see skyflash/manifest.py) as a
+    list of (offset, count, digest) tuples for the read back verification
+
+    Return a tuple with the list and the digest function of the manifest
+    '''
+
+    with open(path, 'rt') as f:
+        data = json.load(f)
+
+    if data['size'] != size:
+        raise ValueError("The manifest {} is not for this image".format(path))
+
+    chunkSize = data['chunkSize']
+    algorithm = data['algorithm']
+    blocks = [(i * chunkSize, min(chunkSize, size - i * chunkSize), bytes.fromhex(c)) for (i, c) in enumerate(data['chunks'])]
+
+    return (blocks, lambda data: hashlib.new(algorithm, data).digest())
+
+def pickBlocks(blocks, mode, sample):
+    '''Pick the blocks to read back: all of them on the full mode; on the
+    sample mode a random sample percent of them, the first and last blocks
+    are always picked'''
+
+    if mode == "full" or len(blocks) <= 2:
+        return blocks
+
+    count = min(len(blocks) - 2, max(1, int(len(blocks) * sample / 100)))
+    picked = random.sample(blocks[1:-1], count)
+
+    return [blocks[0]] + sorted(picked) + [blocks[-1]]
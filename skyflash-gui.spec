@@ -17,7 +17,7 @@ if 'nt' in os.name:
 
 # posix (linux/macos)
 if 'posix' in os.name:
-    extrafiles.append(('posix-build/dist/pypv', '.'))
+    extrafiles.append(('posix-build/dist/pydd', '.'))
 
 a = Analysis(['skyflash-gui.py'],
              binaries=[],
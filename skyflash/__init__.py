@@ -1,4 +1,10 @@
 # part of skyflash
+#
+# The headless path: the cli & library API (__main__.py & cluster.py) and the
+# modules they use (download, hashing, manifest, imaging, tools, devices &
+# progress) runs on build servers with no graphical environment and are
+# imported by the benchmarks, so they must not import PyQt5; only the app
+# (skyflash.py & utils.py) can use it
 
 import os
 import sys
@@ -21,26 +27,32 @@ name = "skyflash"
 if sys.platform == "win32" and hasattr(sys, 'frozen') and hasattr(sys, '_MEIPASS'):
     os.environ['PATH'] = sys._MEIPASS + "\\PyQt5\\Qt\\bin;" + sys._MEIPASS + ";" + os.environ['PATH']
 
-# GUI imports
-from PyQt5.QtGui import QGuiApplication, QIcon
-from PyQt5.QtQml import QQmlApplicationEngine
-from PyQt5.QtCore import QFileInfo
+# the QT5 app, at a higher level to get caught at the end by the garbage
+# collector; it's created by app(), importing the package must not need Qt
+# (the cli & the library API runs on servers without it, see __main__.py)
+QTapp = None
 
-# local imports
-from skyflash.skyflash import Skyflash
-from skyflash.utils import *
+def app():
+    '''Run the app'''
 
-# define the QT5 app at a higher level to get caught at the end by the garbage collector.
-QTapp = QGuiApplication(sys.argv)
+    global QTapp
 
-# define org and name
-QTapp.setOrganizationName("Skycoin")
-QTapp.setOrganizationDomain("skycoin.net")
-QTapp.setApplicationName("Skyflash")
-QTapp.setApplicationDisplayName("Skyflash")
+    # GUI imports
+    from PyQt5.QtGui import QGuiApplication, QIcon
+    from PyQt5.QtQml import QQmlApplicationEngine
+    from PyQt5.QtCore import QFileInfo
 
-def app():
-    '''Run the app'''
+    # local imports
+    from skyflash.skyflash import Skyflash
+    from skyflash.utils import setPath
+
+    QTapp = QGuiApplication(sys.argv)
+
+    # define org and name
+    QTapp.setOrganizationName("Skycoin")
+    QTapp.setOrganizationDomain("skycoin.net")
+    QTapp.setApplicationName("Skyflash")
+    QTapp.setApplicationDisplayName("Skyflash")
 
     try:
         # app instance
@@ -131,15 +143,16 @@ def app():
         # main GUI call
         sys.exit(QTapp.exec_())
     except SystemExit:
-        if skyflash.timer.isActive():
-            print("Timer is active, stopping it [Explicit exit]")
-            skyflash.timer.stop()
-        
+        if skyflash.cardMonitor is not None:
+            print("Card detection is active, stopping it [Explicit exit]")
+            skyflash.cardMonitor.stop()
+
+        skyflash.exporter.stop()
         sys.exit(0)
     except:
-        if skyflash.timer.isActive():
-            print("Timer is active, stopping it (Crash?)")
-            skyflash.timer.stop()
+        if skyflash.cardMonitor is not None:
+            print("Card detection is active, stopping it (Crash?)")
+            skyflash.cardMonitor.stop()
 
         raise
         sys.exit(-1)
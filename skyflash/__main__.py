@@ -0,0 +1,143 @@
+# part of skyflash
+# headless cli: python3 -m skyflash {prepare,build,flash,batch,drives} ...
+
+import sys
+import logging
+import argparse
+
+# local imports
+from skyflash.cluster import *
+from skyflash.progress import ProgressReporter
+from skyflash.devices import removableDrives
+
+def progressLine(percent, text):
+    '''Print a progress line over the previous one, on stderr'''
+
+    sys.stderr.write("\r{:<78}".format(text))
+    if percent >= 100:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+def bytesProgress():
+    '''A progressfn for the bytes read of a download/extraction'''
+
+    reporter = ProgressReporter(progressLine, lambda percent, done: "{:0.1f} MB read".format(done / 1000 / 1000), idle=0.5)
+    return lambda done: reporter.update(-1, done)
+
+def buildProgress():
+    '''A progressfn for buildCluster'''
+
+    reporter = ProgressReporter(progressLine,
+                                lambda percent, index, count: "Image {} of {}, {:.1f}% done".format(index + 1, count, percent))
+    return lambda fraction, index, count: reporter.fraction((index + fraction) / count, index, count)
+
+def prepare(args):
+    base = prepareImage(args.source, args.folder, args.digest, args.segments, args.keep_archive, bytesProgress())
+    sys.stderr.write("\n")
+
+    if not base['verified']:
+        print("ERROR: the image {} can't be verified".format(base['image'] or args.source))
+        return 1
+
+    print("{} verified using {}".format(base['image'], base['algorithm']))
+    return 0
+
+def build(args):
+    images = buildCluster(args.image, args.folder, args.gw, args.dns, args.manager, args.nodes,
+                          args.mode, args.workers, buildProgress())
+
+    for image in images:
+        print(image)
+
+    return 0
+
+def flash(args):
+    reporter = ProgressReporter(progressLine, lambda percent, line: "{}: {}".format(args.device, line))
+    (ok, message) = flashImage(args.image, args.device, reporter.update,
+                               blockSize=args.bs, buffers=args.buffers, direct=args.direct,
+                               skipZero=args.skip_zero, discard=args.discard, allowStale=args.allow_stale,
+                               verify=args.verify, sample=args.sample)
+    reporter.flush()
+    sys.stderr.write("\n")
+
+    print(message if message else "ERROR: the writer did not report anything")
+    return 0 if ok else 1
+
+def batch(args):
+    built = runBatch(loadBatch(args.file), args.workers, buildProgress())
+
+    for (name, images) in built.items():
+        print("{}: {} images".format(name, len(images)))
+
+    return 0
+
+def drives(args):
+    for (name, label, size) in removableDrives():
+        print("{}\t{:0.1f} GB\t{}".format(name, size / 1000 / 1000 / 1000, label))
+
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m skyflash",
+        description="Skyflash headless: prepare the Skybian base image, build the images of the nodes and flash them")
+    parser.add_argument("--debug", action="store_true", help="Log the details on stderr")
+    commands = parser.add_subparsers(dest="command")
+
+    p = commands.add_parser("prepare", help="Download or extract and verify the Skybian base image")
+    p.add_argument("source", help="URL or path of the Skybian release archive (or a image with --digest)")
+    p.add_argument("-o", "--folder", default=".", help="Folder to put the image in, default is the actual folder")
+    p.add_argument("--digest", help="Digest of a plain image as 'algorithm:hex', the archives carry their own")
+    p.add_argument("--segments", type=int, default=1, help="Parallel segments for the download of a plain image")
+    p.add_argument("--keep-archive", action="store_true", help="Keep the downloaded archive")
+    p.set_defaults(run=prepare)
+
+    p = commands.add_parser("build", help="Build the images of a cluster from the base image")
+    p.add_argument("image", help="The verified Skybian base image")
+    p.add_argument("-o", "--folder", default=".", help="Folder to put the images in, default is the actual folder")
+    p.add_argument("-g", "--gw", default=defaultGateway, help="Gateway of the network, default {}".format(defaultGateway))
+    p.add_argument("-d", "--dns", default=defaultDNS, help="DNS servers, like \"{}\"".format(defaultDNS))
+    p.add_argument("-m", "--manager", default=defaultManager, help="IP of the manager, the nodes follows it, default {}".format(defaultManager))
+    p.add_argument("-n", "--nodes", type=int, default=defaultNodes, help="Number of nodes, default {}".format(defaultNodes))
+    p.add_argument("--mode", choices=["clone", "copy", "virtual"], default="clone", help="How to build the images, default clone")
+    p.add_argument("--workers", type=int, default=0, help="Threads to index the base image, default one per core")
+    p.set_defaults(run=build)
+
+    p = commands.add_parser("flash", help="Flash a image on a device, it needs the rights to write it (root)")
+    p.add_argument("image", help="The image to flash, a virtual image (.vimg) works too")
+    p.add_argument("device", help="The device to write to")
+    p.add_argument("-b", "--bs", type=int, default=4*1024*1024, help="Block size for the writes, in bytes, default 4MB")
+    p.add_argument("-n", "--buffers", type=int, default=4, help="Number of buffers in the read/write ring, default 4")
+    p.add_argument("--direct", action="store_true", help="Use O_DIRECT writes if possible")
+    p.add_argument("-z", "--skip-zero", action="store_true", help="Do not write the zero blocks, it needs --discard or --allow-stale")
+    p.add_argument("--discard", action="store_true", help="Discard (trim) the device before writing with --skip-zero, it fails if the device can't")
+    p.add_argument("--allow-stale", action="store_true", help="Accept that stale data survives on the device with --skip-zero")
+    p.add_argument("-v", "--verify", choices=["none", "sample", "full"], default="none", help="Read back the device after the write, default none")
+    p.add_argument("--sample", type=float, default=5, help="Percent of the blocks to check on the sample verification, default 5")
+    p.set_defaults(run=flash)
+
+    p = commands.add_parser("batch", help="Prepare the base image and build all the clusters of a batch file")
+    p.add_argument("file", help="The batch file (json), see skyflash.cluster.loadBatch")
+    p.add_argument("--workers", type=int, default=0, help="Threads to index the base image, default one per core")
+    p.set_defaults(run=batch)
+
+    p = commands.add_parser("drives", help="List the cards (removable drives) on the system")
+    p.set_defaults(run=drives)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING, format="%(levelname)s: %(message)s")
+
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    try:
+        return args.run(args)
+    except (OSError, ValueError) as e:
+        print("ERROR: {}".format(e))
+        return 1
+    except KeyboardInterrupt:
+        print("\nCanceled")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+# part of skyflash
+# content addressed cache of verified skybian base images
+
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+
+# local imports
+from skyflash.manifest import manifestPath
+
+# the version of the index file format
+cacheIndexVersion = 1
+
+# default limits of the cache
+cacheDefaultBudget = 8 * 1024 * 1024 * 1024 # bytes
+cacheDefaultEntries = 4
+
+class ImageCache(object):
+    '''A store of verified skybian base images keyed by it's digest, the
+    images are kept in a folder with a name like "{algorithm}-{digest}.img"
+    and a index file (index.json) with the version, download URL, digest and
+    verification time of each one
+
+    Images are evicted in LRU order when the cache is over the size budget
+    (in bytes) or the count of entries
+    '''
+
+    def __init__(self, folder, budget=cacheDefaultBudget, entries=cacheDefaultEntries):
+        self.folder = folder
+        self.budget = budget
+        self.entries = entries
+        self.indexFile = os.path.join(folder, "index.json")
+        self.lock = threading.Lock()
+        self.index = {}
+
+        os.makedirs(folder, exist_ok=True)
+        self.load()
+
+    @staticmethod
+    def key(algorithm, digest):
+        '''The key (and file name sans extension) of a image'''
+
+        return "{}-{}".format(algorithm, digest.lower())
+
+    def load(self):
+        '''Load the index from disk, forgetting entries with no image'''
+
+        self.index = {}
+        try:
+            with open(self.indexFile, 'rt') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # no index or a corrupt one, start over
+            return
+
+        if data.get('version') != cacheIndexVersion:
+            logging.debug("Cache index version is {}, ignoring it".format(data.get('version')))
+            return
+
+        for key, entry in data.get('images', {}).items():
+            path = self.path(key)
+            if os.path.exists(path) and os.path.getsize(path) == entry['size']:
+                self.index[key] = entry
+            else:
+                logging.debug("Cached image {} is gone or changed, dropping it".format(key))
+
+    def save(self):
+        '''Write the index to disk atomically'''
+
+        data = {'version': cacheIndexVersion, 'images': self.index}
+        tmp = self.indexFile + ".tmp"
+        with open(tmp, 'wt') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+        os.replace(tmp, self.indexFile)
+
+    def path(self, key):
+        '''The path of a cached image by it's key'''
+
+        return os.path.join(self.folder, key + ".img")
+
+    def contains(self, path):
+        '''Return True if path is a image inside the cache'''
+
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.folder)
+
+    def lookup(self, version=None, url=None):
+        '''Find a cached image by it's version or download URL, the entry is
+        marked as used
+
+        Return a tuple (path, entry) or (None, None) if not cached
+        '''
+
+        with self.lock:
+            for key, entry in self.index.items():
+                if (url and entry['url'] == url) or (version and entry['version'] == version):
+                    path = self.path(key)
+                    if not os.path.exists(path):
+                        # removed under our feet
+                        continue
+
+                    entry['used'] = time.time()
+                    self.save()
+                    return (path, dict(entry))
+
+        return (None, None)
+
+    def add(self, path, version, url, algorithm, digest):
+        '''Store a verified image in the cache, the file is moved (not copied)
+        if it's on the same filesystem, then old entries are evicted if needed
+
+        Return the new path of the image
+        '''
+
+        key = self.key(algorithm, digest)
+        dest = self.path(key)
+
+        with self.lock:
+            if os.path.abspath(path) != os.path.abspath(dest):
+                if os.path.exists(dest):
+                    # same content already cached
+                    os.unlink(path)
+                else:
+                    shutil.move(path, dest)
+
+            now = time.time()
+            entry = self.index.get(key, {'verified': now})
+            entry.update({
+                'version': version,
+                'url': url or entry.get('url', ''),
+                'algorithm': algorithm,
+                'digest': digest.lower(),
+                'size': os.path.getsize(dest),
+                'used': now,
+            })
+            self.index[key] = entry
+
+            self.evict(keep=key)
+            self.save()
+
+        logging.debug("Image {} cached as {}".format(version, key))
+
+        return dest
+
+    def evict(self, keep=None):
+        '''Remove the least recently used images until the cache is within
+        it's limits, the image with the key keep is never removed, call it
+        with the lock held'''
+
+        byUse = sorted(self.index.items(), key=lambda item: item[1]['used'])
+        total = sum(entry['size'] for key, entry in byUse)
+        count = len(byUse)
+
+        for key, entry in byUse:
+            if total <= self.budget and count <= self.entries:
+                break
+
+            if key == keep:
+                continue
+
+            logging.debug("Evicting cached image {} ({})".format(key, entry['version']))
+            for path in (self.path(key), manifestPath(self.path(key))):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+            del self.index[key]
+            total -= entry['size']
+            count -= 1
+
+    def remove(self, path):
+        '''Remove a image from the cache by it's path'''
+
+        key = os.path.basename(path)[:-len(".img")]
+        with self.lock:
+            if key in self.index:
+                del self.index[key]
+                self.save()
+
+            for item in (path, manifestPath(path)):
+                if os.path.exists(item):
+                    os.unlink(item)
@@ -0,0 +1,373 @@
+# part of skyflash
+# headless API: get the base image, build the images of a cluster and flash them
+
+import os
+import re
+import sys
+import json
+import logging
+import ipaddress
+import subprocess
+
+# local imports
+from skyflash.imaging import *
+from skyflash.download import ResumableDownload, streamExtract, verifyExtracted
+from skyflash.hashing import hashFile
+from skyflash.manifest import Manifest, loadManifest, manifestPath
+from skyflash.tools import capabilities, findTool
+
+# defaults of the network of a cluster, the same of the app
+defaultGateway = "192.168.0.1"
+defaultDNS = "1.0.0.1, 1.1.1.1"
+defaultManager = "192.168.0.2"
+defaultNodes = 7
+
+# the native block writer, when running from the sources
+writerScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "posix-build", "pydd.py")
+
+def parseDNS(dns):
+    '''Parse a string with up to three DNS servers separated by spaces or
+    comas, return them as a list; raise a ValueError if one is not valid'''
+
+    servers = [str(ipaddress.IPv4Address(d)) for d in re.split(r"[\s,]+", dns.strip(" ,")) if d]
+    if not 0 < len(servers) <= 3:
+        raise ValueError("Give one to three DNS servers, not '{}'".format(dns))
+
+    return servers
+
+def clusterPlan(gw, dns, manager, nodes):
+    '''The images of a cluster: the manager and the nodes on the IPs that
+    follows it on the gateway /24 network, as a list of (nick, ip, mode)
+    tuples like this:
+
+        [('manager', '192.168.0.2', 'manager'), ('node-1', '192.168.0.3', 'node')]
+
+    Raise a ValueError if the network data is not valid
+    '''
+
+    gwip = ipaddress.IPv4Address(gw)
+    mip = ipaddress.IPv4Address(manager)
+    parseDNS(dns)
+    nodes = int(nodes)
+
+    network = ipaddress.IPv4Network("{}/24".format(gwip), strict=False)
+    if mip not in network:
+        raise ValueError("The manager {} is not on the network of the gateway {}".format(manager, gw))
+
+    if nodes < 1:
+        raise ValueError("A cluster needs one node at least")
+
+    last = mip + nodes
+    if last not in network or int(last) & 255 == 255:
+        raise ValueError("{} nodes after the manager {} does not fit on the network".format(nodes, manager))
+
+    if mip <= gwip <= last:
+        raise ValueError("The gateway {} is on the range of the cluster".format(gw))
+
+    plan = [("manager", str(mip), "manager")]
+    for actual in range(1, nodes + 1):
+        plan.append(("node-{}".format(actual), str(mip + actual), "node"))
+
+    return plan
+
+def imageName(nick, mode="clone"):
+    '''The file name of the image of a node'''
+
+    return "Skybian-{}.{}".format(nick, virtualImageExtension if mode == 'virtual' else "img")
+
+def baseManifest(image, workers=0):
+    '''The manifest of the base image, built (in parallel) and saved if missing'''
+
+    manifest = loadManifest(image)
+    if manifest is None:
+        manifest = Manifest.fromFile(image, workers)
+        manifest.save(manifestPath(image))
+
+    return manifest
+
+def buildNodeImage(base, path, config, mode="clone", caps=None, manifest=None, progressfn=None):
+    '''Build the image of a node at path from the base image and the node
+    config block (see nodeConfig), the mode is one of:
+
+    - clone: reflink or in kernel copy if the filesystem can, else a copy.
+    - copy: a plain (sparse) copy.
+    - virtual: just a descriptor of the base image plus the config (.vimg).
+
+    caps are the capabilities of the destination folder (probed if not
+    given); if the manifest of the base image is given the one of the node is
+    derived from it and saved next to the image
+
+    Return the method used as a string
+    '''
+
+    if mode == 'virtual':
+        # the flashers will stream the base image with the config block on it
+        writeVirtualImage(path, base, imageConfigAddress, config)
+        if progressfn:
+            progressfn(1.0)
+        method = mode
+    else:
+        if caps is None:
+            caps = capabilities(os.path.dirname(os.path.abspath(path)))
+
+        # clone the base image and write only the config block on it
+        method = cloneFile(base, path, progressfn, mode != 'copy', caps['reflink'], caps['copy_file_range'])
+        patchFile(path, imageConfigAddress, config)
+
+    # node manifest: the base one with the chunk of the config block hashed again
+    if manifest is not None:
+        with openImage(path) as image:
+            manifest.patched(image, imageConfigAddress, imageConfigAddress + len(config)).save(manifestPath(path))
+
+    return method
+
+def buildCluster(base, folder, gw=defaultGateway, dns=defaultDNS, manager=defaultManager, nodes=defaultNodes,
+                 mode="clone", workers=0, progressfn=None):
+    '''Build the images of a cluster on folder from the base image, see
+    clusterPlan() & buildNodeImage()
+
+    progressfn is called with (fraction, index, count) as each image is built
+
+    Return the list of the paths of the images, the manager first
+    '''
+
+    plan = clusterPlan(gw, dns, manager, nodes)
+    os.makedirs(folder, exist_ok=True)
+
+    caps = capabilities(folder)
+    manifest = baseManifest(base, workers)
+    images = []
+
+    for (index, (nick, ip, kind)) in enumerate(plan):
+        path = os.path.join(folder, imageName(nick, mode))
+        config = nodeConfig(ip, gw, dns, kind, manager, imageConfigDataSize)
+
+        def imageProgress(fraction, index=index):
+            if progressfn:
+                progressfn(fraction, index, len(plan))
+
+        method = buildNodeImage(base, path, config, mode, caps, manifest, imageProgress)
+        logging.debug("Image {} ({}) built using the '{}' method".format(path, ip, method))
+        images.append(path)
+
+    return images
+
+def prepareImage(source, folder, digest=None, segments=1, keepArchive=False, progressfn=None, cancelfn=None):
+    '''Get a verified skybian base image from source: a URL or a local file
+    of a release archive (.tar.xz, .tar.gz...) or a image (.img)
+
+    The archives are extracted to folder and the image is checked against
+    the checksum files on it in the same pass (downloads are streamed); a
+    plain image is checked against digest, a "algorithm:hexdigest" string
+
+    progressfn is called with the bytes read so far
+
+    Return a dict like this:
+
+        {'image': '/path/Skybian-v0.1.0.img', 'algorithm': 'sha1',
+         'digest': '...', 'verified': True}
+    '''
+
+    os.makedirs(folder, exist_ok=True)
+    name = source.split("/")[-1]
+    remote = "://" in source
+
+    if ".tar" in name:
+        if remote:
+            down = ResumableDownload(source, os.path.join(folder, name))
+            down.probe()
+            reader = down.reader()
+            try:
+                result = streamExtract(reader, folder, None, progressfn, cancelfn)
+            finally:
+                reader.close()
+            down.finish(keepArchive)
+        else:
+            with open(source, 'rb') as f:
+                result = streamExtract(f, folder, None, progressfn, cancelfn)
+
+        (image, algorithm, value, ok) = verifyExtracted(result)
+        if image and image in result['files']:
+            manifest = result['manifests'].get(os.path.basename(image))
+            if ok and manifest is not None:
+                manifest.save(manifestPath(image))
+
+        return {'image': image, 'algorithm': algorithm, 'digest': value, 'verified': ok}
+
+    if remote:
+        down = ResumableDownload(source, os.path.join(folder, name), segments)
+        down.probe()
+        image = down.download(progressfn, cancelfn)
+    else:
+        image = source
+
+    if not digest:
+        return {'image': image, 'algorithm': '', 'digest': '', 'verified': False}
+
+    (algorithm, value) = digest.split(":", 1)
+    digests = hashFile(image, [algorithm])
+    return {'image': image, 'algorithm': algorithm, 'digest': value.lower(),
+            'verified': digests[algorithm] == value.lower()}
+
+def writerArgs(image, device, blockSize=4194304, buffers=4, direct=False, skipZero=False,
+               discard=False, verify="none", sample=5, allowStale=False):
+    '''The arguments for the native block writer (pydd) to flash the image on
+    the device with the given options, as a list
+
+    Skip zero needs discard or allowStale, the user must explicitly accept that
+    the stale data of the card survives; a ValueError is raised if not'''
+
+    args = [image, device, "--bs", str(blockSize), "--buffers", str(buffers)]
+
+    # O_DIRECT is not on every OS (macOS), don't ask the writer for it there
+    if direct and capabilities()['direct']:
+        args.append("--direct")
+
+    # skip the zero blocks of the image: stale data on the card will survive
+    # there unless the card can be discarded (trim) first
+    if skipZero:
+        if not (discard or allowStale):
+            raise ValueError("Skip zero leaves stale data on the card, it needs discard or allow stale")
+
+        args.append("--skip-zero")
+        if discard:
+            args.append("--discard")
+        if allowStale:
+            args.append("--allow-stale")
+
+    # read back the card after the write, all of it or a sample
+    if verify != 'none':
+        args += ["--verify", verify, "--sample", str(sample)]
+
+        # the manifest of the image saves the hashing while writing
+        if os.path.exists(manifestPath(image)):
+            args += ["--manifest", manifestPath(image)]
+
+    return args
+
+def flashImage(image, device, progressfn=None, writer=None, **options):
+    '''Flash the image on the device with the native block writer, the
+    options are the ones of writerArgs(); it must run with the rights to
+    write the device (root), no privileges are asked here
+
+    progressfn is called with (percent, line) for each line of the writer;
+    writer is the command (a list) to run it, the script on the sources by
+    default
+
+    Return a tuple (ok, message), message is the last line of the writer
+    '''
+
+    if writer is None:
+        python = sys.executable or findTool("python3")
+        writer = [python, os.path.normpath(writerScript)]
+
+    cmd = writer + writerArgs(image, device, **options)
+    logging.debug("Flashing with: {}".format(" ".join(cmd)))
+
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+    ok = True
+    message = ""
+    for line in p.stdout:
+        line = line.strip()
+        if not line:
+            continue
+
+        message = line
+        if line.startswith("ERROR"):
+            ok = False
+        elif progressfn and line.endswith("%"):
+            try:
+                progressfn(float(line.split()[-1][:-1]), line)
+            except ValueError:
+                pass
+
+    p.stdout.close()
+    p.wait()
+
+    return (ok and p.returncode == 0, message)
+
+def loadBatch(path):
+    '''Load a batch file: a json file with the base image and the clusters to
+    build, like this:
+
+        {
+            "image": "https://.../Skybian-v0.1.0.tar.xz",
+            "digest": "",
+            "folder": "build",
+            "mode": "clone",
+            "clusters": [
+                {"name": "rack-01", "gw": "10.0.1.1", "manager": "10.0.1.10", "nodes": 200},
+                {"name": "rack-02", "gw": "10.0.2.1", "dns": "10.0.0.53", "manager": "10.0.2.10", "nodes": 200}
+            ]
+        }
+
+    Relative paths are from the batch file folder, each cluster is built in
+    it's own sub folder of folder (named as the cluster); the missing network
+    data of a cluster takes the app defaults
+
+    Return the batch as a dict, raise a ValueError if it's not valid
+    '''
+
+    with open(path, 'rt') as f:
+        batch = json.load(f)
+
+    here = os.path.dirname(os.path.abspath(path))
+    if not batch.get('image'):
+        raise ValueError("The batch file has no base image")
+
+    if "://" not in batch['image']:
+        batch['image'] = os.path.join(here, batch['image'])
+
+    batch['folder'] = os.path.join(here, batch.get('folder', "build"))
+    batch.setdefault('mode', "clone")
+    batch.setdefault('digest', "")
+
+    if batch['mode'] not in ("clone", "copy", "virtual"):
+        raise ValueError("Unknown build mode '{}'".format(batch['mode']))
+
+    names = set()
+    for (index, cluster) in enumerate(batch.get('clusters', [])):
+        cluster.setdefault('name', "cluster-{}".format(index + 1))
+        cluster.setdefault('gw', defaultGateway)
+        cluster.setdefault('dns', defaultDNS)
+        cluster.setdefault('manager', defaultManager)
+        cluster.setdefault('nodes', defaultNodes)
+
+        if cluster['name'] in names or os.sep in cluster['name']:
+            raise ValueError("The cluster name '{}' is repeated or not valid".format(cluster['name']))
+        names.add(cluster['name'])
+
+        # fail early, not after a few hundred images
+        try:
+            clusterPlan(cluster['gw'], cluster['dns'], cluster['manager'], cluster['nodes'])
+        except ValueError as e:
+            raise ValueError("Cluster {}: {}".format(cluster['name'], e))
+
+    if not names:
+        raise ValueError("The batch file has no clusters")
+
+    return batch
+
+def runBatch(batch, workers=0, progressfn=None, messagefn=print):
+    '''Get the base image and build the images of all the clusters of a batch
+    (see loadBatch), messagefn gets the text of each step
+
+    Return a dict with the list of images of each cluster, raise a
+    ValueError if the base image can't be verified
+    '''
+
+    messagefn("Preparing the base image from {}".format(batch['image']))
+    base = prepareImage(batch['image'], os.path.join(batch['folder'], "base"), batch['digest'])
+    if not base['verified']:
+        raise ValueError("The base image {} can't be verified".format(base['image']))
+
+    messagefn("Base image {} verified using {}".format(base['image'], base['algorithm']))
+
+    built = {}
+    for cluster in batch['clusters']:
+        messagefn("Building cluster {}: manager {} and {} nodes".format(cluster['name'], cluster['manager'], cluster['nodes']))
+        built[cluster['name']] = buildCluster(base['image'], os.path.join(batch['folder'], cluster['name']),
+                                              cluster['gw'], cluster['dns'], cluster['manager'], cluster['nodes'],
+                                              batch['mode'], workers, progressfn)
+
+    return built
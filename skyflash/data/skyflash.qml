@@ -135,6 +135,11 @@ ApplicationWindow {
         Menu {
             title: "&File"
 
+            MenuItem {
+                text: "&Verify Skybian image again"
+                onTriggered: skf.reverifySkybian()
+            }
+
             MenuItem {
                 text: "E&xit"
                 shortcut: StandardKey.Quit
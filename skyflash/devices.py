@@ -0,0 +1,411 @@
+# part of skyflash
+# removable devices: watch the kernel for block devices being added or removed
+
+import os
+import re
+import socket
+import time
+import select
+import logging
+import threading
+import collections
+
+try:
+    import pyudev
+except ImportError:
+    # optional, the raw netlink socket does the same job
+    pyudev = None
+
+# the netlink family of the kernel uevents, from linux/netlink.h
+NETLINK_KOBJECT_UEVENT = 15
+
+# seconds to wait for more events of the same burst (a disk and it's
+# partitions) before notifying a change
+eventSettleTime = 0.2
+
+# card scan interval limits (seconds) when polling, the interval backs off
+# while nothing changes; with device events the max is a safety net
+cardsPollMin = 1.0
+cardsPollMax = 8.0
+
+def parseUevent(data):
+    '''Parse a kernel uevent message: a "action@devpath" header followed by
+    null separated KEY=VALUE pairs
+
+    Return a dict with the pairs (and ACTION/DEVPATH at least) or None if
+    it's not a kernel uevent (libudev messages are ignored)
+    '''
+
+    fields = data.split(b"\0")
+    if b"@" not in fields[0]:
+        return None
+
+    event = {}
+    for field in fields[1:]:
+        if b"=" in field:
+            key, value = field.split(b"=", 1)
+            event[key.decode(errors="replace")] = value.decode(errors="replace")
+
+    if "ACTION" not in event:
+        action, devpath = fields[0].split(b"@", 1)
+        event["ACTION"] = action.decode(errors="replace")
+        event["DEVPATH"] = devpath.decode(errors="replace")
+
+    return event
+
+class DeviceWatcher(object):
+    '''Watch the block devices being added, removed or changed (media
+    inserted on a card reader) and call callback() on a background thread
+    after each burst of events
+
+    The events comes from pyudev if installed or from a raw netlink socket
+    listening the kernel uevents (linux only, no privileges needed); start()
+    returns False if there is no way to get them, the caller must poll then
+    '''
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.sock = None
+        self.monitor = None
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        '''Start watching, return False if the OS can't tell us the events'''
+
+        if pyudev is not None:
+            try:
+                context = pyudev.Context()
+                self.monitor = pyudev.Monitor.from_netlink(context)
+                self.monitor.filter_by(subsystem='block')
+                self.monitor.start()
+            except Exception as e:
+                logging.debug("Can't watch devices with pyudev: {}".format(e))
+                self.monitor = None
+
+        if self.monitor is None:
+            if not hasattr(socket, "AF_NETLINK"):
+                return False
+
+            try:
+                self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            except OSError as e:
+                # no netlink here (a sandbox, seccomp...)
+                logging.debug("Can't watch devices with netlink: {}".format(e))
+                return False
+
+            try:
+                # group 1 is the kernel broadcast
+                self.sock.bind((os.getpid(), 1))
+            except OSError as e:
+                # a pid already bound (two watchers) let the kernel pick one
+                try:
+                    self.sock.bind((0, 1))
+                except OSError:
+                    logging.debug("Can't watch devices with netlink: {}".format(e))
+                    self.sock.close()
+                    self.sock = None
+                    return False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+        logging.debug("Watching block devices using {}".format("pyudev" if self.monitor else "netlink"))
+        return True
+
+    def fileno(self):
+        return self.monitor.fileno() if self.monitor else self.sock.fileno()
+
+    def receive(self):
+        '''Read a event, return True if it's about a block device'''
+
+        if self.monitor:
+            device = self.monitor.poll(timeout=0)
+            return device is not None
+
+        event = parseUevent(self.sock.recv(65536))
+        return event is not None and event.get("SUBSYSTEM") == "block"
+
+    def run(self):
+        while not self.stopped:
+            try:
+                ready, _, _ = select.select([self], [], [], 1)
+                if not ready or not self.receive():
+                    continue
+
+                # coalesce the burst of events
+                while select.select([self], [], [], eventSettleTime)[0]:
+                    self.receive()
+
+                if not self.stopped:
+                    self.callback()
+            except Exception as e:
+                if not self.stopped:
+                    logging.debug("Device watcher error: {}".format(e))
+                    time.sleep(1)
+
+    def stop(self):
+        '''Stop watching'''
+
+        self.stopped = True
+        if self.thread is not None:
+            self.thread.join()
+
+        if self.sock is not None:
+            self.sock.close()
+
+# block device inventory from sysfs, no lsblk
+
+# whole disks that are never a card: ram disks, device mapper, software raid,
+# optical and floppy drives
+ignoredDevices = ("ram", "zram", "dm-", "md", "sr", "fd")
+
+# per device cache of the sysfs data, see blockDevices()
+deviceCache = {}
+
+def readSys(path, default=""):
+    '''Read a sysfs attribute, stripped, default if it's not there'''
+
+    try:
+        with open(path, 'rt') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+def unescapeMount(path):
+    '''Mount points on mountinfo have the spaces & Co. octal escaped'''
+
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), path)
+
+def mountPoints(mountinfo="/proc/self/mountinfo"):
+    '''Return a dict with the mount points of each device as "major:minor"'''
+
+    mounts = {}
+    try:
+        with open(mountinfo, 'rt') as f:
+            for line in f:
+                # id parent major:minor root mountpoint ...
+                fields = line.split()
+                if len(fields) > 4:
+                    mounts.setdefault(fields[2], []).append(unescapeMount(fields[4]))
+    except OSError:
+        pass
+
+    return mounts
+
+def deviceInfo(sysdir, name):
+    '''Read the data of a whole disk from it's sysfs folder, a dict'''
+
+    partitions = []
+    for item in sorted(os.listdir(sysdir)):
+        if os.path.exists(os.path.join(sysdir, item, "partition")):
+            partitions.append(readSys(os.path.join(sysdir, item, "dev")))
+
+    devicePath = os.path.realpath(os.path.join(sysdir, "device")) if os.path.exists(os.path.join(sysdir, "device")) else ""
+
+    return {
+        'name': name,
+        'dev': readSys(os.path.join(sysdir, "dev")),
+        # always on 512 bytes sectors, no matter the real sector size
+        'size': int(readSys(os.path.join(sysdir, "size"), "0")) * 512,
+        'removable': readSys(os.path.join(sysdir, "removable"), "0") == "1",
+        'model': readSys(os.path.join(sysdir, "device", "model")) or readSys(os.path.join(sysdir, "device", "name")),
+        'usb': "/usb" in devicePath,
+        'loop': readSys(os.path.join(sysdir, "loop", "backing_file")),
+        'partitions': partitions,
+    }
+
+def blockDevices(sysfs="/sys", mountinfo="/proc/self/mountinfo", dev="/dev"):
+    '''List the whole disks on the system (SCSI/USB, MMC, NVMe, virtio, loop,
+    ...) reading sysfs, a list of dicts like this:
+
+        {'name': '/dev/sdb', 'dev': '8:16', 'size': 7948206080,
+         'removable': True, 'model': 'SD Card Reader', 'usb': True, 'loop': '',
+         'partitions': ['8:17'], 'mounts': {'8:17': ['/media/user/boot']}}
+
+    The sysfs data of each disk is cached by it's sysfs inode and the disk
+    generation (diskseq, the kernel increments it on each media change) and
+    size; the mounts (of the disk and it's partitions) are read each time
+
+    sysfs, mountinfo & dev are the paths to use, to run it on a fake tree
+    '''
+
+    block = os.path.join(sysfs, "block")
+    mounts = mountPoints(mountinfo)
+    devices = []
+
+    try:
+        names = sorted(os.listdir(block))
+    except OSError:
+        return devices
+
+    for name in names:
+        if name.startswith(ignoredDevices):
+            continue
+
+        sysdir = os.path.join(block, name)
+        try:
+            inode = os.stat(sysdir).st_ino
+        except OSError:
+            # gone under our feet
+            continue
+
+        key = (sysdir, inode, readSys(os.path.join(sysdir, "diskseq")), readSys(os.path.join(sysdir, "size")))
+        info = deviceCache.get(key)
+        if info is None:
+            info = deviceInfo(sysdir, os.path.join(dev, name))
+            # forget the older generations of this disk
+            for old in [k for k in deviceCache if k[0] == sysdir]:
+                del deviceCache[old]
+            deviceCache[key] = info
+
+        info = dict(info)
+        info['mounts'] = {d: mounts[d] for d in [info['dev']] + info['partitions'] if d in mounts}
+        devices.append(info)
+
+    return devices
+
+def isCard(device):
+    '''Return True if the device may be a card we can flash: removable media
+    or any mmcblk device (some are not flagged as removable), like lsblk did;
+    fixed USB disks (external HDDs, a USB boot disk) are not cards, and empty
+    readers are skipped'''
+
+    if device['size'] == 0:
+        return False
+
+    return device['removable'] or os.path.basename(device['name']).startswith("mmcblk")
+
+def removableDrives(sysfs="/sys", mountinfo="/proc/self/mountinfo", dev="/dev"):
+    '''The cards on the system as a list of (name, label, size) tuples, the
+    label is the name of the mount point of each partition or 'No Label' if
+    not mounted, like this:
+
+    [
+        ('/dev/mmcblk0', '', 8388608),
+        ('/dev/sdb', 'boot, No Label', 7948206080)
+    ]
+    '''
+
+    drives = []
+    for device in blockDevices(sysfs, mountinfo, dev):
+        if not isCard(device):
+            continue
+
+        labels = []
+        for part in device['partitions']:
+            mount = device['mounts'].get(part)
+            labels.append(os.path.basename(mount[0]) if mount else 'No Label')
+
+        drives.append((device['name'], ", ".join(labels), device['size']))
+
+    return drives
+
+# cards detection on a background thread
+
+# a immutable picture of the cards on the system: serial increments on each
+# change, drives is a tuple of (name, label, size) tuples
+CardSnapshot = collections.namedtuple("CardSnapshot", ["serial", "drives", "time"])
+
+class CardMonitor(object):
+    '''Scan the cards on a background thread and publish a new CardSnapshot
+    only when they change, the UI thread never blocks on the OS tools
+
+    scan() must return the cards as a list of (name, label, size) or a false
+    value if there is none; publish(snapshot) is called on the monitor thread,
+    init() (optional) too before the first scan (COM init on windows)
+
+    The scans are driven by the device events if the OS can tell us about
+    them (see DeviceWatcher), if not by a polling that backs off while nothing
+    changes; rescan() asks for a scan right away
+    '''
+
+    def __init__(self, scan, publish, init=None, pollMin=cardsPollMin, pollMax=cardsPollMax):
+        self.scan = scan
+        self.publish = publish
+        self.init = init
+        self.pollMin = pollMin
+        self.pollMax = pollMax
+        self.snapshot = CardSnapshot(0, (), 0.0)
+        self.wake = threading.Event()
+        self.active = threading.Event()
+        self.watcher = None
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        '''Start (or resume) the monitor, with a scan right away'''
+
+        if self.thread is None:
+            self.watcher = DeviceWatcher(self.rescan)
+            if not self.watcher.start():
+                logging.debug("No device events, polling for cards")
+                self.watcher = None
+
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+        self.active.set()
+        self.rescan()
+
+    def pause(self):
+        '''Do not scan until start() is called again'''
+
+        self.active.clear()
+
+    def rescan(self):
+        '''Scan the cards as soon as possible'''
+
+        self.wake.set()
+
+    def update(self):
+        '''Scan the cards and publish a new snapshot if they changed, return
+        True if so'''
+
+        drives = tuple(tuple(drive) for drive in (self.scan() or ()))
+        if drives == self.snapshot.drives:
+            return False
+
+        self.snapshot = CardSnapshot(self.snapshot.serial + 1, drives, time.time())
+        self.publish(self.snapshot)
+        return True
+
+    def run(self):
+        if self.init:
+            self.init()
+
+        interval = self.pollMin
+        while not self.stopped:
+            # paused: just wait to be resumed
+            if not self.active.wait(1):
+                continue
+
+            # a event during the scan must trigger a new one
+            self.wake.clear()
+            try:
+                changed = self.update()
+            except Exception as e:
+                logging.debug("Card scan failed: {}".format(e))
+                changed = False
+
+            if self.watcher:
+                interval = self.pollMax
+            elif changed:
+                interval = self.pollMin
+            else:
+                interval = min(interval * 2, self.pollMax)
+
+            self.wake.wait(interval)
+
+    def stop(self):
+        '''Stop the monitor and it's device watcher'''
+
+        self.stopped = True
+        self.active.set()
+        self.wake.set()
+
+        if self.watcher:
+            self.watcher.stop()
+
+        if self.thread is not None:
+            self.thread.join()
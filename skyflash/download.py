@@ -0,0 +1,509 @@
+# part of skyflash
+# download tools: stream a skybian release from the network, extracting and
+# hashing it on the fly
+
+import os
+import io
+import json
+import tarfile
+import logging
+import threading
+import requests
+
+# local imports
+from skyflash.hashing import hashAlgorithms, HashPipe
+from skyflash.manifest import Manifest, newChunkHash
+
+# digest algorithms we can check the image against, in order of preference
+digestAlgorithms = hashAlgorithms
+
+# read chunk size for the stream, 1 MB
+streamChunkSize = 1024 * 1024
+
+class DownloadCanceled(Exception):
+    '''Raised when the user cancels a download in progress'''
+    pass
+
+class ProgressFileObject(io.FileIO):
+    '''Overide the fileio object to have a callback on progress'''
+
+    def __init__(self, path, *args, **kwargs):
+        self._total_size = os.path.getsize(path)
+
+        # callback will be a function passed on progressfn, must remove it
+        # from the kwargs to make fileio happy
+        self.progfn = kwargs.pop("progressfn", None)
+
+        io.FileIO.__init__(self, path, *args, **kwargs)
+
+    def read(self, size):
+        '''Each time a chunk in read call the progress function if there'''
+        if self.progfn:
+            # must calc and call the progress callback function
+            progress = self.tell() / self._total_size
+            self.progfn(progress)
+
+        return io.FileIO.read(self, size)
+
+class TeeReader(io.RawIOBase):
+    '''A read only file like object that reads from a source (the network) and
+    optionally writes a copy of the data to a file (the archive) while counting
+    the bytes for the progress
+
+    The progressfn is called with the total bytes read so far; the cancelfn
+    is called on each read and if it returns True a DownloadCanceled is raised
+    '''
+
+    def __init__(self, source, copy=None, progressfn=None, cancelfn=None):
+        super(TeeReader, self).__init__()
+        self.source = source
+        self.copy = copy
+        self.progressfn = progressfn
+        self.cancelfn = cancelfn
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.cancelfn and self.cancelfn():
+            raise DownloadCanceled("Download canceled by the user")
+
+        mv = memoryview(buffer).cast('B')
+        data = self.source.read(len(mv))
+        count = len(data)
+        mv[:count] = data
+
+        if count:
+            if self.copy:
+                self.copy.write(data)
+
+            self.count += count
+            if self.progressfn:
+                self.progressfn(self.count)
+
+        return count
+
+def parseSums(data):
+    '''Parse the content of a checksum file (as produced by sha1sum & Co.) and
+    return a dict with the file name as key and the digest as value'''
+
+    sums = {}
+    for line in data.decode(errors="replace").splitlines():
+        try:
+            digest, name = line.strip().split(maxsplit=1)
+        except ValueError:
+            continue
+
+        sums[name.strip("*").strip()] = digest.lower()
+
+    return sums
+
+def streamExtract(source, folder, archive=None, progressfn=None, cancelfn=None):
+    '''Extract a tar archive (xz/gz/plain) from a stream in one pass: the
+    members are written to folder as they arrive, the images are hashed while
+    written and the checksum files on the archive are parsed
+
+    If archive is a path the compressed stream is saved there too
+
+    Return a dict like this:
+
+    {
+        'files': ['/path/Skybian-v0.0.4.img', '/path/Skybian-v0.0.4.img.sha1'],
+        'digests': {'Skybian-v0.0.4.img': {'md5': '...', 'sha1': '...', 'sha256': '...'}},
+        'sums': {'sha1': {'Skybian-v0.0.4.img': '...'}},
+        'manifests': {'Skybian-v0.0.4.img': Manifest},
+        'size': 123456789,
+    }
+
+    size is the compressed bytes read from the source
+    '''
+
+    result = {'files': [], 'digests': {}, 'sums': {}, 'manifests': {}, 'size': 0}
+    copy = open(archive, 'wb') if archive else None
+
+    try:
+        tee = TeeReader(source, copy, progressfn, cancelfn)
+        with tarfile.open(fileobj=io.BufferedReader(tee, streamChunkSize), mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+
+                # never trust the paths on the archive
+                name = os.path.basename(member.name)
+                path = os.path.join(folder, name)
+                ext = name.split(".")[-1]
+                data = tar.extractfile(member)
+
+                logging.debug("Extracting on the fly: {}".format(name))
+
+                if ext in digestAlgorithms:
+                    # a checksum file, small, parse it
+                    content = data.read()
+                    result['sums'][ext] = parseSums(content)
+                    with open(path, 'wb') as f:
+                        f.write(content)
+                else:
+                    # hash it with all the algorithms, we don't know yet the one on the sums
+                    chunks = newChunkHash()
+                    pipe = HashPipe(digestAlgorithms, extra={'manifest': chunks})
+                    try:
+                        with open(path, 'wb') as f:
+                            while True:
+                                chunk = data.read(streamChunkSize)
+                                if not chunk:
+                                    break
+
+                                f.write(chunk)
+                                pipe.put(chunk)
+                    finally:
+                        digests = pipe.close()
+
+                    result['digests'][name] = digests
+                    result['manifests'][name] = Manifest.fromHash(member.size, chunks, {algo: digests[algo] for algo in digestAlgorithms})
+
+                result['files'].append(path)
+
+        result['size'] = tee.count
+    except:
+        # clean up the partial work
+        for path in result['files']:
+            if os.path.isfile(path):
+                os.unlink(path)
+        raise
+    finally:
+        if copy:
+            copy.close()
+
+    return result
+
+def verifyExtracted(result):
+    '''Check the images on a streamExtract result against the checksum files
+    on the archive, using the best algorithm available
+
+    Return a tuple (image path, algorithm, digest, ok) for the first image
+    with a checksum; or (image path, '', '', False) if there is no checksum
+    '''
+
+    for path in result['files']:
+        name = os.path.basename(path)
+        if name not in result['digests']:
+            continue
+
+        for algo in digestAlgorithms:
+            sums = result['sums'].get(algo, {})
+            if name in sums:
+                ok = sums[name] == result['digests'][name][algo]
+                return (path, algo, sums[name], ok)
+
+        # no checksum for it, can't be verified
+        return (path, '', '', False)
+
+    return ('', '', '', False)
+
+class ResumableDownload(object):
+    '''A download that survives interruptions: the data goes to a '.part'
+    file and the progress is saved on a '.part.json' sidecar, if the download
+    is started again (same url, size & ETag) it resumes from there using HTTP
+    Range requests
+
+    If the server gives us the size and accepts ranges the download can be
+    split in segments fetched in parallel over a pooled requests.Session;
+    servers with no Content-Length are downloaded in one stream
+
+    Use probe() first, then download() to get the file or reader() to stream
+    it (one segment only) and finish() when the stream is consumed
+    '''
+
+    def __init__(self, url, path, segments=1, session=None, headers=None):
+        self.url = url
+        self.path = path
+        self.part = path + ".part"
+        self.statePath = self.part + ".json"
+        self.segments = max(1, segments)
+        self.session = session or requests.Session()
+        self.size = -1
+        self.etag = ""
+        self.ranges = False
+        self.state = None
+        self.done = 0
+        self.lock = threading.Lock()
+
+        # one pooled connection per segment
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.segments)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        if headers:
+            self.session.headers.update(headers)
+
+    def probe(self):
+        '''Get the size, ETag and ranges support from the server and load the
+        saved state if it matches, return the size (-1 if unknown)'''
+
+        r = self.session.head(self.url, allow_redirects=True, timeout=60)
+        if r.status_code >= 400:
+            # some servers don't like HEAD, just ask for the headers
+            r = self.session.get(self.url, stream=True, timeout=60)
+            r.close()
+
+        r.raise_for_status()
+
+        self.size = int(r.headers.get('Content-Length', -1))
+        self.etag = r.headers.get('ETag', r.headers.get('Last-Modified', ''))
+        self.ranges = r.headers.get('Accept-Ranges', '') == 'bytes'
+
+        # no size or no ranges: just one stream
+        if self.size < 0 or not self.ranges:
+            self.segments = 1
+
+        self.state = self.loadState()
+        self.done = sum(s[2] - s[0] for s in self.state['segments'])
+
+        logging.debug("Download probe: size {}, ranges {}, segments {}, resuming from {}".format(
+            self.size, self.ranges, len(self.state['segments']), self.done))
+
+        return self.size
+
+    def loadState(self):
+        '''Load the saved state if it's about this same download, if not
+        start a fresh one'''
+
+        try:
+            with open(self.statePath, 'rt') as f:
+                state = json.load(f)
+
+            if (os.path.exists(self.part) and self.ranges and state['url'] == self.url and
+                    state['size'] == self.size and state['etag'] == self.etag):
+                return state
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # fresh start
+        self.discard()
+
+        if self.segments > 1:
+            step = -(-self.size // self.segments)
+            segments = [[i, min(i + step, self.size), i] for i in range(0, self.size, step)]
+        else:
+            segments = [[0, self.size, 0]]
+
+        return {'url': self.url, 'size': self.size, 'etag': self.etag, 'segments': segments}
+
+    def saveState(self):
+        '''Save the state to the sidecar file'''
+
+        with self.lock:
+            data = json.dumps(self.state)
+
+        with open(self.statePath, 'wt') as f:
+            f.write(data)
+
+    def discard(self):
+        '''Erase the partial download and it's state'''
+
+        for path in (self.part, self.statePath):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def complete(self):
+        '''True if all the segments are downloaded'''
+
+        return all(s[1] >= 0 and s[2] >= s[1] for s in self.state['segments'])
+
+    def request(self, position, end=-1):
+        '''Open a streamed request from position up to end (not included)'''
+
+        headers = {}
+        if position > 0 or end > 0 and len(self.state['segments']) > 1:
+            headers['Range'] = "bytes={}-{}".format(position, end - 1 if end > 0 else "")
+
+        r = self.session.get(self.url, headers=headers, stream=True, timeout=60)
+        r.raise_for_status()
+
+        if 'Range' in headers and r.status_code != 206:
+            r.close()
+            raise IOError("The server ignored the range request for {}".format(self.url))
+
+        return r
+
+    def fetchSegment(self, segment, progressfn, cancelfn):
+        '''Download a segment to the part file, runs in it's own thread'''
+
+        start, end, position = segment
+        if end >= 0 and position >= end:
+            return
+
+        r = self.request(position, end)
+        saved = position
+        try:
+            with open(self.part, 'r+b') as f:
+                f.seek(position)
+                for chunk in r.iter_content(streamChunkSize):
+                    if cancelfn and cancelfn():
+                        raise DownloadCanceled("Download canceled by the user")
+
+                    f.write(chunk)
+                    position += len(chunk)
+
+                    with self.lock:
+                        segment[2] = position
+                        self.done += len(chunk)
+                        done = self.done
+
+                    if progressfn:
+                        progressfn(done)
+
+                    # save the state every 8 MB
+                    if position - saved > 8 * streamChunkSize:
+                        f.flush()
+                        self.saveState()
+                        saved = position
+        finally:
+            r.close()
+
+        if end < 0:
+            # size unknown until now
+            segment[1] = position
+        elif position < end:
+            raise IOError("Download truncated at {} of {} bytes".format(position, end))
+
+    def download(self, progressfn=None, cancelfn=None):
+        '''Download the file, in parallel segments if possible, return the
+        path of the downloaded file; on error/cancel the partial download is
+        kept to resume it later'''
+
+        segments = self.state['segments']
+
+        # part file in place with the final size (sparse)
+        with open(self.part, 'ab') as f:
+            if self.size > 0 and len(segments) > 1:
+                f.truncate(self.size)
+
+        self.saveState()
+        errors = []
+
+        def fetch(segment):
+            try:
+                self.fetchSegment(segment, progressfn, cancelfn)
+            except Exception as e:
+                errors.append(e)
+
+        try:
+            threads = [threading.Thread(target=fetch, args=(s,), daemon=True) for s in segments[1:]]
+            for t in threads:
+                t.start()
+
+            # the first one on this thread
+            fetch(segments[0])
+
+            for t in threads:
+                t.join()
+        finally:
+            self.saveState()
+
+        if errors:
+            # the cancel is the most important one
+            for e in errors:
+                if isinstance(e, DownloadCanceled):
+                    raise e
+            raise errors[0]
+
+        self.finish(True)
+        return self.path
+
+    def reader(self):
+        '''Return a file like object to stream the download from the start,
+        the data already downloaded comes from the part file and the rest from
+        the network (saved to the part file as it's read)'''
+
+        if self.size > 0 and len(self.state['segments']) > 1:
+            raise ValueError("A segmented download can't be streamed")
+
+        return ResumeReader(self)
+
+    def finish(self, keep=True):
+        '''Download done: the part file is renamed to the final path, or
+        erased if keep is False'''
+
+        if not self.complete():
+            raise IOError("Download of {} is not complete".format(self.url))
+
+        if keep:
+            os.replace(self.part, self.path)
+        elif os.path.exists(self.part):
+            os.unlink(self.part)
+
+        if os.path.exists(self.statePath):
+            os.unlink(self.statePath)
+
+class ResumeReader(io.RawIOBase):
+    '''A read only file like object over a ResumableDownload: the data already
+    on the part file is read first and then the rest comes from the network,
+    that part is appended to the part file, so it can be resumed later'''
+
+    def __init__(self, download):
+        super(ResumeReader, self).__init__()
+        self.download = download
+        self.segment = download.state['segments'][0]
+        self.local = open(download.part, 'rb') if self.segment[2] > 0 else None
+        self.localLeft = self.segment[2]
+        self.remote = None
+        self.out = None
+        self.saved = self.segment[2]
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        mv = memoryview(buffer).cast('B')
+
+        # what we already have (the part file may have more than the state says)
+        if self.local:
+            count = self.local.readinto(mv[:min(len(mv), self.localLeft)])
+            if count:
+                self.localLeft -= count
+                return count
+
+            self.local.close()
+            self.local = None
+
+        # the rest from the network
+        if self.remote is None:
+            position = self.segment[2]
+            end = self.segment[1]
+            if end >= 0 and position >= end:
+                return 0
+
+            self.remote = self.download.request(position)
+            self.out = open(self.download.part, 'r+b' if position > 0 else 'wb')
+            self.out.seek(position)
+            self.out.truncate()
+
+        data = self.remote.raw.read(len(mv), decode_content=True)
+        count = len(data)
+        if count:
+            mv[:count] = data
+            self.out.write(data)
+            self.segment[2] += count
+
+            # save the state every 8 MB
+            if self.segment[2] - self.saved > 8 * streamChunkSize:
+                self.out.flush()
+                self.download.saveState()
+                self.saved = self.segment[2]
+        elif self.segment[1] < 0:
+            # size unknown until now
+            self.segment[1] = self.segment[2]
+
+        return count
+
+    def close(self):
+        if not self.closed:
+            for f in (self.local, self.out, self.remote):
+                if f:
+                    f.close()
+
+            self.download.saveState()
+
+        super(ResumeReader, self).close()
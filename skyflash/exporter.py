@@ -0,0 +1,248 @@
+# part of skyflash
+# OpenMetrics/Prometheus exporter of the stage metrics: a node_exporter
+# textfile and/or a local HTTP endpoint to scrape, for unattended stations
+
+import os
+import logging
+import tempfile
+import threading
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# local imports
+from skyflash.metrics import stageNames, stageOk, stageFailed
+
+# the HTTP endpoint listens only locally by default
+exporterAddress = "127.0.0.1"
+
+# buckets of the stage durations histogram, seconds: from a card detection to
+# the download of a release over a slow link
+durationBuckets = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# content types of the two exposition formats
+prometheusType = "text/plain; version=0.0.4; charset=utf-8"
+openMetricsType = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+def escapeLabel(value):
+    '''Escape a label value for the exposition formats'''
+
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def labelsText(labels):
+    '''The {name="value",...} part of a sample, empty if no labels'''
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join('{}="{}"'.format(name, escapeLabel(value)) for (name, value) in labels) + "}"
+
+class MetricsExporter(object):
+    '''Keep the counters, gauges & histograms of the stages (feed it the events
+    of a MetricsRecorder with observe()) and expose them: rewriting a textfile
+    for the node_exporter textfile collector after each event and/or serving
+    them over HTTP on /metrics, both optional, see configure()
+
+    Metrics (all prefixed with skyflash_):
+
+    - images_built_total: node images built.
+    - cards_flashed_total{outcome}: flashes ended, by outcome.
+    - bytes_written_total{device}: bytes written to the cards.
+    - flash_throughput_bytes_per_second{device}: of the last good flash.
+    - verification_failures_total{kind}: base images ("image") or cards read
+      back ("card") that did not match.
+    - stages_total{stage,outcome}: the stages ended.
+    - stage_duration_seconds{stage}: histogram of the stage durations.
+    - stage_last_end_timestamp_seconds{stage}: when the last one ended.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writeLock = threading.Lock()
+        self.imagesBuilt = 0
+        self.cardsFlashed = {}
+        self.bytesWritten = {}
+        self.throughput = {}
+        self.verificationFailures = {'image': 0, 'card': 0}
+        self.stages = {}
+        self.durations = {}
+        self.lastEnd = {}
+
+        self.textfile = ""
+        self.server = None
+        self.bound = None
+
+    def observe(self, event):
+        '''Account a ended stage (an event of the MetricsRecorder)'''
+
+        stage = event['stage']
+        outcome = event['outcome']
+        info = event.get('info', {})
+
+        with self.lock:
+            self.stages[(stage, outcome)] = self.stages.get((stage, outcome), 0) + 1
+            self.lastEnd[stage] = event['end']
+
+            # cumulative buckets, plus the sum & count
+            buckets = self.durations.setdefault(stage, [0] * len(durationBuckets) + [0.0, 0])
+            for (index, bound) in enumerate(durationBuckets):
+                if event['seconds'] <= bound:
+                    buckets[index] += 1
+            buckets[-2] += event['seconds']
+            buckets[-1] += 1
+
+            if stage == "build" and outcome == stageOk:
+                self.imagesBuilt += info.get('images', 0)
+
+            if stage == "flash":
+                device = event['key']
+                self.cardsFlashed[outcome] = self.cardsFlashed.get(outcome, 0) + 1
+                self.bytesWritten[device] = self.bytesWritten.get(device, 0) + event['bytes']
+                if outcome == stageOk:
+                    self.throughput[device] = event['throughput']
+                elif "Verification failed" in event['error']:
+                    self.verificationFailures['card'] += 1
+
+            # the base image: on the verify stage or while streamed on the download
+            if (stage == "verify" and outcome == stageFailed) or (stage == "download" and info.get('verified') is False):
+                self.verificationFailures['image'] += 1
+
+        if self.textfile:
+            self.writeTextfile()
+
+    def family(self, lines, name, kind, help, samples, openmetrics):
+        '''Add a metric family to lines, samples are (suffix, labels, value)'''
+
+        name = "skyflash_" + name
+        # the counters are named with _total, on OpenMetrics just the samples
+        typeName = name if kind != "counter" or openmetrics else name + "_total"
+
+        lines.append("# HELP {} {}".format(typeName, help))
+        lines.append("# TYPE {} {}".format(typeName, kind))
+        for (suffix, labels, value) in samples:
+            lines.append("{}{}{} {}".format(name, suffix, labelsText(labels), repr(float(value)) if isinstance(value, float) else value))
+
+    def render(self, openmetrics=False):
+        '''The metrics in the Prometheus text format or in the OpenMetrics one'''
+
+        lines = []
+        with self.lock:
+            self.family(lines, "images_built", "counter", "Node images built.",
+                        [("_total", (), self.imagesBuilt)], openmetrics)
+
+            self.family(lines, "cards_flashed", "counter", "Flashes ended, by outcome.",
+                        [("_total", (("outcome", o),), n) for (o, n) in sorted(self.cardsFlashed.items())], openmetrics)
+
+            self.family(lines, "bytes_written", "counter", "Bytes written to the cards.",
+                        [("_total", (("device", d),), n) for (d, n) in sorted(self.bytesWritten.items())], openmetrics)
+
+            self.family(lines, "flash_throughput_bytes_per_second", "gauge", "Write throughput of the last good flash of each card.",
+                        [("", (("device", d),), v) for (d, v) in sorted(self.throughput.items())], openmetrics)
+
+            self.family(lines, "verification_failures", "counter", "Base images (image) or cards read back (card) that did not match.",
+                        [("_total", (("kind", k),), n) for (k, n) in sorted(self.verificationFailures.items())], openmetrics)
+
+            self.family(lines, "stages", "counter", "Pipeline stages ended, by outcome.",
+                        [("_total", (("stage", s), ("outcome", o)), n) for ((s, o), n) in sorted(self.stages.items())], openmetrics)
+
+            samples = []
+            for stage in stageNames:
+                buckets = self.durations.get(stage)
+                if buckets is None:
+                    continue
+
+                for (index, bound) in enumerate(durationBuckets):
+                    samples.append(("_bucket", (("stage", stage), ("le", repr(float(bound)))), buckets[index]))
+                samples.append(("_bucket", (("stage", stage), ("le", "+Inf")), buckets[-1]))
+                samples.append(("_sum", (("stage", stage),), float(buckets[-2])))
+                samples.append(("_count", (("stage", stage),), buckets[-1]))
+            self.family(lines, "stage_duration_seconds", "histogram", "Duration of the pipeline stages.", samples, openmetrics)
+
+            self.family(lines, "stage_last_end_timestamp_seconds", "gauge", "When the last stage of each kind ended.",
+                        [("", (("stage", s),), float(t)) for (s, t) in sorted(self.lastEnd.items())], openmetrics)
+
+        if openmetrics:
+            lines.append("# EOF")
+
+        return "\n".join(lines) + "\n"
+
+    def writeTextfile(self):
+        '''Rewrite the textfile atomically, the collector must never see half
+        of it; the events comes from the jobs and the card detection threads,
+        one rewrite at a time'''
+
+        path = self.textfile
+        with self.writeLock:
+            try:
+                fd, tmp = tempfile.mkstemp(prefix=".skyflash-metrics-", dir=os.path.dirname(os.path.abspath(path)))
+                with os.fdopen(fd, 'wt') as f:
+                    f.write(self.render())
+                # mkstemp makes it private, the collector may run as other user
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, path)
+            except OSError as e:
+                logging.debug("Can't write the metrics textfile {}: {}".format(path, e))
+
+    def configure(self, textfile="", address=exporterAddress, port=0):
+        '''Set where to export: the textfile path (empty for none, it must end
+        on .prom for the node_exporter) and the HTTP address & port (0 for
+        none); it's safe to call it again, the server is restarted only if
+        the address changed'''
+
+        self.textfile = textfile
+        if textfile:
+            self.writeTextfile()
+
+        bound = (address, port) if port else None
+        if bound == self.bound:
+            return
+
+        self.stop()
+        if bound is None:
+            return
+
+        try:
+            self.server = ExporterServer(bound, ExporterHandler)
+        except OSError as e:
+            logging.debug("Can't serve the metrics on {}:{}: {}".format(address, port, e))
+            return
+
+        self.server.exporter = self
+        self.bound = bound
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.debug("Serving the metrics on http://{}:{}/metrics".format(address, self.server.server_address[1]))
+
+    def stop(self):
+        '''Stop the HTTP server if running'''
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+        self.bound = None
+
+class ExporterServer(socketserver.ThreadingMixIn, HTTPServer):
+    '''The HTTP server of the exporter, a scrape does not block the next one'''
+
+    daemon_threads = True
+    exporter = None
+
+class ExporterHandler(BaseHTTPRequestHandler):
+    '''Serve the metrics on /metrics, in OpenMetrics if the scraper asks for it'''
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = self.server.exporter.render(openmetrics).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", openMetricsType if openmetrics else prometheusType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Exporter: " + format % args)
@@ -0,0 +1,223 @@
+# part of skyflash
+# hashing engine: all the digests of a file in one pass, hashing overlapped with the reads
+
+import os
+import queue
+import hashlib
+import threading
+import concurrent.futures
+
+# digest algorithms we can check a image against, in order of preference
+hashAlgorithms = ["sha512", "blake2b", "sha256", "sha1", "md5"]
+
+# read size for the hashing, 4 MB
+hashBufferSize = 4 * 1024 * 1024
+
+def merkleRoot(hashes, algorithm="sha256"):
+    '''The root of the Merkle tree with the hashes (bytes) as leaves, each
+    parent is the hash of the concatenation of it's two childs; a node with
+    no sibling is promoted as is to the next level'''
+
+    level = list(hashes)
+    if not level:
+        return hashlib.new(algorithm).digest()
+
+    while len(level) > 1:
+        parents = [hashlib.new(algorithm, level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+
+    return level[0]
+
+class ChunkHash(object):
+    '''A hash object that hashes the data in fixed size chunks, the data can
+    be feed in any size; the hexdigest is the root of the Merkle tree of the
+    chunk hashes'''
+
+    def __init__(self, chunkSize, algorithm="sha256"):
+        self.chunkSize = chunkSize
+        self.algorithm = algorithm
+        self.chunks = []
+        self.current = hashlib.new(algorithm)
+        self.filled = 0
+
+    def update(self, data):
+        data = memoryview(data).cast('B')
+        while len(data):
+            count = min(len(data), self.chunkSize - self.filled)
+            self.current.update(data[:count])
+            self.filled += count
+            data = data[count:]
+
+            if self.filled == self.chunkSize:
+                self.chunks.append(self.current.digest())
+                self.current = hashlib.new(self.algorithm)
+                self.filled = 0
+
+    def digests(self):
+        '''The hashes of all the chunks, the last one may be partial'''
+
+        if self.filled:
+            return self.chunks + [self.current.copy().digest()]
+
+        return list(self.chunks)
+
+    def hexdigest(self):
+        return merkleRoot(self.digests(), self.algorithm).hex()
+
+class MultiHash(object):
+    '''A group of hash objects that are feed with the same data, extra
+    hash objects (a ChunkHash for example) can be given by name'''
+
+    def __init__(self, algorithms, extra=None):
+        self.hashers = [(algo, hashlib.new(algo)) for algo in algorithms]
+        self.hashers += list((extra or {}).items())
+
+    def update(self, data):
+        for (algo, h) in self.hashers:
+            h.update(data)
+
+    def hexdigests(self):
+        '''Return a dict with the hex digest of each algorithm'''
+
+        return {algo: h.hexdigest() for (algo, h) in self.hashers}
+
+class HashPipe(object):
+    '''Hash the data on a background thread, so the caller can read (or
+    write) the next block while the previous one is hashed; hashlib releases
+    the GIL on big buffers so both run in parallel
+
+    put() blocks if there are more than depth blocks waiting to be hashed
+    '''
+
+    def __init__(self, algorithms, depth=4, extra=None):
+        self.hash = MultiHash(algorithms, extra)
+        self.queue = queue.Queue(depth)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            (data, release) = item
+            try:
+                if self.error is None:
+                    self.hash.update(data)
+            except Exception as e:
+                self.error = e
+            finally:
+                if release:
+                    release()
+
+    def put(self, data, release=None):
+        '''Queue data to be hashed, release is called (on the hashing
+        thread) when data is not needed anymore'''
+
+        if self.error is not None:
+            raise self.error
+
+        self.queue.put((data, release))
+
+    def close(self):
+        '''Wait for the pending data to be hashed, return the hex digests'''
+
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.hash.hexdigests()
+
+def hashFile(path, algorithms, progressfn=None, bufferSize=hashBufferSize, buffers=3, extra=None):
+    '''Hash a file with all the algorithms in one pass; the file is read with
+    readinto on a few reused buffers while the previous one is hashed on a
+    background thread
+
+    progressfn is called with the fraction of the bytes read; extra hash
+    objects by name (a ChunkHash for example) are feed too
+
+    Return a dict with the hex digest of each algorithm
+    '''
+
+    size = os.path.getsize(path)
+    free = queue.Queue()
+    for i in range(buffers):
+        free.put(bytearray(bufferSize))
+
+    pipe = HashPipe(algorithms, buffers, extra)
+    done = 0
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                buffer = free.get()
+                count = f.readinto(buffer)
+                if not count:
+                    break
+
+                pipe.put(memoryview(buffer)[:count], lambda buffer=buffer: free.put(buffer))
+
+                done += count
+                if progressfn and size:
+                    progressfn(done / size)
+    finally:
+        digests = pipe.close()
+
+    return digests
+
+def hashChunks(path, chunkSize, algorithm="sha256", workers=0, progressfn=None, indexes=None):
+    '''Hash the fixed size chunks of a file in parallel on a pool of threads
+    (hashlib releases the GIL, so it scales with the cores), each thread reads
+    the chunks with it's own file object and buffer
+
+    workers is the number of threads, 0 means one per core; indexes are the
+    chunks to hash, all if not given
+
+    Return a list with the digest (bytes) of each chunk, in order
+    '''
+
+    size = os.path.getsize(path)
+    if indexes is None:
+        indexes = range((size + chunkSize - 1) // chunkSize)
+
+    workers = workers or os.cpu_count() or 1
+    local = threading.local()
+    files = []
+    lock = threading.Lock()
+
+    def work(index):
+        if not hasattr(local, 'file'):
+            local.file = open(path, 'rb', buffering=0)
+            local.buffer = bytearray(chunkSize)
+            with lock:
+                files.append(local.file)
+
+        start = index * chunkSize
+        view = memoryview(local.buffer)[:min(chunkSize, size - start)]
+        local.file.seek(start)
+        done = 0
+        while done < len(view):
+            count = local.file.readinto(view[done:])
+            if not count:
+                raise IOError("Short read of {} at {}".format(path, start + done))
+            done += count
+
+        return hashlib.new(algorithm, view).digest()
+
+    digests = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            for digest in pool.map(work, indexes):
+                digests.append(digest)
+                if progressfn:
+                    progressfn(len(digests) / len(indexes))
+    finally:
+        for f in files:
+            f.close()
+
+    return digests
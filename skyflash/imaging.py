@@ -0,0 +1,333 @@
+# part of skyflash
+# image building tools: clone the skybian base image and patch the node config on it
+
+import os
+import io
+import json
+import errno
+
+try:
+    import fcntl
+except ImportError:
+    # windows has no fcntl, cloning will fall back to a copy
+    fcntl = None
+
+# FICLONE ioctl from linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# errors that flag "this fs/kernel can't do that", not a real failure
+cloneUnsupported = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL,
+                    errno.ENOSYS, errno.EBADF, errno.EPERM)
+
+# chunk size for the copy fallbacks, 4 MB
+copyChunkSize = 4 * 1024 * 1024
+
+# node config block position and size on the skybian image
+imageConfigAddress = 12582912
+imageConfigDataSize = 256
+
+def nodeConfig(nip, gw, dns, mode, manager, size=256):
+    '''Build the config block for a node as bytes, filled with null chars
+    up to size, the text is like this:
+
+        IP={nodeip}
+        GW={gwip}
+        DNS='{dns}'
+        MODE={manager|node}
+        MIP={managerip}
+
+    Raise a ValueError if the text does not fit in the block
+    '''
+
+    configText = "IP={0}\nGW={1}\nDNS='{2}'\nMODE={3}\nMIP={4}".format(nip, gw, dns, mode, manager)
+    data = configText.encode()
+
+    if len(data) > size:
+        raise ValueError("Node config is {} bytes long, it does not fit on {} bytes".format(len(data), size))
+
+    return data + bytes(size - len(data))
+
+def reflinkFile(src, dst):
+    '''Clone src into dst with a reflink (FICLONE ioctl), both files share
+    the data blocks until one of them is modified (copy on write)
+
+    Return True on success or False if the filesystem can't do it
+    '''
+
+    if fcntl is None or not hasattr(fcntl, "ioctl"):
+        return False
+
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError as e:
+            if e.errno in cloneUnsupported:
+                return False
+            raise
+
+    return True
+
+def dataRanges(fd, size):
+    '''Yield (start, end) tuples for the data ranges of a file, holes are
+    skipped using SEEK_DATA/SEEK_HOLE if the OS/fs supports it, if not the
+    whole file is one data range
+    '''
+
+    if not hasattr(os, "SEEK_DATA"):
+        yield (0, size)
+        return
+
+    position = 0
+    while position < size:
+        try:
+            start = os.lseek(fd, position, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # no more data, just a hole until the end
+                return
+            # no support, the rest is data
+            yield (position, size)
+            return
+
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield (start, min(end, size))
+        position = end
+
+def mergeRanges(ranges, align=1, size=None):
+    '''Sort and merge overlapping/contiguous (start, end) ranges, if align is
+    given the ranges are expanded to multiples of it (capped at size)'''
+
+    merged = []
+    for (start, end) in sorted(ranges):
+        start -= start % align
+        if end % align:
+            end += align - end % align
+        if size is not None:
+            end = min(end, size)
+
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+def copyRangeFile(src, dst, progressfn=None):
+    '''Copy src into dst in kernel space with os.copy_file_range, only the
+    data ranges of the source are copied, holes are kept as holes
+
+    Some filesystems (btrfs, xfs, nfs4.2) will share the blocks instead of
+    copying them
+
+    Return True on success or False if the OS/fs can't do it
+    '''
+
+    if not hasattr(os, "copy_file_range"):
+        return False
+
+    size = os.path.getsize(src)
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        sfd = s.fileno()
+        dfd = d.fileno()
+        try:
+            for (start, end) in dataRanges(sfd, size):
+                position = start
+                while position < end:
+                    count = min(copyChunkSize, end - position)
+                    copied = os.copy_file_range(sfd, dfd, count, position, position)
+                    if copied == 0:
+                        # source shrunk under our feet?
+                        raise OSError(errno.EIO, "Short copy of {} at {}".format(src, position))
+
+                    position += copied
+                    if progressfn:
+                        progressfn(position / size)
+        except OSError as e:
+            if e.errno in cloneUnsupported:
+                return False
+            raise
+
+        # the tail may be a hole
+        d.truncate(size)
+
+    return True
+
+def streamCopyFile(src, dst, progressfn=None):
+    '''Plain copy of src into dst on user space; chunks full of zeros are not
+    written but skipped with a seek, in this way the new file is sparse'''
+
+    size = os.path.getsize(src)
+    zeros = bytes(copyChunkSize)
+    position = 0
+
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        while True:
+            data = s.read(copyChunkSize)
+            if not data:
+                break
+
+            if data == zeros[:len(data)]:
+                d.seek(len(data), os.SEEK_CUR)
+            else:
+                d.write(data)
+
+            position += len(data)
+            if progressfn:
+                progressfn(position / size)
+
+        # set the real size, needed if the file ends in a hole
+        d.truncate(size)
+
+def cloneFile(src, dst, progressfn=None, clone=True, reflink=True, copyRange=True):
+    '''Clone/copy the file src into dst picking the fastest way the OS and
+    filesystem can do it:
+
+    - reflink: shared blocks, copy on write, instant and no extra disk.
+    - copy_range: in kernel copy, holes preserved.
+    - stream: user space copy, sparse output.
+
+    If clone is False only the stream copy is used; reflink & copyRange can
+    be set to False to skip a method already known to not work here (see
+    skyflash.tools.capabilities)
+
+    Return the method used as a string
+    '''
+
+    if clone:
+        if reflink and reflinkFile(src, dst):
+            if progressfn:
+                progressfn(1.0)
+            return "reflink"
+
+        if copyRange and copyRangeFile(src, dst, progressfn):
+            return "copy_range"
+
+    streamCopyFile(src, dst, progressfn)
+    return "stream"
+
+def patchFile(path, offset, data):
+    '''Write data on the file at path starting at offset, the rest of the
+    file is untouched (only the modified blocks are un-shared on a reflink)'''
+
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+
+# virtual images: a base image plus a node config block, with no image built on disk
+
+# the file extension of a virtual image
+virtualImageExtension = "vimg"
+
+class VirtualImage(io.RawIOBase):
+    '''A read only file like object that exposes the base image with the data
+    block patched in at offset, like if it was the real node image built on
+    disk
+
+    The base image is read directly, nothing is copied or written
+
+    The writer helpers (posix-build/streamio.py) use this one too, so the
+    flashers read what the build wrote
+    '''
+
+    def __init__(self, base, offset, data):
+        super(VirtualImage, self).__init__()
+        self.base = open(base, 'rb', buffering=0)
+        self.baseFile = base
+        self.size = os.fstat(self.base.fileno()).st_size
+        self.offset = offset
+        self.data = bytes(data)
+        self.position = 0
+
+        if offset + len(self.data) > self.size:
+            self.base.close()
+            raise ValueError("The config block does not fit inside the base image {}".format(base))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        '''Read from the base image and overlay the config block if needed'''
+
+        mv = memoryview(buffer).cast('B')
+        count = self.base.readinto(mv)
+        if not count:
+            return count
+
+        # overlay the data if the chunk read touches it
+        start = max(self.position, self.offset)
+        end = min(self.position + count, self.offset + len(self.data))
+        if start < end:
+            mv[start - self.position:end - self.position] = self.data[start - self.offset:end - self.offset]
+
+        self.position += count
+        return count
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.size
+
+        self.position = self.base.seek(position)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def dataRanges(self):
+        '''The data ranges of the base image plus the config block'''
+
+        ranges = list(dataRanges(self.base.fileno(), self.size))
+        ranges.append((self.offset, self.offset + len(self.data)))
+        return mergeRanges(ranges)
+
+    def close(self):
+        if not self.closed:
+            self.base.close()
+
+        super(VirtualImage, self).close()
+
+def writeVirtualImage(path, base, offset, data):
+    '''Write a virtual image descriptor on path, it's a small json file with
+    the base image path, the offset and the data block (hex encoded)'''
+
+    descriptor = {
+        'base': os.path.abspath(base),
+        'offset': offset,
+        'data': bytes(data).hex(),
+    }
+
+    with open(path, 'wt') as f:
+        json.dump(descriptor, f)
+
+def isVirtualImage(path):
+    '''Return True if the path is a virtual image descriptor'''
+
+    return path.split(".")[-1] == virtualImageExtension
+
+def openImage(path):
+    '''Open a image to read it, if it's a virtual image descriptor
+    a VirtualImage object is returned, if not a plain file object'''
+
+    if not isVirtualImage(path):
+        return open(path, 'rb')
+
+    with open(path, 'rt') as f:
+        descriptor = json.load(f)
+
+    return VirtualImage(descriptor['base'], int(descriptor['offset']), bytes.fromhex(descriptor['data']))
+
+def imageSize(path):
+    '''Return the size of the image in bytes, virtual images has the size
+    of it's base image'''
+
+    if not isVirtualImage(path):
+        return os.path.getsize(path)
+
+    with open(path, 'rt') as f:
+        descriptor = json.load(f)
+
+    return os.path.getsize(descriptor['base'])
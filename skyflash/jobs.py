@@ -0,0 +1,260 @@
+# part of skyflash
+# job scheduler: named jobs with dependencies, cancel tokens and resource limits
+
+import logging
+import threading
+
+# job states
+jobPending = "pending"
+jobRunning = "running"
+jobDone = "done"
+jobFailed = "failed"
+jobCanceled = "canceled"
+
+# default units of each resource, a job not listing a resource is not limited
+# by it: one download at a time and two disk heavy jobs (extract, verify,
+# build) at the same time
+jobDefaultLimits = {
+    'network': 1,
+    'disk': 2,
+}
+
+class JobCanceled(Exception):
+    '''Raised inside a job when it's canceled, see CancelToken.check()'''
+
+    pass
+
+class CancelToken(object):
+    '''A flag to cancel a running job, the job must poll it; it's callable
+    returning True once canceled, so it can be passed as the "canceled"
+    callback of the download & extraction helpers'''
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        '''Raise JobCanceled if the job was canceled'''
+
+        if self.event.is_set():
+            raise JobCanceled()
+
+    def __call__(self):
+        return self.event.is_set()
+
+class Job(object):
+    '''A named unit of work for the JobScheduler
+
+    - start: a callable that gets the job and starts the real work
+      (on a thread pool for example), the owner of the work must call
+      JobScheduler.finish() when it ends.
+    - after: names of the jobs that must end before this one starts, if one
+      of them fails or is canceled this one is canceled too.
+    - resources: a dict with the units of each resource it uses, like
+      {'network': 1, 'disk': 1}.
+    - dropped: a callable that gets the job if it's canceled before it
+      starts, to clean up what the caller set for it.
+    '''
+
+    def __init__(self, name, start, after=(), resources=None, dropped=None):
+        self.name = name
+        self.start = start
+        self.dropped = dropped
+        self.after = tuple(after)
+        self.resources = dict(resources or {})
+        self.token = CancelToken()
+        self.state = jobPending
+        self.error = None
+
+    def active(self):
+        return self.state in (jobPending, jobRunning)
+
+class JobScheduler(object):
+    '''Start the jobs when their dependencies are satisfied and there are
+    free units of the resources they need, in the order they were submitted
+
+    Only one job with a given name can be active (pending or running) at a
+    time; a dependency on a job that is not active is already satisfied
+    '''
+
+    def __init__(self, limits=None):
+        self.limits = dict(jobDefaultLimits if limits is None else limits)
+        self.jobs = {}
+        self.order = []
+        self.used = {}
+        self.lock = threading.RLock()
+        # jobs canceled before they start, see notifyDropped()
+        self.droppedJobs = []
+
+    def setLimits(self, limits):
+        '''Change the resource limits, it applies to the next jobs started'''
+
+        with self.lock:
+            self.limits.update(limits)
+
+        self.schedule()
+
+    def submit(self, job):
+        '''Queue a job, it starts right away if it can; return False if a
+        job with the same name is active'''
+
+        with self.lock:
+            old = self.jobs.get(job.name)
+            if old is not None and old.active():
+                logging.debug("Job {} is already {}".format(job.name, old.state))
+                return False
+
+            self.jobs[job.name] = job
+            self.order.append(job.name)
+
+        logging.debug("Job {} queued, after {}, using {}".format(job.name, job.after, job.resources))
+        self.schedule()
+        return True
+
+    def job(self, name):
+        '''The last job with that name or None'''
+
+        return self.jobs.get(name)
+
+    def token(self, name):
+        '''The cancel token of the job with that name or None'''
+
+        job = self.jobs.get(name)
+        return job.token if job is not None else None
+
+    def isActive(self, name):
+        '''Return True if a job with that name is pending or running'''
+
+        job = self.jobs.get(name)
+        return job is not None and job.active()
+
+    def active(self):
+        '''The names of the jobs pending or running'''
+
+        with self.lock:
+            return [name for name in self.order if self.jobs[name].active()]
+
+    def fits(self, job):
+        for (resource, units) in job.resources.items():
+            limit = self.limits.get(resource)
+            if limit is not None and self.used.get(resource, 0) + units > max(limit, units):
+                return False
+
+        return True
+
+    def waiting(self, job):
+        '''Return True if a dependency of the job is still active'''
+
+        for name in job.after:
+            dep = self.jobs.get(name)
+            if dep is not None and dep is not job and dep.active():
+                return True
+
+        return False
+
+    def schedule(self):
+        '''Start all the pending jobs that can run now'''
+
+        ready = []
+        with self.lock:
+            # forget the ended jobs, the last one by name is kept on jobs
+            self.order = [name for name in self.order if self.jobs[name].active()]
+
+            for name in self.order:
+                job = self.jobs[name]
+                if job.state != jobPending or self.waiting(job) or not self.fits(job):
+                    continue
+
+                for (resource, units) in job.resources.items():
+                    self.used[resource] = self.used.get(resource, 0) + units
+
+                job.state = jobRunning
+                ready.append(job)
+
+        for job in ready:
+            logging.debug("Job {} started".format(job.name))
+            try:
+                job.start(job)
+            except Exception as e:
+                job.error = e
+                self.finish(job.name)
+                raise
+
+    def finish(self, name, error=None):
+        '''Mark the running job as ended (with an error if given or if one was
+        set on the job), the jobs depending on a failed one are canceled'''
+
+        with self.lock:
+            job = self.jobs.get(name)
+            if job is None or job.state != jobRunning:
+                return
+
+            for (resource, units) in job.resources.items():
+                self.used[resource] -= units
+
+            if error is not None:
+                job.error = error
+
+            if job.token.cancelled:
+                job.state = jobCanceled
+            elif job.error is not None:
+                job.state = jobFailed
+            else:
+                job.state = jobDone
+
+            if job.state != jobDone:
+                self.cancelDependents(name)
+
+        logging.debug("Job {} {}".format(name, job.state))
+        self.notifyDropped()
+        self.schedule()
+
+    def cancelDependents(self, name):
+        '''Cancel the pending jobs that depends on name, call it with the lock
+        held'''
+
+        for other in self.order:
+            job = self.jobs[other]
+            if job.state == jobPending and name in job.after:
+                job.token.cancel()
+                job.state = jobCanceled
+                self.droppedJobs.append(job)
+                logging.debug("Job {} canceled, {} did not end well".format(other, name))
+                self.cancelDependents(other)
+
+    def cancel(self, name):
+        '''Cancel a job: a pending one is dropped, a running one gets it's
+        token set and must stop by itself; return True if it was active'''
+
+        with self.lock:
+            job = self.jobs.get(name)
+            if job is None or not job.active():
+                return False
+
+            job.token.cancel()
+            if job.state == jobPending:
+                job.state = jobCanceled
+                self.droppedJobs.append(job)
+                self.cancelDependents(name)
+
+        logging.debug("Job {} canceled".format(name))
+        self.notifyDropped()
+        return True
+
+    def notifyDropped(self):
+        '''Call the dropped callback of the jobs canceled before they
+        started, out of the lock'''
+
+        with self.lock:
+            dropped = self.droppedJobs
+            self.droppedJobs = []
+
+        for job in dropped:
+            if job.dropped:
+                job.dropped(job)
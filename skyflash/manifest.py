@@ -0,0 +1,182 @@
+# part of skyflash
+# chunked Merkle manifests: the hashes of the fixed size chunks of a image
+
+import os
+import json
+import hashlib
+
+# local imports
+from skyflash.hashing import merkleRoot, ChunkHash, hashChunks
+
+# the version of the manifest file format
+manifestVersion = 1
+
+# the manifest file extension, it's next to the image: "Skybian-v0.1.0.img.manifest"
+manifestExtension = "manifest"
+
+# defaults for new manifests
+manifestChunkSize = 4 * 1024 * 1024
+manifestAlgorithm = "sha256"
+
+def manifestPath(image):
+    '''The path of the manifest of a image'''
+
+    return image + "." + manifestExtension
+
+def isManifest(path):
+    '''Return True if the path is a manifest file'''
+
+    return path.split(".")[-1] == manifestExtension
+
+class Manifest(object):
+    '''The hashes of the fixed size chunks of a image and the root of the
+    Merkle tree of them, the last chunk may be partial; it may have the whole
+    file digests of the image too (the ones it was verified against)
+
+    It's stored next to the image as a json file, see manifestPath()
+    '''
+
+    def __init__(self, size, chunks, chunkSize=manifestChunkSize, algorithm=manifestAlgorithm, digests=None):
+        self.size = size
+        self.chunks = list(chunks)
+        self.chunkSize = chunkSize
+        self.algorithm = algorithm
+        self.digests = dict(digests or {})
+
+        if len(self.chunks) != self.count():
+            raise ValueError("The manifest has {} chunks, it must have {}".format(len(self.chunks), self.count()))
+
+    @classmethod
+    def fromHash(cls, size, hasher, digests=None):
+        '''Build the manifest from a ChunkHash that was feed with the image'''
+
+        return cls(size, hasher.digests(), hasher.chunkSize, hasher.algorithm, digests)
+
+    @classmethod
+    def fromFile(cls, path, workers=0, progressfn=None, chunkSize=manifestChunkSize, algorithm=manifestAlgorithm):
+        '''Build the manifest of a image hashing it's chunks in parallel'''
+
+        chunks = hashChunks(path, chunkSize, algorithm, workers, progressfn)
+        return cls(os.path.getsize(path), chunks, chunkSize, algorithm)
+
+    @classmethod
+    def load(cls, path):
+        '''Load a manifest file, raise a ValueError if it's not valid'''
+
+        with open(path, 'rt') as f:
+            data = json.load(f)
+
+        if data.get('version') != manifestVersion:
+            raise ValueError("Unknown manifest version {}".format(data.get('version')))
+
+        manifest = cls(data['size'], [bytes.fromhex(c) for c in data['chunks']], data['chunkSize'], data['algorithm'], data.get('digests'))
+        if manifest.root() != data['root']:
+            raise ValueError("The manifest {} is corrupt, the Merkle root differs".format(path))
+
+        return manifest
+
+    def save(self, path):
+        '''Write the manifest file atomically'''
+
+        data = {
+            'version': manifestVersion,
+            'size': self.size,
+            'chunkSize': self.chunkSize,
+            'algorithm': self.algorithm,
+            'root': self.root(),
+            'digests': self.digests,
+            'chunks': [c.hex() for c in self.chunks],
+        }
+
+        tmp = path + ".tmp"
+        with open(tmp, 'wt') as f:
+            json.dump(data, f, indent=1)
+
+        os.replace(tmp, path)
+
+    def count(self):
+        '''The number of chunks of the image'''
+
+        return (self.size + self.chunkSize - 1) // self.chunkSize
+
+    def chunkRange(self, index):
+        '''The (start, end) of a chunk on the image'''
+
+        start = index * self.chunkSize
+        return (start, min(start + self.chunkSize, self.size))
+
+    def chunksOf(self, start, end):
+        '''The indexes of the chunks that holds the bytes from start to end'''
+
+        return range(start // self.chunkSize, (end + self.chunkSize - 1) // self.chunkSize)
+
+    def root(self):
+        '''The root of the Merkle tree of the chunks, as hex'''
+
+        return merkleRoot(self.chunks, self.algorithm).hex()
+
+    def hashChunk(self, data):
+        '''The hash of a chunk of data'''
+
+        return hashlib.new(self.algorithm, data).digest()
+
+    def check(self, index, data):
+        '''Return True if the data is the chunk at index'''
+
+        return self.hashChunk(data) == self.chunks[index]
+
+    def badChunks(self, stream, indexes=None):
+        '''Read the chunks (all if no indexes are given) from stream, a
+        seekable file like object with the image, and return the indexes of
+        the ones that differs from the manifest'''
+
+        bad = []
+        for index in (range(self.count()) if indexes is None else indexes):
+            (start, end) = self.chunkRange(index)
+            stream.seek(start)
+            data = stream.read(end - start)
+            if len(data) != end - start or not self.check(index, data):
+                bad.append(index)
+
+        return bad
+
+    def verifyFile(self, path, workers=0, progressfn=None):
+        '''Hash the chunks of the image at path in parallel and return the
+        indexes of the ones that differs from the manifest'''
+
+        if os.path.getsize(path) != self.size:
+            return list(range(self.count()))
+
+        chunks = hashChunks(path, self.chunkSize, self.algorithm, workers, progressfn)
+        return [index for (index, chunk) in enumerate(chunks) if chunk != self.chunks[index]]
+
+    def patched(self, stream, start, end):
+        '''Return a new manifest for a image that is this one with the bytes
+        from start to end modified, stream is a seekable file like object with
+        the new image; only the chunks touched are read and hashed, the whole
+        file digests are not valid for the new image so they are dropped'''
+
+        chunks = list(self.chunks)
+        for index in self.chunksOf(start, end):
+            (cstart, cend) = self.chunkRange(index)
+            stream.seek(cstart)
+            chunks[index] = self.hashChunk(stream.read(cend - cstart))
+
+        return Manifest(self.size, chunks, self.chunkSize, self.algorithm)
+
+def newChunkHash():
+    '''A ChunkHash to build a manifest with the default parameters'''
+
+    return ChunkHash(manifestChunkSize, manifestAlgorithm)
+
+def loadManifest(image):
+    '''Load the manifest of a image, None if there is not or it's not valid'''
+
+    path = manifestPath(image)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        return Manifest.load(path)
+    except (OSError, ValueError, KeyError):
+        return None
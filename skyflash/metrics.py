@@ -0,0 +1,180 @@
+# part of skyflash
+# metrics of the pipeline stages: start/end, bytes, throughput, chunks,
+# retries and outcome of each download, extract, verify, build, flash &
+# detect, recorded as json lines next to the log
+
+import json
+import time
+import socket
+import logging
+import threading
+
+# the stages of the pipeline
+stageNames = ("download", "extract", "verify", "build", "flash", "detect")
+
+# outcomes of a stage
+stageOk = "ok"
+stageFailed = "failed"
+stageCanceled = "canceled"
+
+# the metrics file, on the same folder of skyflash.log
+metricsFileName = "metrics.jsonl"
+
+class Stage(object):
+    '''A stage in progress, the work feeds it with the bytes moved and the
+    chunks (reads, writes, images...) as it goes and end() records it
+
+    A stage with no recorder is not recorded, it's handy to call the
+    instrumented code outside of a job
+    '''
+
+    def __init__(self, recorder, name, key="", retries=0, **info):
+        self.recorder = recorder
+        self.name = name
+        self.key = key
+        self.retries = retries
+        self.info = dict(info)
+        self.start = time.time()
+        self.begin = time.monotonic()
+        self.bytes = 0
+        self.chunks = 0
+        self.outcome = None
+        self.error = ""
+        self.event = None
+        self.lock = threading.Lock()
+
+    def add(self, count, chunks=1):
+        '''Some more bytes moved in that chunks'''
+
+        with self.lock:
+            self.bytes += count
+            self.chunks += chunks
+
+    def update(self, done, chunks=None):
+        '''The bytes moved so far (a progress callback), a chunk more or the
+        chunks so far if given'''
+
+        with self.lock:
+            self.bytes = max(self.bytes, int(done))
+            self.chunks = self.chunks + 1 if chunks is None else chunks
+
+    def set(self, **info):
+        '''Add details of the stage: the image, the method, the device...'''
+
+        with self.lock:
+            self.info.update(info)
+
+    def fail(self, error=""):
+        '''Flag the stage as failed, the work ended but not well (a bad
+        checksum, a truncated download...)'''
+
+        self.outcome = stageFailed
+        self.error = str(error)
+
+    def end(self, outcome=stageOk, error=""):
+        '''Close the stage and record it, the outcome flagged by fail() wins
+        over the one given; return the event (just the first call counts)'''
+
+        with self.lock:
+            if self.event is not None:
+                return self.event
+
+            seconds = time.monotonic() - self.begin
+            outcome = self.outcome or outcome
+            self.event = {
+                'stage': self.name,
+                'key': self.key,
+                'host': socket.gethostname(),
+                'start': round(self.start, 3),
+                'end': round(self.start + seconds, 3),
+                'seconds': round(seconds, 3),
+                'bytes': self.bytes,
+                'throughput': round(self.bytes / seconds, 1) if seconds > 0 else 0,
+                'chunks': self.chunks,
+                'retries': self.retries,
+                'outcome': outcome,
+                'error': self.error or (str(error) if outcome != stageOk and error else ""),
+                'info': self.info,
+            }
+
+        if self.recorder is not None:
+            self.recorder.record(self.event)
+
+        return self.event
+
+class MetricsRecorder(object):
+    '''Record the stages as json lines (one event per stage) on a file and
+    pass them to the listeners (exporters); the retries of a stage are the
+    attempts of the same stage & key that did not end well right before it'''
+
+    def __init__(self, path=None, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.failures = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def setPath(self, path, enabled=True):
+        '''Where to write the events, None to just pass them to the listeners'''
+
+        with self.lock:
+            self.path = path
+            self.enabled = enabled
+
+    def addListener(self, listener):
+        '''A callable that gets each event recorded'''
+
+        with self.lock:
+            self.listeners.append(listener)
+
+    def start(self, name, key="", **info):
+        '''Start a stage, see Stage'''
+
+        with self.lock:
+            retries = self.failures.get((name, key), 0)
+
+        return Stage(self, name, key, retries, **info)
+
+    def record(self, event):
+        '''Write the event of a ended stage and pass it to the listeners'''
+
+        slot = (event['stage'], event['key'])
+        with self.lock:
+            if event['outcome'] == stageOk:
+                self.failures.pop(slot, None)
+            else:
+                self.failures[slot] = self.failures.get(slot, 0) + 1
+
+            if self.enabled and self.path:
+                try:
+                    with open(self.path, 'at') as f:
+                        f.write(json.dumps(event, sort_keys=True) + "\n")
+                except OSError as e:
+                    logging.debug("Can't write the metrics to {}: {}".format(self.path, e))
+
+            listeners = list(self.listeners)
+
+        logging.debug("Stage {} {} {} in {}s, {} bytes".format(event['stage'], event['key'], event['outcome'], event['seconds'], event['bytes']))
+
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logging.debug("Metrics listener failed: {}".format(e))
+
+def loadEvents(path):
+    '''Read the events of a metrics file, a list of dicts; the broken lines
+    (a crash while writing) are skipped'''
+
+    events = []
+    try:
+        with open(path, 'rt') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    pass
+    except OSError:
+        pass
+
+    return events
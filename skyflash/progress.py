@@ -0,0 +1,93 @@
+# part of skyflash
+# progress reporting: throttle and coalesce the updates to the UI
+
+import time
+import threading
+
+# defaults of the reporter: at most one update each 0.1 seconds and only if
+# the percent changed by 0.1 or more, or each second no matter the change
+# (the text may have changed: speed, ETA, bytes so far...)
+progressInterval = 0.1
+progressDelta = 0.1
+progressIdle = 1.0
+
+class ProgressReporter(object):
+    '''Pass the progress of a task to emit(percent, text) at a sane rate
+
+    The tasks call update() on each chunk, the updates are coalesced and
+    only the last one is emitted when it's due: after interval seconds if the
+    percent changed by delta or more, or after idle seconds if not; the first
+    update and the end (100%) are always emitted
+
+    The text is built by formatter(percent, *args) only when the update is
+    emitted, so a dropped update costs no string formatting; it can be
+    updated from several threads (parallel download segments)
+    '''
+
+    def __init__(self, emit, formatter, interval=progressInterval, delta=progressDelta, idle=progressIdle, clock=time.monotonic):
+        self.emit = emit
+        self.formatter = formatter
+        self.interval = interval
+        self.delta = delta
+        self.idle = idle
+        self.clock = clock
+
+        self.lastTime = None
+        self.lastPercent = None
+        self.pending = None
+        self.emitted = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def due(self, percent, now):
+        '''Return True if a update with this percent must be emitted now'''
+
+        if self.lastTime is None or (percent >= 100 and self.lastPercent < 100):
+            return True
+
+        elapsed = now - self.lastTime
+        if elapsed >= self.idle:
+            return True
+
+        return elapsed >= self.interval and abs(percent - self.lastPercent) >= self.delta
+
+    def update(self, percent, *args):
+        '''A new progress of the task, percent is 0-100 (or -1 if unknown),
+        args are passed to the formatter'''
+
+        now = self.clock()
+        with self.lock:
+            if not self.due(percent, now):
+                self.pending = (percent, args)
+                self.dropped += 1
+                return
+
+            self.mark(percent, now)
+
+        self.emit(percent, self.formatter(percent, *args))
+
+    def mark(self, percent, now):
+        '''Record a update as emitted, call it with the lock held'''
+
+        self.lastTime = now
+        self.lastPercent = percent
+        self.pending = None
+        self.emitted += 1
+
+    def flush(self):
+        '''Emit the last update if it was held back'''
+
+        with self.lock:
+            if self.pending is None:
+                return
+
+            (percent, args) = self.pending
+            self.mark(percent, self.clock())
+
+        self.emit(percent, self.formatter(percent, *args))
+
+    def fraction(self, fraction, *args):
+        '''Same as update() but with the progress as a fraction (0.0-1.0),
+        handy as the progressfn of the hashing & imaging helpers'''
+
+        self.update(fraction * 100, *args)
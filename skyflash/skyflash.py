@@ -7,28 +7,35 @@ import sys
 import webbrowser
 import time
 import tarfile
-import ssl
-import hashlib
 import logging
 import subprocess
+import shlex
 import enum
 import string
 import tempfile
 import time
 import configparser
-from urllib.request import Request, urlopen
 
 # GUI imports
 from PyQt5.QtGui import QGuiApplication, QIcon
 from PyQt5.QtQml import QQmlApplicationEngine
-from PyQt5.QtCore import QThreadPool, QTimer, pyqtProperty
+from PyQt5.QtCore import QThreadPool, pyqtProperty
 
 # New imports
 from skyflash.utils import *
-
-# image config file position and size
-imageConfigAddress = 12582912
-imageConfigDataSize = 256
+from skyflash.imaging import *
+from skyflash.download import *
+from skyflash.cache import *
+from skyflash.verification import *
+from skyflash.hashing import *
+from skyflash.manifest import *
+from skyflash.devices import *
+from skyflash.cluster import *
+from skyflash.tools import *
+from skyflash.jobs import *
+from skyflash.progress import *
+from skyflash.metrics import *
+from skyflash.exporter import *
 
 # skybian URL
 defaultSkybianUrl = "https://github.com/skycoin/skybian/releases/download/Skybian-v0.0.4/Skybian-v0.0.4.tar.xz"
@@ -65,9 +72,19 @@ class Skyflash(QObject):
     builtImages = []
     flashingNow = []
     flashingOnProgress = False
+    flashingDevices = {}
+    flashQueues = {}
+    flashResults = {}
+    jobWorkers = {} # the workers of the running jobs by name
     appFolder = ""
     bundle = False
     skybianUrl = ""
+    downloadUrl = "" # the url of the last download, empty for local files
+    verifications = None
+    forceVerification = False
+    digests = {} # all the digests known for the skybian image
+    manifest = None # chunked manifest of the skybian image, built while verified
+    imageCache = None
     skybianUpdated = False # true: updated, false: not, none tried but failed
 
     #### registering Signals to emit to QML GUI
@@ -121,10 +138,14 @@ class Skyflash(QObject):
 
     # warn the UI that the list of cards has been changed
     cardsChanged = pyqtSignal()
+    # a new snapshot of the cards, emitted from the card monitor thread
+    cardsSnapshot = pyqtSignal(object)
     # warn the UI that the list of images has been changed
     builtImagesChanged = pyqtSignal()
     # flash process show
     fsProg = pyqtSignal(float, arguments=["percent"])
+    # flash process of a particular device
+    fcProg = pyqtSignal(str, float, str, arguments=["device", "percent", "data"])
 
     # download flags
     downloadActive = False
@@ -138,6 +159,8 @@ class Skyflash(QObject):
 
     # extraction flags
     extractionOk = False
+    streamed = False
+    streamVerified = False
 
     # checksum vars
     cksumOk = False
@@ -150,11 +173,30 @@ class Skyflash(QObject):
     # thread pool
     threadpool = QThreadPool()
 
-    # timer or card detection
-    timer = QTimer()
+    # job scheduler, the background tasks runs as named jobs with dependencies
+    # and resource limits, see startJob()
+    jobs = JobScheduler()
+
+    # thread pool for the flash jobs, one thread per device being flashed
+    flashPool = QThreadPool()
+
+    # card detection on a background thread, see timerStart()
+    cardMonitor = None
+
+    # metrics of the pipeline stages, the running ones by job name and the
+    # last cards detected, see startJob() & scanCards()
+    metrics = MetricsRecorder()
+    jobStages = {}
+    lastDetected = None
+
+    # the stages exported for Prometheus, see metricsSetup()
+    exporter = MetricsExporter()
+    metrics.addListener(exporter.observe)
+    metricsSettings = None
 
     # set the timeout for threads on done
     threadpool.setExpiryTimeout(500)
+    flashPool.setExpiryTimeout(500)
 
     # callbacks to emit signals to QML and others
 
@@ -291,8 +333,21 @@ class Skyflash(QObject):
         if self.cksumOk:
             # success must call for a sha1sum check
             logging.debug("Checksum verification success!")
+            # a image served from the cache has it's version set already
+            cache = self.getCache()
+            if cache is None or not cache.contains(self.skybianFile):
+                self.skybianFileVersion = self.getSkybianVersion(self.skybianFile)
+                self.skybianFile = self.cacheImage(cache)
+
+            # remember it's verified
+            self.getVerifications().record(self.skybianFile, self.digestAlgorithm, self.digest, True)
+
+            # the manifest of chunks goes next to the image
+            if self.manifest is not None:
+                self.manifest.save(manifestPath(self.skybianFile))
+                self.manifest = None
+
             # next step
-            self.skybianFileVersion = self.getSkybianVersion(self.skybianFile)
             self.netConfig.emit()
             self.buildImages.emit()
 
@@ -384,61 +439,74 @@ class Skyflash(QObject):
 
     # flash ones
 
-    def flashProg(self, percent, data):
-        '''Update two progressbar and a status bar in the UI
+    def flashProg(self, device, percent, data):
+        '''Update the progressbar and the status bar in the UI for a device
 
-        The data is to update the status bar
+        Each device has it's own progress signal, the single progress bar and
+        the status bar follows the card selected in the UI
         '''
 
-        # split data
-        self.fsProg.emit(percent)
-        self.setStatus.emit(data)
+        self.fcProg.emit(device, percent, data)
 
-    def flashResult(self, data):
-        ''''''
+        if device == self.card:
+            self.fsProg.emit(percent)
+            self.setStatus.emit(data)
 
-        # restart the timer
-        self.timerStart()
+    def flashResult(self, device, data):
+        '''Receive the result of the flash of a device'''
 
-        pass
+        self.flashResults[device] = data
 
-    def flashError(self, error):
+    def flashError(self, device, error):
         '''Catch any error on the image flash process and pass it to the user'''
 
-        # restart the timer
-        self.timerStart()
         self.setStatus.emit("An error ocurred while flashing the images")
         etype, eval, etrace = error
-        logging.debug("An error ocurred while flashing the images:\n{}".format(eval))
-        self.uiError.emit("Flash failed!", "The flash process failed, please check the logs to see more details", str(eval))
+        logging.debug("An error ocurred while flashing the images on {}:\n{}".format(device, eval))
+        self.uiError.emit("Flash failed!", "The flash process failed on {}, please check the logs to see more details".format(device), str(eval))
 
-        # reset the fail safe trigger
-        self.flashingOnProgress = False
+        # flag it as failed, the done callback will follow
+        self.flashResults[device] = "Error"
 
-    def flashDone(self, data):
-        '''Catch the end of the flash process'''
+    def flashDone(self, device):
+        '''Catch the end of the flash process on a device, start the next
+        job in the queue of that device if any'''
 
-        # restart the timer
-        self.timerStart()
+        image = self.flashingDevices.pop(device, "")
+        result = self.flashResults.pop(device, "")
+        name = shortenPath(image, -1)
 
-        # user feedback
-        msg = """Congratulations, you have flashed it successfully!
+        if result == "Done":
+            # user feedback
+            msg = """Congratulations, you have flashed {} on {} successfully!
 To flash the next image just follow these steps:
   1. Remove the actual card from your PC
   2. Insert the next node card into the slot
   3. Pick the proper device in the combo box
   4. Pick the next desired image from the combo box 
-  5. Click the Flash button and wait until it finish"""  
-        self.uiOk.emit("Image flashing succeeded!", msg)
+  5. Click the Flash button and wait until it finish""".format(name, device)
+            self.uiOk.emit("Image flashing succeeded!", msg)
+            self.setStatus.emit("Flash process of {} on {} was a success!".format(name, device))
 
-        self.setStatus.emit("Flash process was a success!")
+            # config update
+            self.config['MAIN']['setup'] = 'yes'
+            self.save_config()
+        elif result != "Error":
+            # errors are reported already, this is a failure with no error
+            self.uiWarning.emit("Ops!", "The flash process of {} on {} did not end well, please check the logs and try again.".format(name, device))
 
-        # reset the fail safe trigger
-        self.flashingOnProgress = False
+        # next job on this device queue if any
+        if self.flashQueues.get(device):
+            self.flashStart(device, self.flashQueues[device].pop(0))
+            return
 
-        # config update
-        self.config['MAIN']['setup'] == 'yes'
-        self.save_config()
+        self.flashQueues.pop(device, None)
+
+        # reset the fail safe trigger & look for the cards again if nothing
+        # else is flashing, the flashed one has new partitions
+        if len(self.flashingDevices) == 0:
+            self.flashingOnProgress = False
+            self.timerStart()
 
     def checkUpdatesResult(self, data):
         '''Receive the result of the check for updates via data
@@ -543,7 +611,9 @@ To flash the next image just follow these steps:
                     skbURLVer = self.getSkybianVersion(data)
 
                     # if a new version alert the user and reset the interface
-                    if skbURLVer != self.skybianFileVersion:
+                    if skbURLVer != self.skybianFileVersion and self.cachedSkybian(data):
+                        self.setStatus.emit("Using the cached Skybian {}".format(skbURLVer))
+                    elif skbURLVer != self.skybianFileVersion:
                         self.uiWarning.emit("New version of Skybian", "We have detected a new version of Skybian, please download the new version")
                         eraseOldVersions(self.localPathDownloads, "---")
                         self.sStart.emit()
@@ -566,6 +636,67 @@ To flash the next image just follow these steps:
             # already
             logging.debug("Skybian URL already updated")
 
+    def getCache(self):
+        '''Return the cache of verified skybian images, None if it's disabled
+        in the CACHE section of the config'''
+
+        if self.imageCache is None and self.config.getboolean('CACHE', 'enabled', fallback=True):
+            budget = self.config.getint('CACHE', 'budget', fallback=cacheDefaultBudget // (1024 * 1024))
+            entries = self.config.getint('CACHE', 'entries', fallback=cacheDefaultEntries)
+            self.imageCache = ImageCache(os.path.join(self.localPath, "cache"), budget * 1024 * 1024, entries)
+
+        return self.imageCache
+
+    def cacheImage(self, cache):
+        '''Move the verified skybian image to the cache, return the new path
+        of the image or the same one if the cache is disabled or fails'''
+
+        if cache is None:
+            return self.skybianFile
+
+        try:
+            return cache.add(self.skybianFile, self.skybianFileVersion, self.downloadUrl, self.digestAlgorithm, self.digest)
+        except OSError as e:
+            logging.debug("Can't cache the image {}: {}".format(self.skybianFile, e))
+            return self.skybianFile
+
+    def cachedSkybian(self, url):
+        '''Serve the skybian image for url from the cache, without network
+        and with no re-verification (it was verified when cached)
+
+        Return True on a cache hit
+        '''
+
+        cache = self.getCache()
+        if cache is None:
+            return False
+
+        try:
+            version = self.getSkybianVersion(url)
+        except IndexError:
+            # not a release url
+            version = None
+
+        (path, entry) = cache.lookup(version, url)
+        if path is None:
+            return False
+
+        logging.debug("Cache hit for {}: {}".format(url, path))
+
+        self.skybianFile = path
+        self.skybianFileVersion = entry['version']
+        self.digestAlgorithm = entry['algorithm']
+        self.digest = entry['digest']
+        self.downloadOk = True
+        self.extractionOk = True
+        self.cksumOk = True
+
+        self.dDone.emit()
+        self.dData.emit("Skybian {} base image verified! (cached)".format(entry['version']))
+        self.cksumDone()
+
+        return True
+
     @pyqtSlot()
     def downloadSkybian(self):
         '''Slot that receives the start download signal from the UI'''
@@ -580,9 +711,12 @@ To flash the next image just follow these steps:
 
             return
 
-        # check if there is a thread already working there
-        downCount = self.threadpool.activeThreadCount()
-        if downCount < 1:
+        # check if there is a download already working there
+        if not self.jobs.isActive("download"):
+            # already downloaded and verified?
+            if self.cachedSkybian(self.skybianUrl):
+                return
+
             # rise flag
             self.downloadActive = True
 
@@ -590,18 +724,17 @@ To flash the next image just follow these steps:
             self.dData.emit("Downloading...")
 
             # init download process
-            self.down = Worker(self.skyDown)
-            self.down.signals.data.connect(self.downloadFileData)
-            self.down.signals.progress.connect(self.downloadFileProg)
-            self.down.signals.result.connect(self.downloadFileResult)
-            self.down.signals.error.connect(self.downloadFileError)
-            self.down.signals.finished.connect(self.downloadFileDone)
-
-            # init worker
-            self.threadpool.start(self.down)
+            self.startJob("download", self.skyDown,
+                          data=self.downloadFileData,
+                          progress=self.downloadFileProg,
+                          result=self.downloadFileResult,
+                          error=self.downloadFileError,
+                          finished=self.downloadFileDone,
+                          resources={'network': 1, 'disk': 1})
         else:
             # if you clicked it during a download, then you want to cancel
-            # just rise the flag an the thread will catch it and stop
+            # just cancel the job an the thread will catch it and stop
+            self.jobs.cancel("download")
             self.downloadActive = False
             self.downloadOk = False
 
@@ -616,96 +749,103 @@ To flash the next image just follow these steps:
         Result returned must be string and in this case will be the
         path for the downloaded file or an empty string on error/cancel
 
+        The download is resumable: the data goes to a '.part' file with a
+        sidecar state file, a new try resumes from there. If 'segments' in the
+        DOWNLOAD section of the config is more than 1 the file is downloaded
+        in parallel segments (if the server allows it)
+
+        If the download is a tar archive and streaming is enabled in the
+        DOWNLOAD section of the config (the default) the archive is extracted
+        and the image hashed while it's downloaded, in one pass; in that
+        case the path returned is the one of the image (no segments here)
+
         This method is wrapped by the thread and will catch any errors
         upstream so no need to handle it here
         '''
 
         # get the URL from the object
         url = self.skybianUrl
+        self.downloadUrl = url
 
         # DEBUG
         logging.debug("Downloading from: {}".format(url))
 
         headers = {}
         headers['User-Agent'] = "Mozilla/5.0 (X11; Linux i686) AppleWebKit/537.17 (KHTML, like Gecko) Chrome/24.0.1312.27 Safari/537.17"
-        r = Request(url, headers=headers)
 
-        if url.startswith("https"):
-            # prepare the https context
-            scontext = ssl.SSLContext(ssl.PROTOCOL_TLS)
-            req = urlopen(r, context=scontext)
-        else:
-            req = urlopen(r)
+        # extract filename
+        fileName = url.split("/")[-1]
+        filePath = os.path.join(self.localPathDownloads, fileName)
+        streaming = self.config.getboolean('DOWNLOAD', 'streaming', fallback=True) and ".tar" in fileName
+        segments = 1 if streaming else self.config.getint('DOWNLOAD', 'segments', fallback=1)
+
+        # DEBUG
+        logging.debug("Downloading to: {}".format(filePath))
 
         # check if we have a size or it's not known (wtf Github!)
-        info = req.info()
-        if not "Content-Length" in info:
-            self.downloadSize = -1
+        down = ResumableDownload(url, filePath, segments, headers=headers)
+        self.downloadSize = down.probe()
+        if self.downloadSize < 0:
             logging.debug("Download file size is unknown...")
         else:
-            self.downloadSize = int(req.info()['Content-Length'])
             logging.debug("Download file size is {:0.1f}MB".format(self.downloadSize/1000/1000))
 
-        # extract filename
-        fileName = url.split("/")[-1]
-
         # emit data of the download
         if self.downloadSize > 0:
             data_callback.emit("{}, {:04.1f} MB".format(fileName, self.downloadSize/1000/1000))
         else:
             data_callback.emit("Downloading {}...".format(fileName))
 
-        # start download
-        downloadedChunk = 0
+        # resumed downloads start with some data
+        startTime = time.time()
+        startChunk = down.done
 
-        # chuck size @ 100KB
-        blockSize = 102400
-        filePath = os.path.join(self.localPathDownloads, fileName)
-        startTime = 0
-        elapsedTime = 0
+        # metrics, just the bytes moved this time
+        stage = self.jobStage("download")
+        stage.set(url=url, size=self.downloadSize, segments=down.segments, streaming=streaming, resumed=startChunk)
 
-        # DEBUG
-        logging.debug("Downloading to: {}".format(filePath))
+        def downloadText(progress, downloadedChunk):
+            '''Calc speed and ETA for the UI, only for the updates emitted'''
 
-        with open(filePath, "wb") as downFile:
-            startTime = time.time()
-            while True:
-                chunk = req.read(blockSize)
-                if not chunk:
-                    logging.debug("Download Complete.")
-                    break
+            # calc speed and ETA
+            elapsedTime = time.time() - startTime
+            bps = int(max(0, downloadedChunk - startChunk)/elapsedTime) if elapsedTime > 0 else 0 # b/s
+            if self.downloadSize > 0:
+                etas = int((self.downloadSize - downloadedChunk)/bps) if bps > 0 else 0 # seconds
 
-                downloadedChunk += len(chunk)
-                downFile.write(chunk)
-                if self.downloadSize > 0:
-                    progress = (float(downloadedChunk) / self.downloadSize) * 100
-                else:
-                    progress = -1
+            # emit progress
+            if self.downloadSize > 0:
+                prog = "{:.1%}, {}, {} to go".format(progress/100,  speed(bps), eta(etas))
+            else:
+                prog = "{} so far at {}, unknown ETA".format(size(downloadedChunk),  speed(bps))
 
-                # calc speed and ETA
-                elapsedTime = time.time() - startTime
-                bps = int(downloadedChunk/elapsedTime) # b/s
-                if self.downloadSize > 0:
-                    etas = int((self.downloadSize - downloadedChunk)/bps) # seconds
+            return prog
 
-                # emit progress
-                if self.downloadSize > 0:
-                    prog = "{:.1%}, {}, {} to go".format(progress/100,  speed(bps), eta(etas))
-                else:
-                    prog = "{} so far at {}, unknown ETA".format(size(downloadedChunk),  speed(bps))
+        reporter = ProgressReporter(progress_callback.emit, downloadText)
 
-                # emit progress
-                progress_callback.emit(progress, prog)
+        def downloadProgress(downloadedChunk):
+            '''Pass the progress to the UI, throttled'''
 
-                # check if the terminate flag is raised
-                if not self.downloadActive:
-                    downFile.close()
-                    os.unlink(filePath)
-                    return ""
+            if self.downloadSize > 0:
+                progress = (float(downloadedChunk) / self.downloadSize) * 100
+            else:
+                progress = -1
+
+            reporter.update(progress, downloadedChunk)
+            stage.update(downloadedChunk - startChunk)
+
+        # streaming: download, extract & hash in one pass
+        if streaming:
+            return self.skyStreamDown(down, downloadProgress, stage)
 
-        # close the file handle
-        if downFile:
-            downFile.close()
+        try:
+            down.download(downloadProgress, self.jobs.token("download"))
+        except DownloadCanceled:
+            # the partial download is kept to resume it later
+            logging.debug("Download canceled")
+            return ""
+
+        logging.debug("Download Complete.")
 
         # if download size is known and is not meet rise error
         if self.downloadSize != -1:
@@ -719,6 +859,7 @@ To flash the next image just follow these steps:
                 # ops! download truncated
                 self.downloadOk = False
                 logging.debug("Error! file size differs")
+                stage.fail("Download truncated at {} of {} bytes".format(realSize, self.downloadSize))
                 return ""
 
         # unknown length or correct length and downloaded fully
@@ -727,6 +868,53 @@ To flash the next image just follow these steps:
         # return the local filename
         return filePath
 
+    def skyStreamDown(self, down, downloadProgress, stage):
+        '''Download, extract and hash the skybian release in one pass, the
+        compressed archive is kept only if 'keep_archive' is set on the
+        DOWNLOAD section of the config (it's kept as a '.part' file until the
+        download ends, to be able to resume it); stage gets the metrics
+
+        Return the path of the image or an empty string on error/cancel
+        '''
+
+        reader = down.reader()
+        try:
+            result = streamExtract(reader, self.localPathDownloads, None, downloadProgress, self.jobs.token("download"))
+        except DownloadCanceled:
+            logging.debug("Download canceled")
+            return ""
+        finally:
+            reader.close()
+
+        logging.debug("Download & extraction complete, files: {}".format(result['files']))
+
+        # if download size is known and is not meet rise error
+        if self.downloadSize != -1 and result['size'] != self.downloadSize:
+            # ops! download truncated
+            logging.debug("Download size check:\nRemote size: {}\nLocal size: {}".format(self.downloadSize, result['size']))
+            self.downloadOk = False
+            down.discard()
+            stage.fail("Download truncated at {} of {} bytes".format(result['size'], self.downloadSize))
+            return ""
+
+        down.finish(self.config.getboolean('DOWNLOAD', 'keep_archive', fallback=False))
+
+        # check the image against the checksum on the archive
+        (image, algorithm, digest, ok) = verifyExtracted(result)
+        logging.debug("Streamed image {} verification using {}: {}".format(image, algorithm, ok))
+        stage.set(image=image, algorithm=algorithm, verified=ok)
+
+        self.skybianFile = image
+        self.manifest = result['manifests'].get(os.path.basename(image))
+        self.digestAlgorithm = algorithm
+        self.digest = digest
+        self.extractionOk = True
+        self.streamed = True
+        self.streamVerified = ok
+        self.downloadOk = image != ""
+
+        return image
+
     # load skybian from a local file
     @pyqtSlot(str)
     def localFile(self, file):
@@ -746,6 +934,7 @@ To flash the next image just follow these steps:
             file = file.replace("file://", "")
 
         logging.debug("Selected file is " + file)
+        self.downloadUrl = ""
 
         # try to read a chunk of it
         try:
@@ -772,19 +961,26 @@ To flash the next image just follow these steps:
         If error produce feedback, if ok, continue.
         '''
 
+        # already extracted and hashed while downloading
+        if self.streamed:
+            self.streamed = False
+            self.dData.emit("Extraction finished")
+            self.cksumResult("1" if self.streamVerified else "")
+            self.cksumDone()
+            return
+
         # determine the type of file and the curse of actions
         segPath = self.downloadedFile.split(".")
         if segPath[-1] in ["tar", "gz", "xz"]:
             # compressed file, handle it on a thread
-            self.extract = Worker(self.extractFile)
-            self.extract.signals.data.connect(self.downloadFileData)
-            self.extract.signals.progress.connect(self.downloadFileProg)
-            self.extract.signals.result.connect(self.extractFileResult)
-            self.extract.signals.error.connect(self.extractFileError)
-            self.extract.signals.finished.connect(self.extractFileDone)
-
-            # init worker
-            self.threadpool.start(self.extract)
+            self.startJob("extract", self.extractFile,
+                          data=self.downloadFileData,
+                          progress=self.downloadFileProg,
+                          result=self.extractFileResult,
+                          error=self.extractFileError,
+                          finished=self.extractFileDone,
+                          after=("download",),
+                          resources={'disk': 1})
 
         elif segPath[-1] in "img":
             # plain image
@@ -807,19 +1003,22 @@ To flash the next image just follow these steps:
         cwd = os.getcwd()
         os.chdir(self.localPathDownloads)
 
-        # tar extraction progress
-        def tarExtractionProgress(percent):
-            '''Callback used to update the progress on file extraction, it reuse the
-            self.downloadFileProg(percent, data) function'''
+        # tar extraction progress, throttled to not saturate the QML
+        # interface with signals; it reuse the self.downloadFileProg(percent, data)
+        # function on the other side
+        reporter = ProgressReporter(progress_callback.emit,
+                                    lambda percent: "Extracting downloaded file {:.1%}".format(percent / 100))
+
+        # metrics, the bytes of the archive read on each chunk
+        stage = self.jobStage("extract")
+        archiveSize = os.path.getsize(self.downloadedFile)
+        stage.set(archive=self.downloadedFile, size=archiveSize)
 
-            # static var, to avoid saturation of the QML interface with signals
-            # we will emit signals only on > 0.2 changes
-            oldpercent = 0
+        def tarExtractionProgress(fraction):
+            '''Pass the progress to the UI (throttled) and the metrics'''
 
-            if percent - oldpercent > 0.2:
-                oldpercent = percent
-                data = "Extracting downloaded file {:.1%}".format(percent)
-                progress_callback.emit(percent * 100, data)
+            reporter.fraction(fraction)
+            stage.update(fraction * archiveSize)
 
         # update status
         filename = self.downloadedFile.split(os.path.sep)[-1]
@@ -827,6 +1026,8 @@ To flash the next image just follow these steps:
         tar = tarfile.open(fileobj=ProgressFileObject(self.downloadedFile, progressfn=tarExtractionProgress))
         tar.extractall()
         tar.close()
+        reporter.flush()
+        stage.update(archiveSize, stage.chunks)
         self.extractionOk = True
 
         # all ok return to cwd and close the thread
@@ -865,7 +1066,7 @@ To flash the next image just follow these steps:
         logging.debug("Clean of folder {} called".format(path))
 
         # list of file extensions to erase
-        filePatterns = ["img", "gz", "xz", "sha1", "md5"]
+        filePatterns = ["img", virtualImageExtension, manifestExtension, "gz", "xz", "sha1", "md5"]
 
         for item in os.listdir(path):
             itemExtension = item.split(".")[-1]
@@ -889,12 +1090,17 @@ To flash the next image just follow these steps:
         # clean download folder
         self.cleanFolder(self.localPathDownloads)
 
+        # stop the image preparation jobs, if any
+        for name in ("download", "extract", "verify"):
+            self.jobs.cancel(name)
+
         # vars reset
         self.downloadedFile = ""
         self.downloadOk = False
         self.downloadActive = False
         self.skybianFile = ""
         self.extractionOk = False
+        self.streamed = False
 
         # GUI reset
         self.sStart.emit()
@@ -903,72 +1109,109 @@ To flash the next image just follow these steps:
         '''Detects and load the digest sums to check integrity of the
         image file, it will try to detect this ones:
 
-        sha256, sha1 & md5
+        sha512, blake2b, sha256, sha1 & md5
 
-        The first found will be used to check the
+        All the ones found for the image are checked in one pass over the
         image in a thread
         '''
 
-        # list of supported ext/sums digest
-        digestAlgorithms = ["sha256", "sha1", "md5"]
-        digestFile = ""
-        digestType = ""
+        digests = {}
+        imgFile = ""
 
         # detect the sums files
-        files = os.listdir(self.localPathDownloads)
+        files = sorted(os.listdir(self.localPathDownloads))
         for file in files:
             ext = file.split(".")[-1]
-            if ext in digestAlgorithms:
-                logging.debug("Found checksum file: {}".format(file))
-                digestFile = os.path.join(self.localPathDownloads, file)
-                digestType = ext
-                break
+            if ext not in digestAlgorithms:
+                continue
+
+            logging.debug("Found checksum file: {}".format(file))
+            try:
+                with open(os.path.join(self.localPathDownloads, file), 'rb') as sf:
+                    sums = parseSums(sf.read())
+            except OSError:
+                logging.debug("An error opening the checksum file happened...")
+                raise
+
+            # all the sums must be for the same image
+            for name, digest in sums.items():
+                if imgFile in ("", name):
+                    imgFile = name
+                    digests[ext] = digest
+                    break
 
         # can't find a valid digest file
-        if not digestType:
+        if not digests:
             # TODO WARNING no DIGEST to check against
             return "error"
 
-        # prepare to check the digest against the image in a thread
-        try:
-            sf = open(digestFile, 'r')
-        except OSError:
-            logging.debug("An error opening the checksum file happened...")
-            raise
+        # cleaning the filename
+        imgFile = os.path.join(self.localPathDownloads, imgFile)
 
-        # loading values
-        try:
-            digest, imgFile = sf.readline().split(" ")
-        except:
-            logging.debug("Error, checksum file {} is empty?".format(imgFile))
-            raise
-
-        # cleaning the filename (it has a starting * and ends with a newline)
-        imgFile = os.path.join(self.localPathDownloads, imgFile.strip("*"))
-        imgFile = imgFile.strip("\n")
+        # the best algorithm is the one remembered
+        digestType = [algo for algo in digestAlgorithms if algo in digests][0]
 
         # DEBUG
-        logging.debug("checksum details:\nFile: {}\nDigest: {}\nDigest Algorithm is: {}".format(imgFile, digest, digestType))
+        logging.debug("checksum details:\nFile: {}\nDigests: {}\nDigest Algorithm is: {}".format(imgFile, digests, digestType))
 
         self.digestAlgorithm = digestType
-        self.digest = digest
+        self.digest = digests[digestType]
+        self.digests = digests
         self.skybianFile = imgFile
 
         # start the checksum thread
-        self.cksum = Worker(self.cksumCheck)
-        self.cksum.signals.data.connect(self.downloadFileData)
-        self.cksum.signals.progress.connect(self.downloadFileProg)
-        self.cksum.signals.result.connect(self.cksumResult)
-        self.cksum.signals.error.connect(self.cksumError)
-        self.cksum.signals.finished.connect(self.cksumDone)
-
-        # init worker
-        self.threadpool.start(self.cksum)
+        self.verifySkybian()
 
         return
 
+    def getVerifications(self):
+        '''Return the persisted verification results of the images'''
+
+        if self.verifications is None:
+            self.verifications = VerificationRecords(os.path.join(self.localPath, "verified.json"))
+
+        return self.verifications
+
+    def verifySkybian(self, force=False):
+        '''Check the skybian image against the digest in a thread, if it's
+        unchanged since it was verified the last time the result is reused
+        unless force is True'''
+
+        self.forceVerification = force
+
+        # start the checksum thread
+        if not self.startJob("verify", self.cksumCheck,
+                             data=self.downloadFileData,
+                             progress=self.downloadFileProg,
+                             result=self.cksumResult,
+                             error=self.cksumError,
+                             finished=self.cksumDone,
+                             after=("download", "extract"),
+                             resources={'disk': 1}):
+            self.setStatus.emit("The Skybian image is being verified already")
+
+    @pyqtSlot()
+    def reverifySkybian(self):
+        '''Slot that receives the request from the UI to hash the skybian
+        image again, trusting no previous result'''
+
+        if self.skybianFile == "" or not os.path.exists(self.skybianFile):
+            self.setStatus.emit("There is no Skybian image to verify")
+            return
+
+        (algorithm, digest) = self.getVerifications().digestOf(self.skybianFile)
+        if algorithm is None:
+            self.setStatus.emit("Can't find the digest of the Skybian image, please download it again")
+            return
+
+        self.digestAlgorithm = algorithm
+        self.digest = digest
+        self.digests = {algorithm: digest}
+        self.verifySkybian(True)
+
     def cksumCheck(self, data_callback, progress_callback):
-        '''Check the checksum detected for the skybian base file
+        '''Check the checksums detected for the skybian base file, all the
+        digests are computed in one pass over the file
 
         Result returned must be string that will be converted to boolean so we stick
         to strings 1|0
@@ -977,44 +1220,78 @@ To flash the next image just follow these steps:
         so no need to handle it here
         '''
 
-        # object checksum creation the fast way, there is a argument passing way (simpler)
-        # but docs discourage it as slow
-        if self.digestAlgorithm == "md5":
-            cksum = hashlib.md5()
-        elif self.digestAlgorithm == "sha1":
-            cksum = hashlib.sha1()
-        else:
-            logging.debug("Digest algorithm {} is not supported yet".format(self.digestAlgorithm))
-            return
+        expected = self.digests or {self.digestAlgorithm: self.digest}
 
-        # get the file and it's size, etc
-        fileSize = os.path.getsize(self.skybianFile)
-        file = open(self.skybianFile, "rb")
-        actualPosition = 0
-        portionSize = 81920
+        # metrics, the bytes hashed on each chunk
+        stage = self.jobStage("verify")
+        imageBytes = os.path.getsize(self.skybianFile)
+        stage.set(image=self.skybianFile, size=imageBytes, algorithms=sorted(expected))
 
-        # user feedback
-        data_callback.emit("Integrity checking, please wait...")
-
-        # main loop
-        file.seek(0)
-        while actualPosition < fileSize:
-            data = file.read(portionSize)
-            cksum.update(data)
+        for algo in expected:
+            if algo not in hashAlgorithms:
+                logging.debug("Digest algorithm {} is not supported yet".format(algo))
+                stage.fail("Digest algorithm {} is not supported".format(algo))
+                return ""
 
-            # progress and cycle update
-            actualPosition += portionSize
-            percent = actualPosition / fileSize
+        # unchanged since the last verification?
+        records = self.getVerifications()
+        if not self.forceVerification:
+            known = records.lookup(self.skybianFile, self.digestAlgorithm, self.digest)
+            if known is not None:
+                logging.debug("Image {} unchanged since verified, result: {}".format(self.skybianFile, known))
+                stage.set(method="record")
+                if not known:
+                    stage.fail("The image failed a previous verification")
+                return "1" if known else ""
 
-            data = "Integrity checking {:.1%}".format(percent)
-            progress_callback.emit(percent * 100, data)
+        # user feedback
+        data_callback.emit("Integrity checking, please wait...")
 
-        # check the calculated digest
-        calculatedDigest = cksum.hexdigest()
-        logging.debug("Official Sum: {}".format(self.digest))
-        logging.debug("Calculated:   {}".format(calculatedDigest))
+        # throttled, the text is built only for the updates emitted
+        reporter = ProgressReporter(progress_callback.emit,
+                                    lambda percent: "Integrity checking {:.1%}".format(percent / 100))
+
+        def hashProgress(fraction):
+            '''Pass the progress to the UI (throttled) and the metrics'''
+
+            reporter.fraction(fraction)
+            stage.update(fraction * imageBytes)
+
+        # a manifest that was verified against the same digests can check the
+        # image in parallel, chunk by chunk, using all the cores
+        manifest = loadManifest(self.skybianFile)
+        if manifest is not None and all(manifest.digests.get(algo) == digest.lower() for (algo, digest) in expected.items()):
+            workers = self.config.getint('VERIFY', 'workers', fallback=0)
+            stage.set(method="manifest", workers=workers)
+            bad = manifest.verifyFile(self.skybianFile, workers, hashProgress)
+            stage.update(imageBytes, manifest.count())
+            if bad:
+                logging.debug("Image {} has bad chunks: {}".format(self.skybianFile, bad))
+                stage.fail("{} bad chunks".format(len(bad)))
+
+            records.record(self.skybianFile, self.digestAlgorithm, self.digest, not bad)
+            return "" if bad else "1"
+
+        # just whole file digests: sequential, the manifest of chunks is built on the same pass
+        chunks = newChunkHash()
+        stage.set(method="digest")
+        calculated = hashFile(self.skybianFile, list(expected), hashProgress, extra={'manifest': chunks})
+
+        # check the calculated digests
+        ok = True
+        for algo, digest in expected.items():
+            logging.debug("Official {} Sum: {}".format(algo, digest))
+            logging.debug("Calculated:   {}".format(calculated[algo]))
+            ok = ok and digest.lower() == calculated[algo]
+
+        records.record(self.skybianFile, self.digestAlgorithm, self.digest, ok)
+        if ok:
+            self.manifest = Manifest.fromHash(os.path.getsize(self.skybianFile), chunks, {algo: calculated[algo] for algo in expected})
+        else:
+            self.manifest = None
+            stage.fail("The digest does not match")
 
-        if self.digest == calculatedDigest:
+        if ok:
             # success, image integrity preserved
             return "1"
         else:
@@ -1027,29 +1304,59 @@ To flash the next image just follow these steps:
         logfile = os.path.join(self.localPath, "skyflash.log")
         logging.basicConfig(filename=logfile, level=logging.DEBUG)
 
+        # the metrics of the stages goes next to it
+        self.metricsSetup()
+
         logging.info("")
         logging.info("====================================================")
         logging.info("Logging started at {}".format(time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime())))
         logging.info("====================================================")
         logging.info("")
 
+    def metricsSetup(self):
+        '''Point the metrics of the stages to the file next to the log, if
+        enabled on the METRICS section of the config, and set the exporter;
+        it's called on the start of the log and each time the config is
+        loaded, nothing is touched if the settings did not change'''
+
+        settings = (
+            os.path.join(self.localPath, metricsFileName),
+            self.config.getboolean('METRICS', 'enabled', fallback=True),
+            # the node_exporter textfile and/or the local endpoint, if set on
+            # the EXPORTER section of the config
+            self.config.get('EXPORTER', 'textfile', fallback=''),
+            self.config.get('EXPORTER', 'address', fallback=exporterAddress),
+            self.config.getint('EXPORTER', 'port', fallback=0),
+        )
+        if settings == self.metricsSettings:
+            return
+
+        self.metricsSettings = settings
+        self.metrics.setPath(settings[0], settings[1])
+        self.exporter.configure(*settings[2:])
+
     def timerStart(self):
-        '''Start the timer to check for SD cards'''
+        '''Start the detection of SD cards on a background thread: driven by
+        the device events if the OS can tell us about them, if not polling;
+        it's safe to call it when already started, it just scans again'''
 
-        try:
-            self.timer.timeout.connect(self.detectCards)
-        except:
-            pass
+        if self.cardMonitor is None:
+            init = None
+            if sys.platform in ["win32", "cygwin"]:
+                # WMI on a thread needs COM initialized there
+                import pythoncom
+                init = pythoncom.CoInitialize
 
-        # timer stopped, not started until step 4 is visible
-        self.timer.start(1000)
+            self.cardMonitor = CardMonitor(self.scanCards, self.cardsSnapshot.emit, init)
+            self.cardsSnapshot.connect(self.cardsUpdate)
+
+        self.cardMonitor.start()
 
     def timerStop(self):
-        '''Stop the timer to check for SD cards'''
-        try:
-            self.timer.stop()
-        except:
-            pass
+        '''Stop the detection of SD cards'''
+
+        if self.cardMonitor is not None:
+            self.cardMonitor.pause()
 
     def validateNetworkData(self, dgw, ddns, dmanager, dnodes, ui=True):
         '''Validate the network data passed by the QML UI
@@ -1188,6 +1495,11 @@ To flash the next image just follow these steps:
             self.localPathBuild = folder
             logging.debug("User selected a custom build folder: {}".format(self.localPathBuild))
 
+        # one build at a time, it will erase the images being built
+        if self.jobs.isActive("build"):
+            self.setStatus.emit("The images are being built already")
+            return
+
         # erase old images on final folder (if any)
         self.cleanFolder(self.localPathBuild)
 
@@ -1205,25 +1517,23 @@ To flash the next image just follow these steps:
         self.config['NET']['count'] = nodes
         self.save_config()
 
-        # Starting to build the nodes.
-        # thead start
-        self.build = Worker(self.buildTheImages)
-        self.build.signals.data.connect(self.buildData)
-        self.build.signals.progress.connect(self.buildProg)
-        self.build.signals.result.connect(self.buildResult)
-        self.build.signals.error.connect(self.buildError)
-        self.build.signals.finished.connect(self.buildDone)
-
-        # init worker
-        self.threadpool.start(self.build)
+        # Starting to build the nodes, after the image is verified
+        self.startJob("build", self.buildTheImages,
+                      data=self.buildData,
+                      progress=self.buildProg,
+                      result=self.buildResult,
+                      error=self.buildError,
+                      finished=self.buildDone,
+                      after=("verify",),
+                      resources={'disk': 1})
 
     def buildTheImages(self, data_callback, progress_callback):
         '''Build the images from the data entered
 
         Will start with the manager and follow with the nodes next to the manager ip
 
-        The task is just to copy the base image and set on the address [TODO] a text file
-        with this data:
+        The task is just to clone the base image and set on the address imageConfigAddress
+        a text block with this data:
 
             IP={nodeip}
             GW={gwip}
@@ -1232,119 +1542,127 @@ To flash the next image just follow these steps:
             MIP={managerip}
 
         And the rest of the image follows.
+
+        The clone is a reflink or a in kernel copy if the filesystem can do it (no
+        extra disk used and almost instant) and only the config block is written on
+        each image; set 'mode = copy' on the BUILD section of the config to force a
+        plain copy, or 'mode = virtual' to skip the build and write just a small
+        virtual image descriptor (.vimg) that the flashers stream on the fly.
         '''
 
-        baseIP = self.netGw[0:self.netGw.rfind('.') + 1]
-        start = int(self.netManager[self.netManager.rfind('.') + 1:])
-        end = start + int(self.netNodes) + 1
-        count = end - start
-        actual = 0
-        overallProgress = 0
-        singleProgress = 0
-        fileSize = os.path.getsize(self.skybianFile)
+        # the manager and the nodes, the same the cli builds
+        plan = clusterPlan(self.netGw, self.netDns, self.netManager, self.netNodes)
+        count = len(plan)
         images = []
-        file = open(self.skybianFile, "rb")
 
-        # main iteration cycle
-        for n in range(start, end):
-            # build node
-            nip = baseIP + str(n)
+        # build mode: clone (reflink/in kernel copy if possible), copy (plain copy)
+        # or virtual (no image on disk, just a descriptor of base image + config)
+        mode = self.config.get('BUILD', 'mode', fallback='clone')
 
-            # actual node
-            actual = n - start
+        # what the build folder filesystem can do, probed once
+        caps = capabilities(self.localPathBuild)
 
-            # create the config string
-            ntype = 'manager' if nip == self.netManager else 'node'
-            configText = "IP={0}\nGW={1}\nDNS='{2}'\nMODE={3}\nMIP={4}".format(nip, self.netGw, self.netDns, ntype, self.netManager)
+        # metrics, the bytes of each image built (a chunk)
+        stage = self.jobStage("build")
+        baseSize = os.path.getsize(self.skybianFile)
+        stage.set(images=count, mode=mode, size=baseSize)
 
-            # fill the remaining space with null chars
-            needToFill = imageConfigDataSize - len(configText)
-            for i in range(0, needToFill):
-                configText += "\x00"
+        def buildText(percent, actual):
+            '''The progress of the image and the overall one for the UI'''
 
-            actualPosition = 0
-            # WARNING! imageConfigAddress must be divisible by 4 for this to work ok
-            portionSize = int(imageConfigAddress / 4)
+            overAll = percent/100/count + actual/count
+            return "Image creation {:.1%}|{:0.3f}".format(percent/100, overAll * 100)
 
-            # new file and it's name
-            nodeNick = "manager"
-            if nip != self.netManager:
-                nodeNick = "node-" + str(actual)
+        # throttled progress, the copy reports it on each chunk
+        reporter = ProgressReporter(progress_callback.emit, buildText)
 
-            nodeName = "Skybian-" + nodeNick + ".img"
+        # the manifest of the base image, to derive the ones of the nodes; built
+        # in parallel if missing (a image verified before manifests existed)
+        if loadManifest(self.skybianFile) is None:
+            data_callback.emit("Indexing the base image")
+        manifest = baseManifest(self.skybianFile, self.config.getint('VERIFY', 'workers', fallback=0))
+
+        # main iteration cycle
+        for (actual, (nodeNick, nip, ntype)) in enumerate(plan):
+            # create the config block
+            configData = nodeConfig(nip, self.netGw, self.netDns, ntype, self.netManager, imageConfigDataSize)
 
+            # new file and it's name
+            nodeName = imageName(nodeNick, mode)
             nnfp = os.path.join(self.localPathBuild, nodeName)
-            newNode = open(nnfp, 'wb')
-            nodes = int(self.netNodes)
 
             # user feedback
             data_callback.emit("Building {} image".format(nodeNick))
             logging.debug("Building {} image, full path is:\n{}".format(nodeName, nnfp))
 
-            # build node loop
-            file.seek(actualPosition)
-            while actualPosition < imageConfigAddress:
-                data = file.read(portionSize)
-                newNode.write(data)
-
-                # progress and cycle update
-                actualPosition += portionSize
-                percent = actualPosition / fileSize
-
-                overAll = percent/count + actual/count
-                data = "Image creation {:.1%}|{:0.3f}".format(percent, overAll * 100)
-                progress_callback.emit(percent * 100, data)
-
-            # write config
-            newNode.write(configText.encode())
-
-            # seek to new position and resume the copy
-            actualPosition += imageConfigDataSize
-            file.seek(actualPosition)
-            while actualPosition < fileSize:
-                data = file.read(portionSize)
-                newNode.write(data)
+            # progress of the copy
+            def copyProgress(percent):
+                '''Pass the progress of the clone/copy to the UI'''
 
-                # progress and cycle update
-                actualPosition += portionSize
-                percent = actualPosition / fileSize
+                reporter.fraction(percent, actual)
 
-                overAll = percent/count + actual/count
-                data = "Image creation {:.1%}|{:0.1f}".format(percent, overAll * 100)
-                progress_callback.emit(percent * 100, data)
-
-            # close the newNode
-            newNode.close()
+            # clone/copy the base image and patch the config block, the
+            # manifest of the node is saved next to it
+            method = buildNodeImage(self.skybianFile, nnfp, configData, mode, caps, manifest, copyProgress)
+            logging.debug("Image {} built using the '{}' method".format(nodeName, method))
+            stage.add(baseSize)
+            stage.set(method=method)
 
             # add the img path to the list of built images
             images.append(nodeName)
-        
+
+        reporter.flush()
+
         # update the image list 
         self.images2flash = images
         self.update_images_in_config(images)
 
-        # close the file
-        file.close()
+    def scanCards(self):
+        '''Detects and identify the uSD cards in the system OS agnostic, this
+        runs on the card monitor thread
 
-    def detectCards(self):
-        '''Detects and identify the uSD cards in the system OS agnostic'''
+        Return a list of (name, label, size) tuples or False
 
-        # detected drives
-        self.drives = []
+        The scans are frequent, the metrics of the detection are recorded
+        only when the cards changed or the scan fails
+        '''
 
-        # OS specific listing
-        aos = sys.platform.strip()
-        if aos in ["win32", "cygwin"]:
-            logging.debug("Detecting Windows Drives")
-            self.drives = getWinDrivesInfo()
-        elif aos.startswith('linux'):
-            logging.debug("Detecting Linux Drives")
-            self.drives = getLinDrivesInfo()
-        else:
-            logging.debug("Detecting MacOS Drives")
-            self.drives = getMacDriveInfo()
+        stage = self.metrics.start("detect")
+        try:
+            # OS specific listing
+            aos = sys.platform.strip()
+            if aos in ["win32", "cygwin"]:
+                logging.debug("Detecting Windows Drives")
+                drives = getWinDrivesInfo()
+            elif aos.startswith('linux'):
+                logging.debug("Detecting Linux Drives")
+                drives = getLinDrivesInfo()
+            else:
+                logging.debug("Detecting MacOS Drives")
+                drives = getMacDriveInfo()
+        except Exception as e:
+            # just the first of a row of failures
+            if self.lastDetected is not False:
+                self.lastDetected = False
+                stage.end(stageFailed, e)
+            raise
+
+        found = tuple(drives or ())
+        if found != self.lastDetected:
+            self.lastDetected = found
+            stage.update(0, len(found))
+            stage.set(cards=[name for (name, label, size) in found])
+            stage.end()
+
+        return drives
+
+    def cardsUpdate(self, snapshot):
+        '''A new snapshot of the cards from the monitor thread, build a user
+        friendly string for each card; the UI is notified only if the list
+        really changed'''
+
+        self.drives = snapshot.drives
 
-        # build a user friendly string for the cards if there is a card
         if self.drives:
             driveList = []
             for (drive, label, size) in self.drives:
@@ -1404,55 +1722,166 @@ To flash the next image just follow these steps:
         '''Dummy function, return, some workers need this to work'''
         return
 
+    def startJob(self, name, fn, *args, data=None, progress=None, result=None,
+                 error=None, finished=None, after=(), resources=None, pool=None,
+                 dropped=None):
+        '''Run fn(*args) on a Worker as a named job on the scheduler, the
+        signal handlers are optional; dropped is called with the job if it's
+        canceled before it starts
+
+        The job starts when the jobs named in after are done and there are
+        free units of the resources it needs ('network' & 'disk', the limits
+        are on the JOBS section of the config), see JobScheduler; pool is the
+        thread pool to use, the main one by default
+
+        The jobs of the pipeline stages (the name starts with the stage, like
+        "flash /dev/sdb") are measured, see jobStage()
+
+        Return False if a job with that name is active already
+        '''
+
+        self.jobs.setLimits({
+            'network': self.config.getint('JOBS', 'network', fallback=jobDefaultLimits['network']),
+            'disk': self.config.getint('JOBS', 'disk', fallback=jobDefaultLimits['disk']),
+        })
+
+        def launch(job):
+            '''Wire the worker signals and start it'''
+
+            stage = name.split()[0]
+            if stage in stageNames:
+                self.jobStages[name] = self.metrics.start(stage, name[len(stage):].strip())
+
+            worker = Worker(fn, *args)
+            worker.signals.data.connect(data or self.dummy)
+            worker.signals.progress.connect(progress or self.dummy)
+            worker.signals.result.connect(result or self.dummy)
+            # the scheduler must know the outcome before the handlers run
+            worker.signals.error.connect(lambda error, job=job: setattr(job, 'error', error))
+            worker.signals.error.connect(error or self.dummy)
+            worker.signals.finished.connect(lambda data, name=name: self.jobEnded(name))
+            worker.signals.finished.connect(finished or self.dummy)
+
+            # keep a reference, the signals die with the worker
+            self.jobWorkers[name] = worker
+            (pool or self.threadpool).start(worker)
+
+        return self.jobs.submit(Job(name, launch, after, resources, dropped))
+
+    def jobEnded(self, name):
+        '''A job worker ended, let the scheduler start the next ones'''
+
+        self.jobWorkers.pop(name, None)
+
+        # record the stage, the error (if any) is already on the job
+        stage = self.jobStages.pop(name, None)
+        job = self.jobs.job(name)
+        if stage is not None and job is not None:
+            if job.token.cancelled:
+                stage.end(stageCanceled)
+            elif job.error is not None:
+                # the error is a (type, value, traceback) tuple from the worker
+                stage.end(stageFailed, job.error[1] if isinstance(job.error, tuple) else job.error)
+            else:
+                stage.end()
+
+        self.jobs.finish(name)
+
+    def jobStage(self, name):
+        '''The stage being measured for the job with that name, a stage that
+        is not recorded if there is none (the code runs out of a job)'''
+
+        return self.jobStages.get(name) or Stage(None, name.split()[0])
+
     @pyqtSlot()
     def imageFlash(self):
-        '''Flash the images, one at a time, each one on a turn'''
+        '''Flash the selected image on the selected card
 
-        # failsafe if we are already on a flashing process
-        if self.flashingOnProgress:
-            logging.debug("User pressed the Flashing button during a flash, aborting")
-            self.uiWarning.emit("Ops!", "Please wait until the actual flashing process ends.")
-            return
+        Each card has it's own queue, if the card is busy the image is queued
+        and flashed when the actual one ends; different cards are flashed at
+        the same time up to the limit set in the FLASH section of the config
+        '''
+
+        image = self.flashingNow
+        device = self.card
 
-        # stop the timer, it must not mess with the device on the copy process
-        self.timerStop()
+        if not image or not device:
+            self.uiWarning.emit("Ops!", "Please select a card and a image to flash.")
+            return
 
-        # Preparing the flasher thread
-        self.flash = Worker(self.flasher)
-        self.flash.signals.data.connect(self.dummy)
-        self.flash.signals.progress.connect(self.flashProg)
-        self.flash.signals.result.connect(self.flashResult)
-        self.flash.signals.error.connect(self.flashError)
-        self.flash.signals.finished.connect(self.flashDone)
+        # busy card: queue the image
+        if device in self.flashingDevices:
+            logging.debug("Device {} is busy, queueing {}".format(device, image))
+            self.flashQueues.setdefault(device, []).append(image)
+            self.setStatus.emit("{} queued to be flashed on {}".format(shortenPath(image, -1), device))
+            return
 
-        #  start flashing thread
-        self.threadpool.start(self.flash)
+        # the detection runs on it's own thread and only reads the devices
+        # info, it can go on while flashing
         self.flashingOnProgress = True
 
-    def flasher(self, data_callback, progress_callback):
-        '''Flash the images
-        The actual image to flash is on self.flashingNow [image, name]'''
+        self.flashStart(device, image)
+
+    def flashStart(self, device, image):
+        '''Start the flash thread of a image on a device'''
+
+        # concurrent writes limit, from the config
+        self.flashPool.setMaxThreadCount(self.config.getint('FLASH', 'parallel', fallback=2))
+
+        # keep track of it
+        self.flashingDevices[device] = image
+
+        # flashing job, on it's own pool, after the images are built
+        self.startJob("flash " + device, self.flasher, image, device,
+                      progress=lambda percent, data, device=device: self.flashProg(device, percent, data),
+                      result=lambda data, device=device: self.flashResult(device, data),
+                      error=lambda error, device=device: self.flashError(device, error),
+                      finished=lambda data, device=device: self.flashDone(device),
+                      after=("build",),
+                      pool=self.flashPool,
+                      # the build failed, the device is free again
+                      dropped=lambda job, device=device: self.flashDone(device))
+
+    def flasher(self, image, device, data_callback, progress_callback):
+        '''Flash the image on the device, this runs on the flash threadpool'''
+
+        # metrics, the progress of the writer is parsed on followFlashProgress()
+        stage = self.jobStage("flash " + device)
+        stage.set(image=image, size=imageSize(image),
+                  blocksize=self.config.getint('FLASH', 'blocksize', fallback=4194304),
+                  verify=self.config.get('FLASH', 'verify', fallback='none'))
 
         if sys.platform in ["win32", "cygwin"]:
             # windows
-            self.windowsFlasher(data_callback, progress_callback)
+            result = self.windowsFlasher(image, device, data_callback, progress_callback)
         elif sys.platform == "darwin":
             # mac
-            self.macosFlasher(data_callback, progress_callback)
+            result = self.macosFlasher(image, device, data_callback, progress_callback)
         else:
             # linux
-            self.linuxFlasher(data_callback, progress_callback)
+            result = self.linuxFlasher(image, device, data_callback, progress_callback)
+
+        if result != "Done":
+            stage.fail(stage.error or "The writer failed")
+
+        # the result signal carries a string, a failure may return False/None
+        return result or ""
+
+    def flashLogFile(self, name, device):
+        '''Path to the progress log file of a flash process, one per device
+        as they can run at the same time'''
+
+        dev = "".join(c if c.isalnum() else "_" for c in device)
+        return os.path.join(tempfile.gettempdir(), "{}{}.log".format(name, dev))
 
-    def windowsFlasher(self, data_callback, progress_callback):
+    def windowsFlasher(self, image, device, data_callback, progress_callback):
         '''Windows flasher'''
 
-        # there are images left to burn, pick the first one
-        image = self.flashingNow
         name = image.split(os.sep)[-1].split(".")[0]
-        drive = self.card
-        logfile = os.path.join(tempfile.gettempdir(), "skfpl.log")
+        drive = device
+        logfile = self.flashLogFile("skfpl", device)
         flasher = "flash.exe"
-        size = os.path.getsize(image)
+        size = imageSize(image)
 
         # touch (& truncate) the logfile
         f = open(logfile, 'wt')
@@ -1467,36 +1896,40 @@ To flash the next image just follow these steps:
             drive = drive[:-1]
 
         # build the command to flash it
-        cmd = "{} \"{}\" \"{}\" \"{}\"".format(flasher, image, drive, logfile)
+        cmd = "{} \"{}\" \"{}\" \"{}\" --buffers {} --buffer-size {} --verify {} --sample {}".format(flasher, image, drive, logfile,
+                    self.config.getint('FLASH', 'buffers', fallback=4),
+                    self.config.getint('FLASH', 'blocksize', fallback=4194304),
+                    self.config.get('FLASH', 'verify', fallback='none'),
+                    self.config.getfloat('FLASH', 'sample', fallback=5))
+
+        if os.path.exists(manifestPath(image)):
+            cmd += " --manifest \"{}\"".format(manifestPath(image))
 
         # logging
         logging.debug("Full cmd line is:\n{}".format(cmd))
 
         try:
             p = subprocess.Popen(cmd)
-            flash_start = time.time()
 
             #  open the log file
             lf = open(logfile, 'rt')
 
-            while p.poll() is None:
-                #  capturing progress via a file
-                l = lf.readline().strip("\n")
-                if len(l) != 0:
-                    # get time
-                    now_time = time.time()
-
-                    # check for errors
-                    if l.startswith("ERROR"):
-                        print("Error detected:\n{}".format(l))
-                        return False
-
-                    if "%" in l:
-                        # we are on:
-                        pr = float(l.strip()[:-1])
-                        if pr > 0:
-                            (speed, eta) = calc_speed_eta(size, pr, flash_start, now_time)
-                            progress_callback.emit(pr, "Flashing {}: {}%, {}, {} left".format(name, pr, speed, eta))
+            def logLines():
+                '''Follow the log file while the flasher runs'''
+
+                while p.poll() is None:
+                    #  capturing progress via a file
+                    l = lf.readline()
+                    if l:
+                        yield l
+                    else:
+                        time.sleep(0.1)
+
+                # the tail of it
+                for l in lf:
+                    yield l
+
+            ok = self.followFlashProgress(logLines(), name, size, progress_callback, self.jobStage("flash " + device))
 
             #  close the log file
             if lf:
@@ -1506,7 +1939,7 @@ To flash the next image just follow these steps:
             logging.debug("Return Code was {}".format(p.returncode))
 
             # check for return code
-            if p.returncode == 0:
+            if ok and p.returncode == 0:
                 # All ok, pop the image from the list
                 return "Done"
             else:
@@ -1520,81 +1953,131 @@ To flash the next image just follow these steps:
 
         return "Done"
 
-    def linuxFlasher(self, data_callback, progress_callback):
-        '''Linux flasher'''
+    def writerCmd(self, image, device, python):
+        '''Build the command (as a list) to call the native block writer for
+        the image & device, with the options from the FLASH section of the
+        config'''
 
-        #  command to run
-        pkexec = getLinuxPath("pkexec")
-        dd = getLinuxPath("dd")
-        python = getLinuxPath("python3")
-        logfile = os.path.join(tempfile.gettempdir(), "skf.log")
-
-        # touch the logfile
-        f = open(logfile, mode='wt')
-        f.write("0.0%")
-        f.close()
-
-        # detect the streamer syntax
+        # detect the writer syntax
         if self.bundle:
             # I'm in a static pre compiled env
-            streamer = os.path.join(self.appFolder, "pypv")
+            cmd = [os.path.join(self.appFolder, "pydd")]
         else:
             # just a python call to the code
-            streamer = python + " " + os.path.join(self.appFolder, "../posix-build/pypv.py")
+            cmd = [python, os.path.join(self.appFolder, "../posix-build/pydd.py")]
 
-        # there are images left to burn, pick the first one
-        image = self.flashingNow
-        name = image.split(os.sep)[-1].split(".")[0]
-        destination = self.card
-        size = os.path.getsize(image)
+        cmd += writerArgs(image, device,
+                          self.config.getint('FLASH', 'blocksize', fallback=4194304),
+                          self.config.getint('FLASH', 'buffers', fallback=4),
+                          self.config.getboolean('FLASH', 'direct', fallback=False),
+                          self.config.getboolean('FLASH', 'skipzero', fallback=False),
+                          self.config.getboolean('FLASH', 'discard', fallback=False),
+                          self.config.get('FLASH', 'verify', fallback='none'),
+                          self.config.getfloat('FLASH', 'sample', fallback=5),
+                          self.config.getboolean('FLASH', 'allowstale', fallback=False))
 
-        data_callback.emit("Flashing now {} image".format(name))
+        return cmd
 
-        if pkexec and dd and (python or streamer):
-            cmd = "{} {} {} | {} {} of={}".format(streamer, image, logfile, pkexec, dd, destination)
-            logging.debug("Full cmd line is:\n{}".format(cmd))
+    def followFlashProgress(self, lines, name, size, progress_callback, stage=None):
+        '''Parse the progress lines from the native writer and pass it to the UI
+        and to the metrics of the stage if given
 
-            # TODO Test if the destination file is in there
+        Return False if the writer reported an error or True if not
+        '''
 
-            try:
-                p = subprocess.Popen(cmd, shell=True)
-                flash_start = time.time()
+        flash_start = time.time()
+        stage = stage or Stage(None, "flash")
+        blockSize = max(1, stage.info.get('blocksize', 4194304))
 
-                #  open the log file
-                lf = open(logfile, 'r')
+        def flashText(pr, verifying, now):
+            '''The progress text, only for the updates emitted'''
 
-                while p.poll() is None:
-                    #  capturing progress via a file
-                    l = lf.readline().strip("\n")
-                    if len(l) != 0:
-                        # get time
-                        now_time = time.time()
+            if verifying:
+                return "Verifying {}: {}%".format(name, pr)
+
+            (speed, eta) = calc_speed_eta(size, pr, flash_start, now)
+            return "Flashing {}: {}%, {}, {} left".format(name, pr, speed, eta)
+
+        # the writer reports each block, throttle it
+        reporter = ProgressReporter(progress_callback.emit, flashText)
+
+        for l in lines:
+            l = l.strip("\n")
+            if len(l) == 0:
+                continue
+
+            # check for errors
+            if l.startswith("ERROR"):
+                logging.debug("Error detected:\n{}".format(l))
+                stage.fail(l)
+                reporter.flush()
+                progress_callback.emit(0, "{}: {}".format(name, l))
+                return False
+
+            if l.startswith("WARNING"):
+                logging.debug(l)
+                continue
+
+            # read back verification
+            if l.startswith("VERIFIED"):
+                logging.debug("{} on {}".format(l, name))
+                stage.set(verified=l[len("VERIFIED "):])
+                reporter.flush()
+                progress_callback.emit(100, "Verified {}: {}".format(name, l[len("VERIFIED "):]))
+                continue
 
-                        # check for errors
-                        if l.startswith("ERROR"):
-                            print("Error detected:\n{}".format(l))
-                            return False
+            if l.startswith("VERIFY"):
+                pr = float(l.split()[-1][:-1])
+                reporter.update(pr, True, time.time())
+                continue
 
-                        if "%" in l:
-                            pr = float(l.strip()[:-1])
+            if "%" in l:
+                pr = float(l.strip()[:-1])
 
-                            if pr > 0:
-                                (speed, eta) = calc_speed_eta(size, pr, flash_start, now_time)
-                                progress_callback.emit(pr, "Flashing {}: {}%, {}, {} left".format(name, pr, speed, eta))
+                if pr > 0:
+                    reporter.update(pr, False, time.time())
 
-                #  close the log file
-                if lf:
-                    lf.close()
+                    # the writer reports the bytes written, not the blocks
+                    done = int(size * pr / 100)
+                    stage.update(done, -(-done // blockSize))
+
+        reporter.flush()
+        return True
+
+    def linuxFlasher(self, image, device, data_callback, progress_callback):
+        '''Linux flasher
+
+        The native writer runs with privileges via pkexec and report the progress
+        over a pipe (it's stdout)
+        '''
+
+        #  command to run
+        pkexec = findTool("pkexec")
+        python = findTool("python3")
+
+        name = image.split(os.sep)[-1].split(".")[0]
+        destination = device
+        size = imageSize(image)
+
+        data_callback.emit("Flashing now {} image".format(name))
+
+        if pkexec and (python or self.bundle):
+            cmd = [pkexec] + self.writerCmd(image, destination, python)
+            logging.debug("Full cmd line is:\n{}".format(" ".join(cmd)))
+
+            try:
+                p = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+                ok = self.followFlashProgress(p.stdout, name, size, progress_callback, self.jobStage("flash " + device))
+                p.stdout.close()
+                p.wait()
 
                 logging.debug("Return Code was {}".format(p.returncode))
 
                 # check for return code
-                if p.returncode == 0:
-                    # All ok, pop the image from the list
+                if ok and p.returncode == 0:
                     return "Done"
                 else:
                     # different code
-                    # TODO capture an error
                     return "Oops!"
 
             except OSError as e:
@@ -1603,91 +2086,86 @@ To flash the next image just follow these steps:
         else:
             logging.debug("Error getting one of the dependencies")
 
+            # probe again next time, the user may install it meanwhile
+            invalidateTools()
+
             # user warning
             self.uiWarning.emit("Ops!", "There was an utility missing in your system!")
 
-    def macosFlasher(self, data_callback, progress_callback):
-        '''Macos flasher'''
-
-        #  command to run
-        dd = getLinuxPath("dd")
-        python = getLinuxPath("python3")
-        logfile = os.path.join(tempfile.gettempdir(), "skf.log")
+    def macosFlasher(self, image, device, data_callback, progress_callback):
+        '''Macos flasher
 
-        # touch the logfile
-        f = open(logfile, mode='wt')
-        f.write("0.0%")
-        f.close()
+        The native writer runs with privileges via osascript, it reports the
+        progress over a fifo as we can't get it's stdout while running
+        '''
 
-        # detect the streamer syntax
-        if self.bundle:
-            # I'm in a static pre compiled env
-            streamer = os.path.join(self.appFolder, "pypv")
-        else:
-            # just a python call to the code
-            streamer = python + " " + os.path.join(self.appFolder, "../posix-build/pypv.py")
+        #  command to run
+        python = findTool("python3")
+        fifo = self.flashLogFile("skf", device)
 
-        print("Streamer tool is at: {}".format(streamer))
+        # the pipe to get the progress
+        if os.path.exists(fifo):
+            os.unlink(fifo)
+        os.mkfifo(fifo)
 
-        # there are images left to burn, pick the first one
-        image = self.flashingNow
         name = image.split(os.sep)[-1].split(".")[0]
-        destination = self.card
-        size = os.path.getsize(image)
+        destination = device
+        size = imageSize(image)
 
         data_callback.emit("Flashing now {} image".format(name))
 
         # umount the drive
-        getDataFromCLI("diskutil unmountDisk {}".format(destination))
+        subprocess.call([findTool("diskutil") or "/usr/sbin/diskutil", "unmountDisk", destination])
 
-        if dd and (python or streamer):
-            cmd = "{} {} {} | {} of={}".format(streamer, image, logfile, dd, destination)
+        if python or self.bundle:
+            cmd = " ".join(shlex.quote(arg) for arg in self.writerCmd(image, destination, python) + ["--progress", fifo])
             logging.debug("Basic cmd line is:\n{}".format(cmd))
 
-            # pack the cmd in the long sentence to ask for permissions
-            realcmd = "osascript -e 'do shell script \"{}\" with administrator privileges'".format(cmd)
+            # pack the cmd in the long sentence to ask for permissions, no
+            # shell in the middle, just a AppleScript string
+            script = 'do shell script "{}" with administrator privileges'.format(cmd.replace("\\", "\\\\").replace('"', '\\"'))
+            realcmd = [findTool("osascript") or "/usr/bin/osascript", "-e", script]
             print("Full command is like this:\n")
             print(realcmd)
 
             try:
-                p = subprocess.Popen(realcmd, shell=True)
-                flash_start = time.time()
-
-                #  open the log file
-                lf = open(logfile, 'r')
+                p = subprocess.Popen(realcmd)
+
+                # non blocking read, the writer may never open it (auth canceled)
+                fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+
+                def fifoLines():
+                    '''Yield the lines from the fifo until the writer ends'''
+
+                    pending = ""
+                    while True:
+                        try:
+                            chunk = os.read(fd, 4096).decode()
+                        except BlockingIOError:
+                            chunk = ""
+
+                        if chunk:
+                            pending += chunk
+                            *lines, pending = pending.split("\n")
+                            for l in lines:
+                                yield l
+                        elif p.poll() is not None:
+                            break
+                        else:
+                            time.sleep(0.1)
 
-                while p.poll() is None:
-                    #  capturing progress via a file
-                    l = lf.readline().strip("\n")
-                    if len(l) != 0:
-                        # get time
-                        now_time = time.time()
-
-                        # check for errors
-                        if l.startswith("ERROR"):
-                            print("Error detected:\n{}".format(l))
-                            return False
-
-                        if "%" in l:
-                            # we are on:
-                            pr = float(l.strip()[:-1])
-                            if pr > 0:
-                                (speed, eta) = calc_speed_eta(size, pr, flash_start, now_time)
-                                progress_callback.emit(pr, "Flashing {}: {}%, {}, {} left".format(name, pr, speed, eta))
-
-                #  close the log file
-                if lf:
-                    lf.close()
+                ok = self.followFlashProgress(fifoLines(), name, size, progress_callback, self.jobStage("flash " + device))
+                p.wait()
+                os.close(fd)
+                os.unlink(fifo)
 
                 logging.debug("Return Code was {}".format(p.returncode))
 
                 # check for return code
-                if p.returncode == 0:
-                    # All ok, pop the image from the list
+                if ok and p.returncode == 0:
                     return "Done"
                 else:
                     # different code
-                    # TODO capture an error
                     return "Oops!"
 
             except OSError as e:
@@ -1696,13 +2174,17 @@ To flash the next image just follow these steps:
         else:
             logging.debug("Error getting one of the dependencies")
 
+            # probe again next time, the user may install it meanwhile
+            invalidateTools()
+
             # user warning
             self.uiWarning.emit("Ops!", "There was an utility missing in your system!")
 
     def loadPrevious(self):
         '''WARNING legacy procedure, will be removed in future versions, deprecated in favor of
         the use of configparser and a config file; now returns the file and version as a tuple
-        or a (false, false)
+        or a (false, false); the persisted verification records (see
+        verification.py) are the replacement for the '.checked' file
 
         Original docstring follows
 
@@ -1777,32 +2259,15 @@ To flash the next image just follow these steps:
 
         logging.debug("===> Starting to check for updates")
 
-        # Preparing the check update thread
-        self.ckup = Worker(checkUpdates)
-        self.ckup.signals.data.connect(self.dummy)
-        self.ckup.signals.progress.connect(self.dummy)
-        self.ckup.signals.result.connect(self.checkUpdatesResult)
-        self.ckup.signals.error.connect(self.dummy)
-        self.ckup.signals.finished.connect(self.dummy)
-
-        #  start flashing thread
-        self.threadpool.start(self.ckup)
+        # a tiny request, it does not wait for the network resource
+        self.startJob("updates", checkUpdates, result=self.checkUpdatesResult)
 
     def updateSkybianURL(self):
         '''Fetch the information about the lastest testnet/mainnet version
         of Skybian from the internet
         '''
 
-        # Preparing the check update thread
-        self.updl = Worker(getLatestSkybian)
-        self.updl.signals.data.connect(self.dummy)
-        self.updl.signals.progress.connect(self.dummy)
-        self.updl.signals.result.connect(self.skybianUrlResult)
-        self.updl.signals.error.connect(self.dummy)
-        self.updl.signals.finished.connect(self.dummy)
-
-        #  start flashing thread
-        self.threadpool.start(self.updl)
+        self.startJob("skybian url", getLatestSkybian, result=self.skybianUrlResult)
 
     @pyqtSlot(bool)
     def defaultNetwork(self, status):
@@ -1883,6 +2348,9 @@ To flash the next image just follow these steps:
             self.config.read(self.config_file)
             logging.debug("Config File loaded, parsing...")
 
+            # the metrics & exporter follows the config loaded
+            self.metricsSetup()
+
             # validate some of the config items
             if self.config['MAIN']['setup'] == 'no':
                 # first run, don't load anything
@@ -1920,10 +2388,21 @@ To flash the next image just follow these steps:
                     self.skybianFileVersion = self.config['SKYBIAN']['version']
 
                     self.extractionOK = True
-                    self.setStatus.emit("Using local file: {}".format(shortenPath(self.skybianFile, -1)))
-                    self.dData.emit("Using: {}".format(shortenPath(self.skybianFile, -1)))
-                    self.netConfig.emit()
-                    self.buildImages.emit()
+
+                    # changed since verified? hash it again before use
+                    (algorithm, digest) = self.getVerifications().digestOf(skybian_file)
+                    if algorithm is not None and self.getVerifications().get(skybian_file) is None:
+                        logging.debug("Skybian file changed since it was verified, checking it again")
+                        self.digestAlgorithm = algorithm
+                        self.digest = digest
+                        self.digests = {algorithm: digest}
+                        self.setStatus.emit("Skybian file changed since it was verified, checking it again")
+                        self.verifySkybian()
+                    else:
+                        self.setStatus.emit("Using local file: {}".format(shortenPath(self.skybianFile, -1)))
+                        self.dData.emit("Using: {}".format(shortenPath(self.skybianFile, -1)))
+                        self.netConfig.emit()
+                        self.buildImages.emit()
 
                 else:
                     # Verified but the file is not present... ?
@@ -2024,12 +2503,13 @@ To flash the next image just follow these steps:
             # now load it
             self.config.read(self.config_file)
             logging.debug("Mangled config file detected, resetting it and loading defaults")
+            self.metricsSetup()
 
             # erase old/previous (now orphaned) images from the default dir
             logging.debug("As we are resetting we need to also erase the now orphaned images on this system")
             flist = os.listdir(self.localPathBuild)
             for f in flist:
-                if ".img" in f:
+                if ".img" in f or isVirtualImage(f) or isManifest(f):
                     item = os.path.join(self.localPathBuild, f)
                     if os.path.isfile(item):
                         os.unlink(item)
@@ -2057,6 +2537,53 @@ To flash the next image just follow these steps:
                             'count' : '2',
                             }
 
+        conf['DOWNLOAD'] = {
+                            'streaming' : 'yes',
+                            'keep_archive' : 'no',
+                            'segments' : '1',
+                            }
+
+        conf['CACHE'] = {
+                            'enabled' : 'yes',
+                            'budget' : str(cacheDefaultBudget // (1024 * 1024)),
+                            'entries' : str(cacheDefaultEntries),
+                            }
+
+        conf['VERIFY'] = {
+                            'workers' : '0',
+                            }
+
+        conf['BUILD'] = {
+                            'mode' : 'clone',
+                            }
+
+        conf['FLASH'] = {
+                            'parallel' : '2',
+                            'blocksize' : '4194304',
+                            'buffers' : '4',
+                            'direct' : 'no',
+                            'skipzero' : 'no',
+                            'discard' : 'no',
+                            'allowstale' : 'no',
+                            'verify' : 'none',
+                            'sample' : '5',
+                            }
+
+        conf['JOBS'] = {
+                            'network' : str(jobDefaultLimits['network']),
+                            'disk' : str(jobDefaultLimits['disk']),
+                            }
+
+        conf['METRICS'] = {
+                            'enabled' : 'yes',
+                            }
+
+        conf['EXPORTER'] = {
+                            'textfile' : '',
+                            'address' : exporterAddress,
+                            'port' : '0',
+                            }
+
         conf['IMAGES'] = {
                             'generated' : 'no',
                             'image0' : ''
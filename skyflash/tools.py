@@ -0,0 +1,124 @@
+# part of skyflash
+# registry of the external tools and OS capabilities we depend on, probed once
+
+import os
+import shutil
+import logging
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# resolved tools and probed capabilities, see invalidateTools()
+toolPaths = {}
+capabilityCache = {}
+registryLock = threading.Lock()
+
+def findTool(name):
+    '''Return the full path of a tool on the PATH or False if it's not
+    there, the result is memoized'''
+
+    with registryLock:
+        if name not in toolPaths:
+            toolPaths[name] = shutil.which(name) or False
+            logging.debug("Tool {} resolved to {}".format(name, toolPaths[name]))
+
+        return toolPaths[name]
+
+def invalidateTools():
+    '''Forget the resolved tools and capabilities, they will be probed again
+    on the next use (the user installed something, a new folder is used...)'''
+
+    with registryLock:
+        toolPaths.clear()
+        capabilityCache.clear()
+
+def probeDirect(folder):
+    '''Return True if a file on folder can be opened with O_DIRECT'''
+
+    if not hasattr(os, "O_DIRECT"):
+        return False
+
+    fd, path = tempfile.mkstemp(dir=folder, prefix=".skyflash-probe-")
+    os.close(fd)
+    try:
+        os.close(os.open(path, os.O_WRONLY | os.O_DIRECT))
+        return True
+    except OSError:
+        return False
+    finally:
+        os.unlink(path)
+
+def probeCopyRange(folder):
+    '''Return True if os.copy_file_range works between files on folder'''
+
+    if not hasattr(os, "copy_file_range"):
+        return False
+
+    with tempfile.TemporaryFile(dir=folder) as src, tempfile.TemporaryFile(dir=folder) as dst:
+        src.write(b"skyflash")
+        src.flush()
+        try:
+            return os.copy_file_range(src.fileno(), dst.fileno(), 8, 0, 0) == 8
+        except OSError:
+            return False
+
+def probeReflink(folder):
+    '''Return True if the filesystem of folder can clone files (FICLONE)'''
+
+    if fcntl is None:
+        return False
+
+    # avoid a import loop, imaging is a sibling module
+    from skyflash.imaging import FICLONE
+
+    with tempfile.TemporaryFile(dir=folder) as src, tempfile.TemporaryFile(dir=folder) as dst:
+        src.write(b"skyflash")
+        src.flush()
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError:
+            return False
+
+def capabilities(folder=None):
+    '''The capabilities of the system (and of the filesystem of folder if
+    given) to pick the fastest way to build and flash, a dict like this:
+
+        {'pkexec': True, 'python3': True, 'direct': True,
+         'copy_file_range': True, 'reflink': False}
+
+    The result is memoized by folder
+    '''
+
+    key = os.path.abspath(folder) if folder else None
+    with registryLock:
+        if key in capabilityCache:
+            return dict(capabilityCache[key])
+
+    caps = {
+        'pkexec': bool(findTool("pkexec")),
+        'python3': bool(findTool("python3")),
+        'direct': hasattr(os, "O_DIRECT"),
+        'copy_file_range': hasattr(os, "copy_file_range"),
+        'reflink': fcntl is not None,
+    }
+
+    if key:
+        for (name, probe) in (('direct', probeDirect), ('copy_file_range', probeCopyRange), ('reflink', probeReflink)):
+            if caps[name]:
+                try:
+                    caps[name] = probe(key)
+                except OSError as e:
+                    logging.debug("Can't probe {} on {}: {}".format(name, key, e))
+                    caps[name] = False
+
+    logging.debug("Capabilities for {}: {}".format(key, caps))
+
+    with registryLock:
+        capabilityCache[key] = caps
+
+    return dict(caps)
@@ -3,15 +3,17 @@
 
 import sys
 import os
-import io
 import enum
 import traceback
 import subprocess
-import json
 import ipaddress
 import requests
 from PyQt5.QtCore import QObject, pyqtSignal, QRunnable, pyqtSlot
 
+# local imports
+from skyflash.devices import removableDrives
+from skyflash.tools import findTool
+
 # import the windows libs only in linux
 try:
     import wmi
@@ -175,32 +177,6 @@ def validIP(iip):
     except ValueError as messg:
         return (False, str(messg))
 
-def getLinuxPath(soft):
-    '''Make use of getDataFromCLI
-       Return False if the soft is not in the system or the path string if true'''
-
-    output = getDataFromCLI("which {}".format(soft))
-
-    if not output:
-        return output
-    else:
-        return output.strip("\n")
-
-def getDataFromCLI(cmd):
-    '''Returns the data from a cmd line to run on linux
-       if data is empty returns false
-    '''
-
-    try:
-        output = subprocess.check_output(cmd, shell=True)
-    except subprocess.CalledProcessError:
-        return False
-
-    if output == '':
-        output = False
-
-    return bytes(output).decode()
-
 def setPath(dir):
     '''Pick the correct path for the current OS and create it if not there
     This is the path in with we will download, extract, create, etc.
@@ -282,41 +258,6 @@ def windowsDevices():
 
     return data
 
-def linuxMediaDevices():
-    ''' List the media devices in this linux box
-
-    Based on the info from the linux kernel, see the file disk.txt
-    on the kernel tree for details
--
-    Basically we are looking for major #8 (SCSI disks) or
-    major #179 (MMC block devices) each one has a particular
-    minor number handling, se disks.txt file mentioned earlier
-    '''
-
-    with open("/proc/partitions", "r") as f:
-        devices = []
-
-        for line in f.readlines()[1:]:
-            words = [ word.strip() for word in line.split() ]
-            if len(words) > 3: 
-                major_number = int(words[0])
-                minor_number = int(words[1])
-                device_name = words[3]
-
-                # SCSI disks (Mainly USB or scsi ones)
-                if (major_number == 8) and not (minor_number % 16):
-                    devices.append("/dev/" + device_name)
-
-                # MMC block devices (Mainly SPI or PCI internal cards)
-                if (major_number == 179) and not (minor_number % 8):
-                    devices.append("/dev/" + device_name)
-
-        # data return
-        return devices
-
-    # default return if devices are not found
-    return False
-
 def getMacDriveInfo():
     '''Get drives info in MacOS
 
@@ -333,8 +274,8 @@ def getMacDriveInfo():
     import plistlib
 
     # get the info
-    cmd = ("diskutil list -plist external")
-    rx = subprocess.check_output(cmd, shell=True)
+    cmd = [findTool("diskutil") or "/usr/sbin/diskutil", "list", "-plist", "external"]
+    rx = subprocess.check_output(cmd)
     d = plistlib.loads(rx)
 
     # usdcard and flash drive example
@@ -428,6 +369,9 @@ def getLinDrivesInfo():
     force the detection of any device with the mmcblk string on
     it's name to be sure
 
+    The data comes from sysfs & mountinfo directly, see removableDrives()
+    in devices.py
+
     if possible with a drive label and sizes on bytes, like this:
     [
         ('/dev/mmcblk0', '', 8388608),
@@ -436,41 +380,7 @@ def getLinDrivesInfo():
     ]
     '''
 
-    # get all media devices in the system
-    drives = linuxMediaDevices()
-
-    # if we detected a drive, gather the details via lsblk
-    if drives:
-        d = " ".join(drives)
-        js = getDataFromCLI("lsblk -Jpb {}".format(d))
-    else:
-        # TODO: warn the user
-        print("No drives found, detection procedure returned no drive")
-        return False
-
-    # is no usefull data exit
-    if js is False:
-        print("lsblk did not offered info about the drive requested, weird!")
-        return False
-
-    # usefull data beyond this point
-    finalDrives = []
-    data = json.loads(js)
-
-    # getting data, output format is: [(drive, "LABEL", total),]
-    for device in data['blockdevices']:
-        if (device['rm'] == '1') or ('mmcblk' in device['name']):
-            name = device['name']
-            cap = int(device['size'])
-            mounted = ""
-            for c in device['children']:
-                nn = 'No Label'
-                if c['mountpoint'] is not None:
-                    nn = c['mountpoint'].split("/")[-1]
-
-                mounted += "{}, ".format(nn)
-
-            finalDrives.append((name, mounted.strip(" ,"), cap))
+    finalDrives = removableDrives()
 
     # final test
     if len(finalDrives) > 0:
@@ -478,30 +388,6 @@ def getLinDrivesInfo():
     else:
         return False
 
-# fileio overide class to get progress on tarfile extraction
-class ProgressFileObject(io.FileIO):
-    '''Overide the fileio object to have a callback on progress'''
-
-    def __init__(self, path, *args, **kwargs):
-        self._total_size = os.path.getsize(path)
-
-        # callback will be a function passed on progressfn
-        if kwargs["progressfn"]:
-            self.progfn = kwargs["progressfn"]
-            # must remove the progressfn if present from the kwargs to make fileio happy
-            kwargs.pop("progressfn")
-
-        io.FileIO.__init__(self, path, *args, **kwargs)
-
-    def read(self, size):
-        '''Each time a chunk in read call the progress function if there'''
-        if self.progfn:
-            # must calc and call the progress callback function
-            progress = self.tell() / self._total_size
-            self.progfn(progress)
-
-        return io.FileIO.read(self, size)
-
 # signals class, to be used on threads; for all major tasks
 class WorkerSignals(QObject):
     '''This class defines the signals to be emmited by the different threaded
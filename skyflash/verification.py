@@ -0,0 +1,127 @@
+# part of skyflash
+# persisted verification results of images, to not hash an unchanged image twice
+
+import os
+import json
+import time
+import logging
+import threading
+
+# the version of the records file format
+recordsVersion = 1
+
+def statSignature(path):
+    '''The stat signature of a file: if any of this changes the file must be
+    verified again'''
+
+    st = os.stat(path)
+    return {
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'inode': st.st_ino,
+    }
+
+class VerificationRecords(object):
+    '''Verification results of images stored in a json file, keyed by the
+    absolute path of the image; each record has the stat signature of the
+    file (size, mtime_ns and inode) at the time of the verification, the
+    digest algorithm and digest used and the result
+
+    A record is valid only while the stat signature of the file is the same
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = {}
+
+        try:
+            with open(path, 'rt') as f:
+                data = json.load(f)
+            if data.get('version') == recordsVersion:
+                self.records = data.get('records', {})
+        except (OSError, ValueError):
+            # no records yet or a corrupt file, start over
+            pass
+
+    def save(self):
+        '''Write the records to disk atomically, call it with the lock held'''
+
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wt') as f:
+            json.dump({'version': recordsVersion, 'records': self.records}, f, indent=1, sort_keys=True)
+
+        os.replace(tmp, self.path)
+
+    def get(self, path):
+        '''Return the record of a file if it's still valid (the file has not
+        changed since it was verified) or None'''
+
+        key = os.path.abspath(path)
+        with self.lock:
+            record = self.records.get(key)
+
+        if record is None:
+            return None
+
+        try:
+            signature = statSignature(path)
+        except OSError:
+            return None
+
+        for field, value in signature.items():
+            if record.get(field) != value:
+                logging.debug("File {} changed since verified ({})".format(path, field))
+                return None
+
+        return dict(record)
+
+    def digestOf(self, path):
+        '''Return the (algorithm, digest) of the last verification of the
+        file, even if it changed since then, or (None, None)'''
+
+        with self.lock:
+            record = self.records.get(os.path.abspath(path))
+
+        if record is None:
+            return (None, None)
+
+        return (record['algorithm'], record['digest'])
+
+    def lookup(self, path, algorithm, digest):
+        '''Return the result of a previous verification of the file against
+        that digest (True or False) or None if the file must be hashed'''
+
+        record = self.get(path)
+        if record is None or record['algorithm'] != algorithm or record['digest'] != digest.lower():
+            return None
+
+        return record['result']
+
+    def record(self, path, algorithm, digest, result):
+        '''Store the result of the verification of a file'''
+
+        key = os.path.abspath(path)
+        record = statSignature(path)
+        record.update({
+            'algorithm': algorithm,
+            'digest': digest.lower(),
+            'result': bool(result),
+            'time': time.time(),
+        })
+
+        with self.lock:
+            self.records[key] = record
+            # forget the files that are gone
+            for gone in [k for k in self.records if not os.path.exists(k)]:
+                del self.records[gone]
+
+            self.save()
+
+    def forget(self, path):
+        '''Drop the record of a file, the next check will hash it'''
+
+        key = os.path.abspath(path)
+        with self.lock:
+            if self.records.pop(key, None) is not None:
+                self.save()
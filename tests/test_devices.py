@@ -0,0 +1,78 @@
+# part of skyflash
+# tests of the drives detection from sysfs on a fake tree
+
+import os
+
+# local imports
+from skyflash import devices
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wt') as f:
+        f.write(data + "\n")
+
+def addDisk(sysfs, name, major, removable, device, size=15523840, partitions=1):
+    '''A whole disk on the fake sysfs, device is the path of the parent
+    device below sys/devices (it tells USB from the rest)'''
+
+    sysdir = os.path.join(sysfs, "block", name)
+    write(os.path.join(sysdir, "dev"), "{}:0".format(major))
+    write(os.path.join(sysdir, "size"), str(size))
+    write(os.path.join(sysdir, "removable"), removable)
+
+    target = os.path.join(sysfs, "devices" + device, name)
+    write(os.path.join(target, "model"), "Test {}".format(name))
+    os.symlink(target, os.path.join(sysdir, "device"))
+
+    prefix = name + "p" if name[-1].isdigit() else name
+    for part in range(1, partitions + 1):
+        write(os.path.join(sysdir, "{}{}".format(prefix, part), "partition"), str(part))
+        write(os.path.join(sysdir, "{}{}".format(prefix, part), "dev"), "{}:{}".format(major, part))
+
+def fakeSystem(folder):
+    '''A card reader with a card (sdb), a internal mmc card (mmcblk0, not
+    flagged as removable), a fixed USB disk (sdc), a nvme disk, an empty
+    reader (sdd) and a ram disk; the card first partition is mounted'''
+
+    sysfs = str(folder.joinpath("sys"))
+    mountinfo = str(folder.joinpath("mountinfo"))
+
+    addDisk(sysfs, "sdb", 8, "1", "/pci0000:00/usb1/1-1/1-1:1.0/host6/target6:0:0/6:0:0:0", partitions=2)
+    addDisk(sysfs, "mmcblk0", 179, "0", "/platform/mmc_host/mmc0/mmc0:aaaa")
+    addDisk(sysfs, "sdc", 9, "0", "/pci0000:00/usb2/2-3/2-3:1.0/host7/target7:0:0/7:0:0:0")
+    addDisk(sysfs, "nvme0n1", 259, "0", "/pci0000:00/0000:00:1d.0/nvme/nvme0")
+    addDisk(sysfs, "sdd", 10, "1", "/pci0000:00/usb1/1-2/1-2:1.0/host8/target8:0:0/8:0:0:0", size=0)
+    write(os.path.join(sysfs, "block", "ram0", "dev"), "1:0")
+
+    with open(mountinfo, 'wt') as f:
+        f.write("30 1 259:1 / / rw - ext4 /dev/nvme0n1p1 rw\n")
+        f.write("40 1 8:1 / /media/user/my\\040boot rw - vfat /dev/sdb1 rw\n")
+
+    return (sysfs, mountinfo)
+
+def test_blockDevices(tmp_path):
+    sysfs, mountinfo = fakeSystem(tmp_path)
+    found = {d['name']: d for d in devices.blockDevices(sysfs, mountinfo)}
+
+    # the ram disk is ignored
+    assert sorted(found) == ["/dev/mmcblk0", "/dev/nvme0n1", "/dev/sdb", "/dev/sdc", "/dev/sdd"]
+
+    sdb = found["/dev/sdb"]
+    assert sdb['removable'] and sdb['usb']
+    assert sdb['size'] == 15523840 * 512
+    assert sdb['partitions'] == ["8:1", "8:2"]
+    assert sdb['mounts'] == {"8:1": ["/media/user/my boot"]}
+
+    assert found["/dev/sdc"]['usb'] and not found["/dev/sdc"]['removable']
+    assert not found["/dev/mmcblk0"]['usb']
+    assert found["/dev/nvme0n1"]['mounts'] == {"259:1": ["/"]}
+
+def test_removableDrives(tmp_path):
+    sysfs, mountinfo = fakeSystem(tmp_path)
+    drives = devices.removableDrives(sysfs, mountinfo)
+
+    # no fixed USB disk, no nvme and no empty reader
+    assert drives == [
+        ("/dev/mmcblk0", "No Label", 15523840 * 512),
+        ("/dev/sdb", "my boot, No Label", 15523840 * 512),
+    ]
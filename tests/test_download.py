@@ -0,0 +1,136 @@
+# part of skyflash
+# tests of the resumable downloads against a local HTTP server
+
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+# local imports
+from skyflash.download import ResumableDownload, DownloadCanceled, streamChunkSize
+
+# a bit more than 3 chunks, not a multiple of anything
+payload = bytes(range(256)) * (3 * streamChunkSize // 256) + b"tail" * 1000
+
+class Handler(BaseHTTPRequestHandler):
+    '''Serve the payload with Range support, or as a plain stream with no
+    size if the server is on the noLength mode; the ranges asked are saved'''
+
+    def headers200(self):
+        self.send_response(200)
+        if not self.server.noLength:
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", '"skybian"')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.headers200()
+
+    def do_GET(self):
+        asked = self.headers.get("Range")
+        self.server.ranges.append(asked)
+
+        if asked is None or self.server.noLength:
+            self.headers200()
+            self.wfile.write(payload)
+            return
+
+        start, end = asked[len("bytes="):].split("-")
+        start = int(start)
+        end = int(end) + 1 if end else len(payload)
+
+        self.send_response(206)
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end - 1, len(payload)))
+        self.send_header("ETag", '"skybian"')
+        self.end_headers()
+        self.wfile.write(payload[start:end])
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.noLength = False
+    server.ranges = []
+    server.url = "http://127.0.0.1:{}/Skybian.tar.xz".format(server.server_address[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+def readFile(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_segmented(server, tmp_path):
+    path = str(tmp_path / "Skybian.tar.xz")
+    download = ResumableDownload(server.url, path, segments=3)
+
+    assert download.probe() == len(payload)
+    assert download.download() == path
+    assert readFile(path) == payload
+
+    # one range per segment, no part files left
+    assert len(server.ranges) == 3 and None not in server.ranges
+    assert not os.path.exists(download.part) and not os.path.exists(download.statePath)
+
+def test_cancelResume(server, tmp_path):
+    path = str(tmp_path / "Skybian.tar.xz")
+    download = ResumableDownload(server.url, path)
+    download.probe()
+
+    with pytest.raises(DownloadCanceled):
+        download.download(cancelfn=lambda: download.done >= streamChunkSize)
+
+    # the partial download is kept to resume it
+    assert os.path.exists(download.part) and os.path.exists(download.statePath)
+    assert not os.path.exists(path)
+
+    download = ResumableDownload(server.url, path)
+    download.probe()
+    assert download.done == streamChunkSize
+
+    download.download()
+    assert readFile(path) == payload
+    assert server.ranges == [None, "bytes={}-{}".format(streamChunkSize, len(payload) - 1)]
+
+def test_noContentLength(server, tmp_path):
+    server.noLength = True
+    path = str(tmp_path / "Skybian.tar.xz")
+    download = ResumableDownload(server.url, path, segments=4)
+
+    # no size, no ranges: one stream
+    assert download.probe() == -1
+    download.download()
+    assert readFile(path) == payload
+    assert server.ranges == [None]
+
+def test_readerResume(server, tmp_path):
+    path = str(tmp_path / "Skybian.tar.xz")
+    download = ResumableDownload(server.url, path)
+    download.probe()
+
+    reader = download.reader()
+    first = reader.read(streamChunkSize + 100)
+    reader.close()
+
+    # the data already read comes from the part file, the rest from the network
+    download = ResumableDownload(server.url, path)
+    download.probe()
+    assert download.done == streamChunkSize + 100
+
+    reader = download.reader()
+    data = reader.read()
+    reader.close()
+    download.finish()
+
+    assert first == payload[:streamChunkSize + 100]
+    assert data == payload
+    assert readFile(path) == payload
+    assert server.ranges == [None, "bytes={}-".format(streamChunkSize + 100)]
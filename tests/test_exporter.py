@@ -0,0 +1,86 @@
+# part of skyflash
+# tests of the metrics exporter: the textfile and the HTTP endpoint
+
+import os
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+# local imports
+from skyflash.metrics import MetricsRecorder
+from skyflash.exporter import MetricsExporter, prometheusType, openMetricsType
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def feed(recorder, device):
+    '''The stages of a card: a build and a good flash'''
+
+    recorder.start("build", "rack-01", images=2).end()
+    stage = recorder.start("flash", device)
+    stage.add(4096)
+    stage.end()
+
+def test_textfile(tmp_path):
+    textfile = str(tmp_path / "skyflash.prom")
+    exporter = MetricsExporter()
+    exporter.configure(textfile)
+    recorder = MetricsRecorder()
+    recorder.addListener(exporter.observe)
+
+    # the events comes from many threads, each one rewrites the file
+    threads = [threading.Thread(target=feed, args=(recorder, "/dev/sd{}".format(c))) for c in "bcdefgh"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with open(textfile, 'rt') as f:
+        data = f.read()
+
+    assert data == exporter.render()
+    assert "skyflash_images_built_total 14\n" in data
+    assert 'skyflash_cards_flashed_total{outcome="ok"} 7\n' in data
+    assert 'skyflash_bytes_written_total{device="/dev/sdh"} 4096\n' in data
+
+    # no temp files left behind, readable by the collector
+    assert os.listdir(str(tmp_path)) == ["skyflash.prom"]
+    assert os.stat(textfile).st_mode & 0o777 == 0o644
+
+def test_endpoint():
+    port = freePort()
+    exporter = MetricsExporter()
+    exporter.configure(port=port)
+    recorder = MetricsRecorder()
+    recorder.addListener(exporter.observe)
+    feed(recorder, "/dev/sdb")
+
+    url = "http://127.0.0.1:{}/metrics".format(port)
+    try:
+        with urllib.request.urlopen(url, timeout=10) as r:
+            assert r.headers["Content-Type"] == prometheusType
+            data = r.read().decode()
+
+        assert data == exporter.render()
+        assert 'skyflash_stages_total{stage="flash",outcome="ok"} 1\n' in data
+        assert not data.endswith("# EOF\n")
+
+        request = urllib.request.Request(url, headers={"Accept": "application/openmetrics-text; version=1.0.0"})
+        with urllib.request.urlopen(request, timeout=10) as r:
+            assert r.headers["Content-Type"] == openMetricsType
+            data = r.read().decode()
+
+        assert data == exporter.render(True)
+        assert "# TYPE skyflash_images_built counter\n" in data
+        assert data.endswith("# EOF\n")
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen("http://127.0.0.1:{}/other".format(port), timeout=10)
+        assert error.value.code == 404
+    finally:
+        exporter.stop()
@@ -0,0 +1,124 @@
+# part of skyflash
+# tests of the posix writer (posix-build/pydd.py) on file backed fake devices
+
+import os
+import sys
+import subprocess
+
+# the writer is a script, not part of the package
+writerFolder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "posix-build")
+sys.path.insert(0, writerFolder)
+
+import pydd
+
+# local imports
+from skyflash.imaging import writeVirtualImage
+
+blockSize = 64 * 1024
+imageSize = 16 * blockSize
+
+# the data parts of the test image, the rest are holes
+dataParts = ((0, b"\x11"), (3 * blockSize + 100, b"\x22"), (9 * blockSize, b"\x33"))
+
+def makeImage(path):
+    '''A sparse image with a few data blocks'''
+
+    with open(path, 'wb') as f:
+        for (offset, fill) in dataParts:
+            f.seek(offset)
+            f.write(fill * blockSize)
+        f.truncate(imageSize)
+
+    return path
+
+def makeDevice(path, fill=b"\0"):
+    '''A fake device of the image size, full of fill (stale data if not zeros)'''
+
+    with open(path, 'wb') as f:
+        f.write(fill * imageSize)
+
+    return path
+
+def readFile(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def runWriter(*args):
+    '''Run the writer script, return the exit code and the output lines'''
+
+    p = subprocess.run([sys.executable, os.path.join(writerFolder, "pydd.py"), "-b", str(blockSize)] + list(args),
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return (p.returncode, p.stdout.splitlines())
+
+def test_flashVerify(tmp_path):
+    image = makeImage(str(tmp_path / "image.img"))
+    device = makeDevice(str(tmp_path / "card"), b"\xaa")
+
+    code, lines = runWriter(image, device, "-v", "full")
+    assert code == 0
+    assert "100.0%" in lines and lines[-2] == "VERIFY 100.0%"
+    assert lines[-1].startswith("VERIFIED full ")
+    assert readFile(device) == readFile(image)
+
+def test_flashVirtualImage(tmp_path):
+    base = makeImage(str(tmp_path / "base.img"))
+    vimg = str(tmp_path / "node.vimg")
+    writeVirtualImage(vimg, base, 5 * blockSize + 10, b"IP=192.168.0.2")
+    device = makeDevice(str(tmp_path / "card"))
+
+    code, lines = runWriter(vimg, device, "-v", "full")
+    assert code == 0
+    assert lines[-1].startswith("VERIFIED full ")
+
+    data = readFile(base)
+    expected = data[:5 * blockSize + 10] + b"IP=192.168.0.2" + data[5 * blockSize + 24:]
+    assert readFile(device) == expected
+
+def test_skipZeroNeedsDiscardOrAllowStale(tmp_path):
+    image = makeImage(str(tmp_path / "image.img"))
+    device = makeDevice(str(tmp_path / "card"), b"\xaa")
+
+    code, lines = runWriter(image, device, "-z")
+    assert code == 1
+    assert lines[-1].startswith("ERROR: --skip-zero leaves stale data")
+
+    # a file can't discard, it's an error without --allow-stale
+    code, lines = runWriter(image, device, "-z", "--discard")
+    assert code == 1
+    assert "does not support discard" in lines[-1]
+    assert readFile(device) == b"\xaa" * imageSize
+
+def test_skipZeroAllowStale(tmp_path):
+    image = makeImage(str(tmp_path / "image.img"))
+    device = makeDevice(str(tmp_path / "card"), b"\xaa")
+
+    code, lines = runWriter(image, device, "-z", "--discard", "--allow-stale", "-v", "full")
+    assert code == 0
+    assert lines[0].startswith("WARNING: the device does not support discard")
+    assert lines[-1].startswith("VERIFIED full ") and lines[-1].endswith(", written blocks only")
+
+    # the data blocks are written, the holes keep the stale data
+    device = readFile(device)
+    for (offset, fill) in dataParts:
+        assert device[offset:offset + blockSize] == fill * blockSize
+    assert device[imageSize - blockSize:] == b"\xaa" * blockSize
+
+def test_skipZeroVerifiesTheHoles(tmp_path):
+    image = makeImage(str(tmp_path / "image.img"))
+    clean = makeDevice(str(tmp_path / "clean"))
+    stale = makeDevice(str(tmp_path / "stale"), b"\xaa")
+
+    for (device, good) in ((clean, True), (stale, False)):
+        digests = []
+        pydd.flash(image, device, blockSize, False, sys.stdout, skipZero=True, digests=digests)
+
+        # the blocks written plus the skipped ranges cover the whole image
+        assert sum(count for (offset, count, digest) in digests) == imageSize
+
+        bad, readed, elapsed = pydd.verify(device, digests, blockSize, sys.stdout)
+        if good:
+            assert bad is None
+            assert readFile(device) == readFile(image)
+        else:
+            # the first hole, after the first data block
+            assert bad == blockSize
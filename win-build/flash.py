@@ -3,9 +3,14 @@
 # argument parser
 import argparse
 parser = argparse.ArgumentParser()
-parser.add_argument("file", help="The full path to the file you want to flash")
+parser.add_argument("file", help="The full path to the file you want to flash, it can be a virtual image (.vimg)")
 parser.add_argument("drive", help="The drive name you will to write to, like F: (case is not relevant)")
 parser.add_argument("logfile", help="The file to log the activity")
+parser.add_argument("-n", "--buffers", type=int, default=4, help="Number of buffers in the read/write ring, default 4")
+parser.add_argument("-s", "--buffer-size", type=int, default=4*1024*1024, help="Size of each buffer in bytes, default 4MB")
+parser.add_argument("-v", "--verify", choices=["none", "sample", "full"], default="none", help="Read back the drive after the write and check it: all the blocks or a sample of them, default none")
+parser.add_argument("--sample", type=float, default=5, help="Percent of the blocks to check on the sample verification, default 5")
+parser.add_argument("-m", "--manifest", help="Verify against the chunks of this image manifest instead of hashing the blocks while writing")
 args = parser.parse_args()
 
 # advice
@@ -13,9 +18,15 @@ print("Flashing {} to drive {}".format(args.file, args.drive))
 
 import sys
 import os
+import time
 import subprocess
 import csv
 
+# the data path shared with the posix writers (image reads, virtual images,
+# buffers ring & verification), PyInstaller bundles it from there too
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "posix-build"))
+from streamio import openImage, BufferRing, blockDigest, manifestBlocks, pickBlocks
+
 try:
     import win32file
     import wmi
@@ -154,9 +165,9 @@ logfile = args.logfile
 # get the removable drive data
 data = windowsDevices()
 
-# test if the file exist
+# test if the file exist, and open it (plain or virtual image)
 try:
-    fsize = os.path.getsize(image)
+    inputFile, fsize = openImage(image)
 except FileNotFoundError:
     print("ERROR: File '{}' not found, please check that.".format(args.file))
     sys.exit()
@@ -179,50 +190,78 @@ if fsize > dsize:
 # Receive the paths to the physical device device and logical volume and return a handler to each one
 hDevice, hVolumes = lockWinDevice(physicalDevice, volumeGUID)
 
-# Open the Skybian file using a PyHANDLE (a wrapper to a standard Win32 HANDLE)
-inputFileHandle = CreateFile(image, w32GenericRead, 0, None, w32OpenExisting, 0, None)
-
 # windows needs a write chunk to be multiple of the sector size, aka 512 bytes
 sectorSize = 512
-portionSize = sectorSize * 1000 # 1/2 MB chunks
 actualPosition = 0
 
+# the reads are done in a thread filling a ring of buffers, so the device
+# always has a chunk ready to be written
+ring = BufferRing(inputFile, args.buffers, args.buffer_size)
+
+# digests of the blocks for the read back verification: from the manifest
+# or taken while writing
+digests = []
+digestfn = blockDigest
+if args.verify != "none" and args.manifest:
+    (digests, digestfn) = manifestBlocks(args.manifest, fsize)
+
 # build node loop
-while actualPosition < fsize:
-    errorCode, data = ReadFile(inputFileHandle, portionSize)
-
-    # returned error code
-    if errorCode != 0: 
-        print("ERROR: Read from image file failed!")
-        sys.exit()
-    
-    # avoid writes with no sectorsize length
-    if  len(data) != portionSize:
-        # final part, fill with zeroes until 512 multiple
-        diff = len(data) % sectorSize
-        data += bytearray(sectorSize - diff)
-    
-    # actual write
-    errorCode, ws = WriteFile(hDevice, data)
-
-    # returned error code and data size
-    if errorCode != 0: 
-        print("ERROR: Write to device failed!")
-        sys.exit()
-    
-    # check writted data length
-    if ws != len(data):
-        print("ERROR: Write data != from read data!")
-        sys.exit()
-    
-    # progress and cycle update
-    actualPosition += portionSize
-    per = actualPosition / fsize
-    if per > 100:
-        per = 100.0
-
-    lf.write("{:.1%}\n".format(per))
+try:
+    for data in ring:
+        # avoid writes with no sectorsize length
+        count = len(data)
+        if count % sectorSize:
+            # final part, fill with zeroes until 512 multiple
+            data = bytes(data) + bytes(sectorSize - count % sectorSize)
+
+        # actual write
+        errorCode, ws = WriteFile(hDevice, data)
+
+        # returned error code and data size
+        if errorCode != 0: 
+            print("ERROR: Write to device failed!")
+            sys.exit()
+
+        # check writted data length
+        if ws != len(data):
+            print("ERROR: Write data != from read data!")
+            sys.exit()
+
+        if args.verify != "none" and not args.manifest:
+            digests.append((actualPosition, len(data), blockDigest(data)))
+
+        # progress and cycle update
+        actualPosition += count
+        per = actualPosition / fsize
+
+        lf.write("{:.1%}\n".format(per))
+except OSError:
+    print("ERROR: Read from image file failed!")
+    sys.exit()
+finally:
+    ring.close()
+
+# read back the drive and check the blocks written, raw disk handles are not
+# cached by windows so we read what's on the card
+if args.verify != "none":
+    picked = pickBlocks(digests, args.verify, args.sample)
+    start = time.time()
+    readed = 0
+    for (index, (offset, count, digest)) in enumerate(picked):
+        # raw reads must be sector aligned too
+        win32file.SetFilePointer(hDevice, offset, win32file.FILE_BEGIN)
+        errorCode, data = ReadFile(hDevice, count + (-count % sectorSize))
+        if errorCode != 0 or digestfn(data[:count]) != digest:
+            lf.write("ERROR: Verification failed, the block at offset {} differs from the image\n".format(offset))
+            sys.exit(1)
+
+        readed += count
+        lf.write("VERIFY {:.1%}\n".format((index + 1) / len(picked)))
+
+    elapsed = time.time() - start
+    speed = readed / elapsed / 1000 / 1000 if elapsed else 0
+    lf.write("VERIFIED {} {:0.1f} MB at {:0.1f} MB/s\n".format(args.verify, readed / 1000 / 1000, speed))
 
 # close input and output file handles
-CloseHandle(inputFileHandle)
+inputFile.close()
 CloseHandle(hDevice)
@@ -1,9 +1,14 @@
 # -*- mode: python -*-
 
+import os
+
 block_cipher = None
 
 
+# the data path module shared with the posix writers, see posix-build/streamio.py,
+# and the skyflash package it uses (one folder up)
 a = Analysis(['flash.py'],
+             pathex=[os.path.join(SPECPATH, '..', 'posix-build'), os.path.join(SPECPATH, '..')],
              binaries=[],
              datas=[],
              hiddenimports=[],